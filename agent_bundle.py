@@ -0,0 +1,284 @@
+"""Self-contained bundle of the on-instance agent and its pinned dependencies.
+
+The bundle is a compressed zipapp. On its first start it unpacks itself into a cache directory, because
+botocore reads its service models from the file system, and then runs the agent (or, with `serve`, the
+latency echo responder) from there. Instances download it from a presigned S3 URL instead of installing
+pip, boto3 and a clone of the repository on every boot. The bundle also carries the iperf3 packages, which
+instances install with `dpkg -i` instead of running `apt-get update` and `apt-get install` on every boot.
+
+    python agent_bundle.py build      # -> dist/agent.pyz
+    python agent_bundle.py measure    # build time, size and cold/warm start of the bundle
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess  # nosec (remove bandit warning)
+import sys
+import tempfile
+import time
+import urllib.request
+import zipapp
+from typing import Any, Dict, Optional
+
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+BUNDLE_PATH = os.path.join('dist', 'agent.pyz')
+BUNDLE_URL_PATH = os.path.join('dist', 'agent-bundle.json')
+REQUIREMENTS_PATH = os.path.join(ROOT_DIR, 'agent-requirements.txt')
+# Module of the bundle -> file of the repository
+AGENT_MODULES = {
+    'agent.py': 'user-data.py',
+    'agent_clients.py': 'agent_clients.py',
+    'bandwidth.py': 'bandwidth.py',
+    'instrumentation.py': 'instrumentation.py',
+    'latency_probe.py': 'latency_probe.py',
+    'run_progress.py': 'run_progress.py',
+    'sampling.py': 'sampling.py',
+}
+# botocore and boto3 ship models of every AWS service; the agent only talks to these
+AGENT_SERVICES = ('dynamodb', 'sqs')
+# The instances run Ubuntu 22.04
+TARGET_PYTHON_VERSION = '3.10'
+# iperf3 and the libraries it needs that the Ubuntu 22.04 AMIs lack; the release pocket's versions are
+# pinned because its files are never removed from the archive
+UBUNTU_ARCHIVE_URL = 'http://archive.ubuntu.com/ubuntu/pool'
+AGENT_DEBS = (
+    'universe/i/iperf3/iperf3_3.9-1_amd64.deb',
+    'universe/i/iperf3/libiperf0_3.9-1_amd64.deb',
+    'main/l/lksctp-tools/libsctp1_1.0.19+dfsg-1build1_amd64.deb',
+)
+DEBS_DIR = 'debs'
+# SigV4 presigned URLs are valid for at most 7 days; a URL with less than a day left is renewed
+PRESIGNED_URL_SECONDS = 7 * 24 * 60 * 60
+PRESIGNED_URL_RENEW_SECONDS = 24 * 60 * 60
+
+BOOTSTRAP = '''"""Entry point of the agent bundle."""
+
+import os
+import runpy
+import shutil
+import sys
+import zipfile
+
+BUNDLE_ID = '{bundle_id}'
+DEBS_DIR = '{debs_dir}'
+
+
+def unpack() -> str:
+    """Unpack the bundle once per bundle ID and return the directory it was unpacked to."""
+    archive = os.path.dirname(os.path.abspath(__file__))
+    cache_dir = os.environ.get('AGENT_CACHE_DIR', os.path.expanduser('~/.cache/latency-agent'))
+    target = os.path.join(cache_dir, BUNDLE_ID)
+    if not os.path.isdir(target):
+        tmp_target = f'{{target}}.{{os.getpid()}}.tmp'
+        with zipfile.ZipFile(archive) as bundle:
+            bundle.extractall(tmp_target)
+        try:
+            os.replace(tmp_target, target)
+        except OSError:
+            # The agent and the echo responder start together; another process unpacked the bundle first
+            if not os.path.isdir(target):
+                raise
+            shutil.rmtree(tmp_target, ignore_errors=True)
+
+    return target
+
+
+def extract_debs(directory: str) -> None:
+    """Extract the bundled packages into a directory, without unpacking the rest of the bundle."""
+    os.makedirs(directory, exist_ok=True)
+    with zipfile.ZipFile(os.path.dirname(os.path.abspath(__file__))) as bundle:
+        for member in bundle.namelist():
+            if member.startswith(f'{{DEBS_DIR}}/') and member.endswith('.deb'):
+                with bundle.open(member) as source, \
+                        open(os.path.join(directory, os.path.basename(member)), 'wb') as target:
+                    shutil.copyfileobj(source, target)
+
+
+if __name__ == '__main__':
+    command = sys.argv[1:2]
+    if command == ['debs']:
+        # Run as root at boot, before `dpkg -i`; the agent itself runs as another user
+        extract_debs(sys.argv[2])
+        sys.exit()
+
+    sys.path.insert(0, unpack())
+    if command == ['serve']:
+        runpy.run_module('latency_probe', run_name='__main__')
+    elif command == ['check']:
+        # Imports everything the agent needs without starting it
+        import agent_clients, bandwidth, instrumentation, latency_probe  # noqa: F401,E401
+    else:
+        runpy.run_module('agent', run_name='__main__')
+'''
+
+
+def install_requirements(target: str) -> None:
+    """Install the pinned dependencies for the instances' Python into `target`."""
+    subprocess.run([sys.executable, '-m', 'pip', 'install', '--quiet', '--no-compile',  # nosec (remove bandit warning)
+                    '--only-binary=:all:', '--python-version', TARGET_PYTHON_VERSION, '--implementation', 'py',
+                    '--target', target, '-r', REQUIREMENTS_PATH], check=True)
+
+
+def download_debs(target: str) -> None:
+    """Download the pinned packages that instances install at boot into `target`."""
+    os.makedirs(target, exist_ok=True)
+    for deb in AGENT_DEBS:
+        with urllib.request.urlopen(f'{UBUNTU_ARCHIVE_URL}/{deb}') as response:  # nosec (remove bandit warning)
+            with open(os.path.join(target, os.path.basename(deb)), 'wb') as deb_file:
+                shutil.copyfileobj(response, deb_file)
+
+
+def prune_service_models(target: str) -> None:
+    """Remove the models of every AWS service the agent does not use."""
+    for data_dir in (os.path.join(target, 'botocore', 'data'), os.path.join(target, 'boto3', 'data')):
+        for entry in os.listdir(data_dir):
+            if os.path.isdir(os.path.join(data_dir, entry)) and entry not in AGENT_SERVICES:
+                shutil.rmtree(os.path.join(data_dir, entry))
+
+
+def tree_digest(directory: str) -> str:
+    """Return a digest of every file's path and content below a directory."""
+    digest = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            digest.update(os.path.relpath(path, directory).encode())
+            with open(path, 'rb') as bundled_file:
+                digest.update(bundled_file.read())
+
+    return digest.hexdigest()
+
+
+def sources_digest() -> str:
+    """Return a digest of everything a bundle is built from: the agent's modules, its requirements, its
+    packages and the bootstrap."""
+    digest = hashlib.sha256(BOOTSTRAP.encode())
+    digest.update('\n'.join(AGENT_DEBS).encode())
+    for module, source in sorted(AGENT_MODULES.items()):
+        digest.update(module.encode())
+        with open(os.path.join(ROOT_DIR, source), 'rb') as source_file:
+            digest.update(source_file.read())
+    with open(REQUIREMENTS_PATH, 'rb') as requirements_file:
+        digest.update(requirements_file.read())
+
+    return digest.hexdigest()
+
+
+def sources_path(bundle_path: str) -> str:
+    """Return the path of the file that records which sources a bundle was built from."""
+    return f'{bundle_path}.sources'
+
+
+def build_bundle(output: str = BUNDLE_PATH) -> str:
+    """Build the agent bundle and return its path."""
+    digest = sources_digest()
+    with tempfile.TemporaryDirectory() as staging:
+        install_requirements(staging)
+        prune_service_models(staging)
+        download_debs(os.path.join(staging, DEBS_DIR))
+        for module, source in AGENT_MODULES.items():
+            shutil.copyfile(os.path.join(ROOT_DIR, source), os.path.join(staging, module))
+
+        with open(os.path.join(staging, '__main__.py'), 'w', encoding='utf-8') as bootstrap_file:
+            bootstrap_file.write(BOOTSTRAP.format(bundle_id=tree_digest(staging)[:16], debs_dir=DEBS_DIR))
+
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        zipapp.create_archive(staging, output, interpreter='/usr/bin/env python3', compressed=True)
+
+    with open(sources_path(output), 'w', encoding='utf-8') as sources_file:
+        sources_file.write(digest)
+
+    return output
+
+
+def is_bundle_current(bundle_path: str) -> bool:
+    """Return whether the bundle exists and was built from the current sources."""
+    try:
+        with open(sources_path(bundle_path), encoding='utf-8') as sources_file:
+            return os.path.isfile(bundle_path) and sources_file.read().strip() == sources_digest()
+    except FileNotFoundError:
+        return False
+
+
+def file_digest(path: str) -> str:
+    """Return the SHA-256 of a file."""
+    with open(path, 'rb') as bundle_file:
+        return hashlib.sha256(bundle_file.read()).hexdigest()
+
+
+def publish_bundle(bucket_name: str, bundle_path: str = BUNDLE_PATH, url_path: str = BUNDLE_URL_PATH,
+                   endpoint_url: Optional[str] = None) -> str:
+    """Upload the bundle (building it if it is missing or its sources changed) and return a presigned URL to
+    download it.
+
+    The URL ends up in every instance's user data, so it is reused for as long as the bundle and the bucket
+    are unchanged and it is not about to expire; a new URL would replace every instance.
+    """
+    if not is_bundle_current(bundle_path):
+        build_bundle(bundle_path)
+
+    digest = file_digest(bundle_path)
+    key = f'agent-{digest[:16]}.pyz'
+    try:
+        with open(url_path, encoding='utf-8') as url_file:
+            published: Dict[str, Any] = json.load(url_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        published = {}
+
+    if (published.get('bucket') == bucket_name and published.get('key') == key
+            and published.get('expires_at', 0) - time.time() > PRESIGNED_URL_RENEW_SECONDS):
+        return published['url']
+
+    import boto3
+
+    s3 = boto3.client('s3', region_name='us-east-1', endpoint_url=endpoint_url)
+    s3.upload_file(bundle_path, bucket_name, key)
+    url = s3.generate_presigned_url('get_object', Params={'Bucket': bucket_name, 'Key': key},
+                                    ExpiresIn=PRESIGNED_URL_SECONDS)
+
+    published = {'bucket': bucket_name, 'key': key, 'url': url, 'expires_at': time.time() + PRESIGNED_URL_SECONDS}
+    with open(url_path, 'w', encoding='utf-8') as url_file:
+        json.dump(published, url_file, indent=2)
+
+    return url
+
+
+def time_start(bundle_path: str, cache_dir: str) -> float:
+    """Return the time it takes the bundle to start and import all of the agent's modules, in seconds."""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, bundle_path, 'check'],  # nosec (remove bandit warning)
+                   env={**os.environ, 'AGENT_CACHE_DIR': cache_dir}, check=True)
+    return time.perf_counter() - start
+
+
+def measure(bundle_path: str = BUNDLE_PATH) -> None:
+    """Build the bundle and report its build time, size, and cold and warm start times."""
+    start = time.perf_counter()
+    build_bundle(bundle_path)
+    build_seconds = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cold_seconds = time_start(bundle_path, cache_dir)
+        warm_seconds = time_start(bundle_path, cache_dir)
+
+    sys.stdout.write(f'build:       {build_seconds:8.2f} s\n'
+                     f'size:        {os.path.getsize(bundle_path) / 2**20:8.2f} MiB\n'
+                     f'cold start:  {cold_seconds * 1000:8.0f} ms (unpacks the bundle)\n'
+                     f'warm start:  {warm_seconds * 1000:8.0f} ms\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build or measure the agent bundle.')
+    parser.add_argument('command', choices=['build', 'measure'])
+    parser.add_argument('--output', default=BUNDLE_PATH, help='path of the bundle')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        sys.stdout.write(f'Built {build_bundle(args.output)}.\n')
+    else:
+        measure(args.output)
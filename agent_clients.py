@@ -0,0 +1,135 @@
+"""Shared AWS clients and batched result writing for the on-instance agent."""
+
+import sys
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import boto3
+from botocore.config import Config
+
+import instrumentation
+
+
+CLIENT_CONFIG = Config(retries={'mode': 'adaptive', 'max_attempts': 10},
+                       max_pool_connections=10,
+                       tcp_keepalive=True)
+# DynamoDB accepts at most 25 items per BatchWriteItem call
+MAX_BATCH_ITEMS = 25
+MAX_UNPROCESSED_RETRIES = 8
+
+
+class AgentClients:
+    """One boto3 session whose clients are created once per service and region and then reused.
+
+    Clients keep their connections alive between calls and retry adaptively when throttled. Every API call
+    made through them is counted by operation name.
+    """
+
+    def __init__(self) -> None:
+        """Create the session."""
+        self.session = boto3.session.Session()
+        self.api_calls: Counter = Counter()
+        self._clients: Dict[Tuple[str, str], Any] = {}
+        self._resources: Dict[Tuple[str, str], Any] = {}
+
+    def _count_call(self, model: Any, **_: Any) -> None:
+        """Count an API call (botocore `before-call` event handler)."""
+        self.api_calls[model.name] += 1
+
+    def client(self, service: str, region_name: str) -> Any:
+        """Return the shared client for the given service and region."""
+        key = (service, region_name)
+        if key not in self._clients:
+            client = instrumentation.instrument_client(self.session.client(service, region_name=region_name,
+                                                                           config=CLIENT_CONFIG))
+            client.meta.events.register('before-call.*.*', self._count_call)
+            self._clients[key] = client
+
+        return self._clients[key]
+
+    def resource(self, service: str, region_name: str) -> Any:
+        """Return the shared resource for the given service and region."""
+        key = (service, region_name)
+        if key not in self._resources:
+            resource = self.session.resource(service, region_name=region_name, config=CLIENT_CONFIG)
+            instrumentation.instrument_client(resource.meta.client)
+            resource.meta.client.meta.events.register('before-call.*.*', self._count_call)
+            self._resources[key] = resource
+
+        return self._resources[key]
+
+
+class BatchResultWriter:
+    """Bounded buffer of DynamoDB items, flushed with BatchWriteItem.
+
+    The buffer is flushed when it holds `max_items` items, when its oldest item is older than
+    `max_age_seconds` as a new item is added, and on `close()`. Unprocessed items are retried with
+    exponential backoff. `before_flush` is called before buffered items are written, e.g. to flush the
+    results that they refer to first.
+    """
+
+    def __init__(self, clients: AgentClients, table_name: str, region_name: str = 'us-east-1',
+                 max_items: int = MAX_BATCH_ITEMS, max_age_seconds: float = 60.0,
+                 before_flush: Optional[Callable[[], None]] = None) -> None:
+        """Create an empty writer for the given table."""
+        self.dynamodb = clients.resource('dynamodb', region_name)
+        self.table_name = table_name
+        self.before_flush = before_flush
+        self.max_items = min(max_items, MAX_BATCH_ITEMS)
+        self.max_age_seconds = max_age_seconds
+        self._buffer: List[Dict[str, Any]] = []
+        self._oldest_at = 0.0
+        self.items_written = 0
+        self.batch_calls = 0
+        self.batch_seconds = 0.0
+
+    def add(self, item: Dict[str, Any]) -> None:
+        """Buffer an item, flushing if a size or time threshold is reached."""
+        if not self._buffer:
+            self._oldest_at = time.monotonic()
+        self._buffer.append(item)
+
+        if len(self._buffer) >= self.max_items or time.monotonic() - self._oldest_at >= self.max_age_seconds:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write all buffered items."""
+        if self._buffer and self.before_flush is not None:
+            self.before_flush()
+
+        while self._buffer:
+            batch, self._buffer = self._buffer[:self.max_items], self._buffer[self.max_items:]
+            self._write_batch(batch)
+
+    def _write_batch(self, batch: List[Dict[str, Any]]) -> None:
+        """Write one batch, retrying unprocessed items."""
+        request_items = {self.table_name: [{'PutRequest': {'Item': item}} for item in batch]}
+        for attempt in range(MAX_UNPROCESSED_RETRIES + 1):
+            start = time.monotonic()
+            response = self.dynamodb.batch_write_item(RequestItems=request_items)
+            self.batch_seconds += time.monotonic() - start
+            self.batch_calls += 1
+
+            request_items = response.get('UnprocessedItems') or {}
+            if not request_items:
+                self.items_written += len(batch)
+                return
+
+            if attempt < MAX_UNPROCESSED_RETRIES:
+                time.sleep(min(0.05 * 2 ** attempt, 5.0))
+
+        raise ValueError(f'{len(request_items[self.table_name])} items were left unprocessed in {self.table_name}.')
+
+    def report(self) -> str:
+        """Return how many calls and how much time batching saved compared to one put_item per item."""
+        seconds_per_call = self.batch_seconds / self.batch_calls if self.batch_calls else 0.0
+        saved_calls = self.items_written - self.batch_calls
+        return (f'Wrote {self.items_written} items in {self.batch_calls} BatchWriteItem calls '
+                f'({self.batch_seconds:.3f}s), saving {saved_calls} calls and about '
+                f'{saved_calls * seconds_per_call:.3f}s')
+
+    def close(self) -> None:
+        """Flush remaining items and log the savings."""
+        self.flush()
+        sys.stdout.write(self.report() + '\n')
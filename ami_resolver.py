@@ -0,0 +1,114 @@
+"""Resolution of the Ubuntu AMI of every region, cached per region."""
+
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+
+AMI_CACHE_PATH = 'amis.json'
+AMI_CACHE_VERSION = 1
+AMI_CACHE_TTL_SECONDS = 24 * 60 * 60
+# Canonical publishes the current AMI of every release in every region as a public SSM parameter
+UBUNTU_AMI_PARAMETER = '/aws/service/canonical/ubuntu/server/22.04/stable/current/amd64/hvm/ebs-gp2/ami-id'
+CANONICAL_OWNER_ID = '099720109477'
+UBUNTU_IMAGE_FILTERS = [
+    {'Name': 'name', 'Values': ['ubuntu/images/hvm-ssd/ubuntu-jammy-22.04-amd64-server-*']},
+    {'Name': 'architecture', 'Values': ['x86_64']},
+    {'Name': 'virtualization-type', 'Values': ['hvm']},
+    {'Name': 'root-device-type', 'Values': ['ebs']},
+    {'Name': 'state', 'Values': ['available']},
+]
+
+
+def latest_ubuntu_ami_from_parameter(regional_ssm_client: Any) -> str:
+    """Return the current Ubuntu 22.04 LTS AMI of a region from Canonical's public SSM parameter."""
+    return regional_ssm_client.get_parameter(Name=UBUNTU_AMI_PARAMETER)['Parameter']['Value']
+
+
+def latest_ubuntu_ami_from_images(regional_ec2_client: Any) -> str:
+    """Return the newest Ubuntu 22.04 LTS AMI of a region, filtering server-side as tightly as possible."""
+    newest: Optional[Dict[str, Any]] = None
+    paginator = regional_ec2_client.get_paginator('describe_images')
+    for page in paginator.paginate(Owners=[CANONICAL_OWNER_ID], Filters=UBUNTU_IMAGE_FILTERS):
+        for image in page['Images']:
+            if newest is None or image['CreationDate'] > newest['CreationDate']:
+                newest = image
+
+    if newest is None:
+        raise ValueError('No Ubuntu 22.04 LTS AMI found.')
+
+    return newest['ImageId']
+
+
+class AmiResolver:
+    """Resolves the Ubuntu AMI of regions, serving entries younger than `ttl_seconds` from `cache_path`.
+
+    The SSM parameter is tried first; `describe_images` is only used where it cannot be read.
+    """
+
+    def __init__(self, cache_path: Optional[str] = AMI_CACHE_PATH,
+                 ttl_seconds: float = AMI_CACHE_TTL_SECONDS) -> None:
+        """Create a resolver, loading its cache."""
+        self.cache_path = cache_path
+        self.ttl_seconds = ttl_seconds
+        self.lookups = 0
+        self._lock = threading.Lock()
+        self._cache = self._load_cache() if cache_path else {}
+
+    def _load_cache(self) -> Dict[str, Dict[str, Any]]:
+        """Load the on-disk cache, ignoring missing or outdated files."""
+        assert self.cache_path  # nosec (remove bandit warning)
+        try:
+            with open(self.cache_path, encoding='utf-8') as cache_file:
+                data = json.load(cache_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+        if data.get('version') != AMI_CACHE_VERSION:
+            return {}
+
+        return data['regions']
+
+    def save(self) -> None:
+        """Atomically write the cache to disk."""
+        if not self.cache_path:
+            return
+
+        with self._lock:
+            data = {'version': AMI_CACHE_VERSION, 'regions': dict(sorted(self._cache.items()))}
+
+        tmp_path = f'{self.cache_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as cache_file:
+            json.dump(data, cache_file, indent=2)
+        os.replace(tmp_path, self.cache_path)
+
+    def cached(self, region_name: str) -> Optional[str]:
+        """Return the cached AMI of a region, or None if there is no fresh entry."""
+        with self._lock:
+            entry = self._cache.get(region_name)
+
+        if entry is None or time.time() - entry['fetched_at'] > self.ttl_seconds:
+            return None
+
+        return entry['ami']
+
+    def resolve(self, region_name: str, regional_ssm_client: Any, regional_ec2_client: Any) -> str:
+        """Return the Ubuntu AMI of a region, looking it up only if the cache has no fresh entry."""
+        ami = self.cached(region_name)
+        if ami is not None:
+            return ami
+
+        from botocore.exceptions import ClientError
+
+        try:
+            ami = latest_ubuntu_ami_from_parameter(regional_ssm_client)
+        except ClientError:
+            ami = latest_ubuntu_ami_from_images(regional_ec2_client)
+
+        with self._lock:
+            self.lookups += 1
+            self._cache[region_name] = {'ami': ami, 'fetched_at': time.time()}
+
+        return ami
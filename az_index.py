@@ -0,0 +1,88 @@
+"""Index of availability zone names, IDs and regions."""
+
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+from synchronization import AwsRegion
+
+
+AZ_INDEX_PATH = 'az-index.json'
+AZ_INDEX_VERSION = 1
+
+
+class AzIndex:
+    """Maps AZ names to AZ IDs and AZ names to their regions.
+
+    AZ names are account-specific aliases of the AZ IDs, so both must come from the same
+    `describe_availability_zones` record. The results store numbers AZs itself, in first-seen order, so
+    that its rows stay valid when the topology changes.
+    """
+
+    def __init__(self, entries: List[Tuple[str, str, str]]) -> None:
+        """Create an index from (name, ID, region) entries."""
+        entries = sorted(entries, key=lambda entry: (entry[2], entry[0]))
+        self.names = [name for name, _, _ in entries]
+        self.ids = [az_id for _, az_id, _ in entries]
+        self.regions = [region_name for _, _, region_name in entries]
+        self._name_indices = {name: idx for idx, name in enumerate(self.names)}
+
+    @classmethod
+    def from_regions(cls, regions: List[AwsRegion]) -> 'AzIndex':
+        """Create an index of the discovered regions' AZs."""
+        return cls([(az.name, az.id, region.name) for region in regions for az in region.azs])
+
+    def __len__(self) -> int:
+        """Return the number of AZs."""
+        return len(self.names)
+
+    def __contains__(self, az_name: object) -> bool:
+        """Return whether the AZ name is known."""
+        return az_name in self._name_indices
+
+    def id_of(self, az_name: str) -> str:
+        """Return the AZ ID of an AZ name."""
+        return self.ids[self._name_indices[az_name]]
+
+    def region_of(self, az_name: str) -> str:
+        """Return the region of an AZ name."""
+        return self.regions[self._name_indices[az_name]]
+
+    @property
+    def name_to_id(self) -> Dict[str, str]:
+        """Return a mapping of every AZ name to its ID."""
+        return dict(zip(self.names, self.ids))
+
+    def save(self, path: str = AZ_INDEX_PATH) -> None:
+        """Atomically write the index to disk."""
+        data = {'version': AZ_INDEX_VERSION, 'names': self.names, 'ids': self.ids, 'regions': self.regions}
+
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as index_file:
+            json.dump(data, index_file)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str = AZ_INDEX_PATH) -> Optional['AzIndex']:
+        """Load an index written by `save`, ignoring missing or outdated files."""
+        try:
+            with open(path, encoding='utf-8') as index_file:
+                data = json.load(index_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        if data.get('version') != AZ_INDEX_VERSION:
+            return None
+
+        return cls(list(zip(data['names'], data['ids'], data['regions'])))
+
+
+def get_az_index(path: str = AZ_INDEX_PATH) -> AzIndex:
+    """Return the index saved by the last discovery, discovering the regions if there is none."""
+    index = AzIndex.load(path)
+    if index is None:
+        # Imported here because discovery itself builds and saves the index
+        from discovery import all_regions
+        index = AzIndex.from_regions(all_regions(index_path=path))
+
+    return index
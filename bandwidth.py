@@ -0,0 +1,149 @@
+"""Streaming iperf3 bandwidth measurement with a convergence-based cutoff."""
+
+import json
+import re
+import subprocess  # nosec (remove bandit warning)
+from collections import deque
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Deque, List, Optional
+
+import instrumentation
+from sampling import AdaptiveSampler, SamplingPolicy, SamplingResult
+
+
+IPERF3_PORT = 5201
+# `--json-stream` first shipped with iperf3 3.17
+JSON_STREAM_VERSION = (3, 17)
+UNIT_MULTIPLIERS = {'': 1, 'K': 10**3, 'M': 10**6, 'G': 10**9, 'T': 10**12}
+# e.g. "[SUM]   0.00-0.50   sec  56.2 MBytes   943 Mbits/sec    0" or "[  5]   0.00-0.50   sec ..."
+INTERVAL_LINE_PATTERN = re.compile(r'^\[\s*(?P<stream>SUM|\d+)\]\s+(?P<start>[\d.]+)-(?P<end>[\d.]+)\s+sec\s+'
+                                   r'[\d.]+\s+\w?Bytes\s+(?P<rate>[\d.]+)\s+(?P<unit>\w?)bits/sec'
+                                   r'(?:\s+(?P<retransmits>\d+))?')
+MAX_ERROR_LINES = 20
+
+
+@dataclass
+class BandwidthInterval:
+    """Throughput of one reporting interval, summed over all streams."""
+
+    start: float
+    end: float
+    bits_per_second: float
+    retransmits: Optional[int]
+
+
+@dataclass
+class BandwidthResult:
+    """Outcome of a bandwidth measurement."""
+
+    streams: int
+    intervals: List[BandwidthInterval]
+    sampling: SamplingResult
+
+    @property
+    def gbps(self) -> float:
+        """Return the converged throughput in Gb/s."""
+        return self.sampling.mean
+
+    @property
+    def retransmits(self) -> int:
+        """Return the total number of TCP retransmits over all intervals."""
+        return sum(interval.retransmits or 0 for interval in self.intervals)
+
+
+@lru_cache(maxsize=1)
+def supports_json_stream() -> bool:
+    """Return whether the installed iperf3 can emit one JSON event per interval."""
+    result = subprocess.run(['iperf3', '--version'], capture_output=True, text=True)  # nosec (remove bandit warning)
+    match = re.search(r'iperf (\d+)\.(\d+)', result.stdout)
+    return bool(match) and (int(match.group(1)), int(match.group(2))) >= JSON_STREAM_VERSION
+
+
+def parse_interval_line(line: str, streams: int) -> Optional[BandwidthInterval]:
+    """Parse an interval line of iperf3's human-readable output.
+
+    With several streams only the `[SUM]` lines are used; end-of-test summary lines are skipped.
+    """
+    match = INTERVAL_LINE_PATTERN.match(line)
+    if not match or 'sender' in line or 'receiver' in line:
+        return None
+
+    if (match.group('stream') == 'SUM') != (streams > 1):
+        return None
+
+    retransmits = match.group('retransmits')
+    return BandwidthInterval(start=float(match.group('start')),
+                             end=float(match.group('end')),
+                             bits_per_second=float(match.group('rate')) * UNIT_MULTIPLIERS[match.group('unit')],
+                             retransmits=int(retransmits) if retransmits is not None else None)
+
+
+def parse_json_stream_line(line: str) -> Optional[BandwidthInterval]:
+    """Parse an interval event of iperf3's `--json-stream` output."""
+    try:
+        event = json.loads(line)
+    except json.JSONDecodeError:
+        return None
+
+    if event.get('event') == 'error':
+        raise ValueError(f'Error running iperf3: {event.get("data")}')
+
+    if event.get('event') != 'interval':
+        return None
+
+    total = event['data']['sum']
+    return BandwidthInterval(start=total['start'],
+                             end=total['end'],
+                             bits_per_second=total['bits_per_second'],
+                             retransmits=total.get('retransmits'))
+
+
+def measure_bandwidth(server_ip: str, policy: SamplingPolicy, port: int = IPERF3_PORT, streams: int = 1,
+                      interval_seconds: float = 0.5, omit_seconds: float = 1.0) -> BandwidthResult:
+    """Measure throughput to an iperf3 server, stopping as soon as it has converged.
+
+    iperf3 runs for at most the policy's time budget and reports every `interval_seconds`. Intervals are
+    read as they are produced; those ending after the first `omit_seconds` (TCP ramp-up) are fed to an
+    adaptive sampler, and the client is stopped once the sampler is satisfied. All intervals are kept.
+    """
+    json_stream = supports_json_stream()
+    command = ['iperf3', '-c', server_ip, '-p', str(port), '-P', str(streams),
+               '-t', str(max(1, int(policy.max_seconds + omit_seconds))), '-i', str(interval_seconds),
+               '--json-stream' if json_stream else '--forceflush']
+
+    sampler = AdaptiveSampler(policy)
+    intervals: List[BandwidthInterval] = []
+    output_tail: Deque[str] = deque(maxlen=MAX_ERROR_LINES)
+
+    with instrumentation.span('iperf3', server=server_ip), \
+            subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,  # nosec (remove bandit warning)
+                             text=True) as process:
+        assert process.stdout  # nosec (remove bandit warning)
+        for line in process.stdout:
+            output_tail.append(line.rstrip())
+            interval = parse_json_stream_line(line) if json_stream else parse_interval_line(line, streams)
+            if interval is None:
+                continue
+
+            intervals.append(interval)
+            if interval.end <= omit_seconds:
+                continue
+
+            sampler.add(interval.bits_per_second / 10**9)
+            if sampler.should_stop():
+                process.terminate()
+                break
+
+    stopped_early = sampler.stop_reason is not None
+    if not stopped_early and process.returncode != 0:
+        raise ValueError(f'Error running iperf3: {" ".join(output_tail)}')
+
+    if sampler.count == 0:
+        raise ValueError(f'iperf3 reported no intervals after the first {omit_seconds}s.')
+
+    # iperf3 finishing on its own means the whole time budget was used
+    if not stopped_early:
+        sampler.stop_reason = 'time_budget'
+
+    return BandwidthResult(streams=streams, intervals=intervals, sampling=sampler.result())
@@ -0,0 +1,54 @@
+"""Loopback harness for the latency prober: measures its overhead and compares it with a naive blocking probe."""
+
+import os
+import socket
+import sys
+import time
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from latency_probe import LatencyStats, percentile, probe_latency, start_echo_server  # noqa: E402
+
+
+def blocking_probe(port: int, count: int) -> List[float]:
+    """Return round-trip times in milliseconds of one-at-a-time blocking send/receive probes."""
+    rtts = []
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.connect(('127.0.0.1', port))
+        sock.settimeout(1.0)
+        for _ in range(count):
+            start = time.perf_counter_ns()
+            sock.send(b'x' * 20)
+            sock.recv(2048)
+            rtts.append((time.perf_counter_ns() - start) / 1e6)
+    return sorted(rtts)
+
+
+def describe(name: str, stats: LatencyStats, cpu_seconds: float, wall_seconds: float) -> str:
+    """Return a one-line summary of a probe run."""
+    return (f'{name:<24} sent={stats.sent:<5} lost={stats.sent - stats.received:<3} reordered={stats.reordered:<3} '
+            f'min={stats.min_ms:.3f} p50={stats.p50_ms:.3f} p90={stats.p90_ms:.3f} p99={stats.p99_ms:.3f} '
+            f'max={stats.max_ms:.3f} jitter={stats.jitter_ms:.3f} ms  '
+            f'cpu/probe={cpu_seconds / stats.sent * 1e6:.1f} us  wall={wall_seconds:.2f} s')
+
+
+def main() -> None:
+    """Run the prober against a loopback echo responder with a few settings."""
+    port, stop = start_echo_server()
+
+    for count, interval, batch_size in [(100, 0.01, 1), (1000, 0.001, 1), (1000, 0.01, 10), (5000, 0.0, 50)]:
+        cpu_start, wall_start = time.process_time(), time.perf_counter()
+        stats = probe_latency('127.0.0.1', port, count=count, interval=interval, batch_size=batch_size)
+        cpu, wall = time.process_time() - cpu_start, time.perf_counter() - wall_start
+        sys.stdout.write(describe(f'n={count} i={interval} b={batch_size}', stats, cpu, wall) + '\n')
+
+    rtts = blocking_probe(port, 1000)
+    sys.stdout.write(f'{"blocking baseline":<24} min={rtts[0]:.3f} p50={percentile(rtts, 0.5):.3f} '
+                     f'p99={percentile(rtts, 0.99):.3f} ms\n')
+
+    stop.set()
+
+
+if __name__ == '__main__':
+    main()
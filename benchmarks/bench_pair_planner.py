@@ -0,0 +1,68 @@
+"""Micro-benchmark of global pair planning and instruction building for a synthetic AZ set.
+
+Also checks that the plan covers every AZ pair exactly once and that no AZ exceeds its pair cap per shard.
+"""
+
+import os
+import sys
+import time
+from itertools import combinations
+from typing import Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pair_planner import DEFAULT_MAX_PAIRS_PER_INSTANCE, build_plan_instructions, plan_global_pairs  # noqa: E402
+from synchronization import AwsAZ, AwsRegion  # noqa: E402
+
+
+def synthetic_regions(region_count: int, azs_per_region: int) -> List[AwsRegion]:
+    """Return a synthetic set of regions."""
+    return [AwsRegion(f'xx-synthetic-{region_idx}',
+                      [AwsAZ(f'xx-synthetic-{region_idx}{chr(97 + az_idx)}', f'xxs{region_idx}-az{az_idx + 1}',
+                             'ami-0123456789abcdef0')
+                       for az_idx in range(azs_per_region)])
+            for region_idx in range(region_count)]
+
+
+def synthetic_endpoints(regions: List[AwsRegion]) -> Dict[str, Tuple[Dict[str, str], Dict[str, str]]]:
+    """Return synthetic public IPs and SQS queues for every AZ."""
+    return {region.name: ({az.name: f'10.{region_idx // 256}.{region_idx % 256}.{az_idx + 1}'
+                           for az_idx, az in enumerate(region.azs)},
+                          {az.name: f'https://sqs.{region.name}.amazonaws.com/000000000000/sqs-queue-{az.name}'
+                           for az in region.azs})
+            for region_idx, region in enumerate(regions)}
+
+
+def main() -> None:
+    """Time planning, sharding and building the instructions of every shard for the full AZ set."""
+    region_count = int(sys.argv[1]) if len(sys.argv) > 1 else 35
+    azs_per_region = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    max_pairs_per_instance = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_MAX_PAIRS_PER_INSTANCE
+    regions = synthetic_regions(region_count, azs_per_region)
+    endpoints = synthetic_endpoints(regions)
+
+    start = time.perf_counter()
+    plan = plan_global_pairs(regions)
+    planned = time.perf_counter()
+    shards = plan.shard(max_pairs_per_instance)
+    sharded = time.perf_counter()
+    item_count = sum(len(region_instructions.items) for shard in shards
+                     for region_instructions in build_plan_instructions(shard, regions, endpoints))
+    built = time.perf_counter()
+
+    pairs = [(from_az.name, to_az.name) for from_az, to_az in plan.pairs()]
+    az_names = [az.name for region in sorted(regions, key=lambda region: region.name) for az in region.azs]
+    assert sorted(pairs) == sorted([(az_name, az_name) for az_name in az_names]  # nosec (remove bandit warning)
+                                   + list(combinations(az_names, 2)))
+    assert all(max(shard.pairs_per_az().values()) <= max_pairs_per_instance  # nosec (remove bandit warning)
+               for shard in shards)
+
+    sys.stdout.write(f'{region_count} regions x {azs_per_region} AZs -> {len(pairs)} pairs in {len(plan.rounds)} '
+                     f'rounds, {len(shards)} shards of at most {max_pairs_per_instance} pairs per AZ\n'
+                     f'plan:          {(planned - start) * 1000:8.2f} ms\n'
+                     f'shard:         {(sharded - planned) * 1000:8.2f} ms\n'
+                     f'instructions:  {(built - sharded) * 1000:8.2f} ms ({item_count} items over all shards)\n')
+
+
+if __name__ == '__main__':
+    main()
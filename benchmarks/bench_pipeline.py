@@ -0,0 +1,324 @@
+"""Offline benchmark of the whole pipeline against local AWS, Terraform and iperf3 stand-ins.
+
+Every stage runs for synthetic fleets of regions and AZs, in a scratch directory: AWS calls go to the
+in-process fake in `fake_aws.py`, `terraform` and `iperf3` are the scripts in `fakebin/`, and the agent
+probes a loopback UDP echo responder that adds a fixed round-trip time. Each stage reports its wall time,
+AWS API calls and subprocess spawns, and the results are compared with a stored baseline:
+
+    python benchmarks/bench_pipeline.py                         # compare with the baseline
+    python benchmarks/bench_pipeline.py --fleet 100x4 200x3     # fleets of REGIONSxAZS
+    python benchmarks/bench_pipeline.py --save-baseline         # store the results as the new baseline
+
+API call and spawn counts are deterministic and must not grow; wall times may grow by `--tolerance` (plus
+50 ms, for stages that only take milliseconds).
+Needs boto3, which the fake patches, but no AWS credentials or network access.
+"""
+
+import argparse
+import contextlib
+import heapq
+import io
+import json
+import os
+import random
+import runpy
+import select
+import socket
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from decimal import Decimal
+from itertools import combinations
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+import agent_bundle  # noqa: E402
+import main  # noqa: E402
+import terraform_runner  # noqa: E402
+from fake_aws import FakeAws, synthetic_fleet  # noqa: E402
+from latency_probe import ECHO_PORT, PACKET_FORMAT, RECEIVE_BUFFER_SIZE  # noqa: E402
+from synchronization import AwsRegion  # noqa: E402
+from terraform_runner import get_terraform_output  # noqa: E402
+
+
+BASELINE_PATH = os.path.join(BENCHMARKS_DIR, 'pipeline-baseline.json')
+FAKEBIN_DIR = os.path.join(BENCHMARKS_DIR, 'fakebin')
+DEFAULT_FLEETS = ['4x3', '16x4', '64x6']
+DEFAULT_TOLERANCE = 0.5
+# Stages that take milliseconds are too noisy for a relative tolerance alone
+WALL_TIME_SLACK_SECONDS = 0.05
+# Roughly the round-trip time between two AZs
+ECHO_RTT_SECONDS = 0.001
+TERRAFORM_LATENCY_SECONDS = 0.05
+API_LATENCY_SECONDS = 0.002
+
+
+@dataclass
+class StageResult:
+    """Cost of one stage of the pipeline."""
+
+    wall_seconds: float
+    api_calls: Dict[str, int] = field(default_factory=dict)
+    spawns: Dict[str, int] = field(default_factory=dict)
+
+
+class DelayedEchoResponder:
+    """Loopback stand-in for the instances' echo responders that answers every probe after a fixed RTT."""
+
+    def __init__(self, rtt_seconds: float, port: int = ECHO_PORT) -> None:
+        """Bind the responder to the loopback interface."""
+        self.rtt_seconds = rtt_seconds
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', port))
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+
+    def _serve(self) -> None:
+        """Echo every probe once its round-trip time has passed, with 5% jitter."""
+        pending: List[Tuple[float, int, bytes, Any]] = []
+        sequence = 0
+        while not self.stop.is_set():
+            timeout = max(0.0, pending[0][0] - time.perf_counter()) if pending else 0.05
+            readable, _, _ = select.select([self.sock], [], [], timeout)
+            if readable:
+                data, address = self.sock.recvfrom(RECEIVE_BUFFER_SIZE)
+                if len(data) == PACKET_FORMAT.size:
+                    due = time.perf_counter() + self.rtt_seconds * random.uniform(0.95, 1.05)
+                    heapq.heappush(pending, (due, sequence, data, address))
+                    sequence += 1
+
+            while pending and pending[0][0] <= time.perf_counter():
+                _, _, data, address = heapq.heappop(pending)
+                self.sock.sendto(data, address)
+
+    def __enter__(self) -> 'DelayedEchoResponder':
+        """Start answering probes."""
+        self.thread.start()
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        """Stop answering probes and close the socket."""
+        self.stop.set()
+        self.thread.join()
+        self.sock.close()
+
+
+def parse_fleet(spec: str) -> Tuple[int, int]:
+    """Parse a REGIONSxAZS fleet specification."""
+    region_count, azs_per_region = spec.lower().split('x')
+    return int(region_count), int(azs_per_region)
+
+
+def read_spawns(spawn_log: str) -> Counter:
+    """Return the subprocess spawns logged by the stand-ins so far, by command."""
+    if not os.path.isfile(spawn_log):
+        return Counter()
+    with open(spawn_log, encoding='utf-8') as log_file:
+        return Counter(line.strip() for line in log_file)
+
+
+def run_stage(aws: FakeAws, spawn_log: str, stage: Callable[[], Any]) -> Tuple[StageResult, Any]:
+    """Run a stage with its output silenced and return its cost together with its result."""
+    calls_before = Counter(aws.calls)
+    spawns_before = read_spawns(spawn_log)
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = stage()
+    wall_seconds = time.perf_counter() - start
+
+    return StageResult(wall_seconds=wall_seconds,
+                       api_calls=dict(sorted((Counter(aws.calls) - calls_before).items())),
+                       spawns=dict(sorted((read_spawns(spawn_log) - spawns_before).items()))), result
+
+
+def synthetic_metrics(regions: List[AwsRegion]) -> List[Dict[str, Any]]:
+    """Return a metrics table item for every AZ pair of every region, as a full run would write them."""
+    pairs = [(az, az) for region in regions for az in region.azs]
+    pairs.extend(pair for region in regions for pair in combinations(region.azs, 2))
+
+    return [{'availability_zone_from': from_az.name, 'availability_zone_to': to_az.name,
+             'network_latency_ms': Decimal(f'{random.uniform(0.05, 2.0):.4f}'),
+             'bandwidth_gbps': Decimal(f'{random.uniform(4.0, 5.0):.4f}')}
+            for from_az, to_az in pairs]
+
+
+def run_agent(aws: FakeAws, region: AwsRegion) -> None:
+    """Run the agent of the region's leader AZ through every round of its seeded instructions.
+
+    Peers are not run; their round announcements are queued up front, so the agent never waits for them
+    and the stage measures the agent's own probing, iperf3 and DynamoDB work.
+    """
+    az = region.azs[0]
+    instructions_table = get_terraform_output('ec2_instance_instructions_table_name')
+    instructions = next(item for item in aws.tables[instructions_table] if item['availability_zone'] == az.name)
+    queue_url = get_terraform_output(f'az_sqs_queue-{az.name}', region.name)
+    for round_idx in range(len(instructions['rounds'].split(','))):
+        aws.queues[queue_url].extend(f'Round {round_idx} {peer.name} {instructions["run_id"]}'
+                                     for peer in region.azs[1:])
+
+    config = {
+        'sqs_queue_url': queue_url,
+        'control_sqs_queue_url': get_terraform_output('sqs_control_queue_url'),
+        'dynamodb_write_table': get_terraform_output('ec2_instance_metrics_table_name'),
+        'dynamodb_read_table': instructions_table,
+        'dynamodb_series_table': get_terraform_output('ec2_instance_metrics_series_table_name'),
+        'dynamodb_progress_table': get_terraform_output('ec2_instance_pair_progress_table_name'),
+        'region': region.name,
+        'az': az.name,
+        'mode': 'once',
+        # The agent returns after its run instead of waiting for the next one
+        'next_run_wait_seconds': 0,
+    }
+    with open('agent.json', 'w', encoding='utf-8') as config_file:
+        json.dump(config, config_file)
+
+    os.environ['AGENT_CONFIG'] = os.path.abspath('agent.json')
+    runpy.run_path(os.path.join(ROOT_DIR, 'user-data.py'), run_name='__main__')
+
+
+def run_fleet(region_count: int, azs_per_region: int, args: argparse.Namespace) -> Dict[str, StageResult]:
+    """Run every stage for one synthetic fleet in a scratch directory and return the cost of each stage."""
+    aws = FakeAws(synthetic_fleet(region_count, azs_per_region), api_latency_seconds=args.api_latency)
+    results: Dict[str, StageResult] = {}
+    cwd = os.getcwd()
+
+    with tempfile.TemporaryDirectory() as scratch, aws.patch():
+        os.chdir(scratch)
+        spawn_log = os.path.join(scratch, 'spawns.log')
+        os.environ['BENCH_SPAWN_LOG'] = spawn_log
+        # Output stores are per stack name and would otherwise outlive the previous fleet's scratch directory
+        terraform_runner._TERRAFORM_OUTPUTS.clear()  # pylint: disable=protected-access
+        # A stand-in bundle, so that applying does not build the real one
+        os.makedirs('dist')
+        with open(os.path.join('dist', 'agent.pyz'), 'wb') as bundle_file:
+            bundle_file.write(b'bundle')
+        with open(agent_bundle.sources_path(os.path.join('dist', 'agent.pyz')), 'w', encoding='utf-8') as sources_file:
+            sources_file.write(agent_bundle.sources_digest())
+
+        try:
+            results['discover'], regions = run_stage(aws, spawn_log, lambda: main.discover(refresh=True))
+            results['discover_cached'], _ = run_stage(aws, spawn_log, main.discover)
+            results['render'], _ = run_stage(aws, spawn_log, lambda: main.render(regions, main.compile_templates()))
+            results['apply'], _ = run_stage(aws, spawn_log, lambda: main.apply(regions, args.max_parallel_regions))
+            results['seed'], _ = run_stage(aws, spawn_log, lambda: main.seed(regions))
+            with DelayedEchoResponder(args.echo_rtt):
+                results['agent'], _ = run_stage(aws, spawn_log, lambda: run_agent(aws, regions[0]))
+
+            aws.put_items({get_terraform_output('ec2_instance_metrics_table_name'): synthetic_metrics(regions)})
+            results['report'], _ = run_stage(aws, spawn_log, lambda: main.report(None, 'report', None))
+            results['destroy'], _ = run_stage(aws, spawn_log, lambda: main.destroy_all(args.max_parallel_regions))
+        finally:
+            os.chdir(cwd)
+
+    return results
+
+
+def compare(results: Dict[str, Dict[str, StageResult]], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Return the regressions of the results against the baseline."""
+    regressions = []
+    for fleet, stages in results.items():
+        for stage, result in stages.items():
+            expected = baseline.get(fleet, {}).get(stage)
+            if expected is None:
+                continue
+
+            if result.wall_seconds > expected['wall_seconds'] * (1 + tolerance) + WALL_TIME_SLACK_SECONDS:
+                regressions.append(f'{fleet} {stage}: {result.wall_seconds:.3f}s, baseline '
+                                   f'{expected["wall_seconds"]:.3f}s')
+            for kind in ('api_calls', 'spawns'):
+                for name, count in getattr(result, kind).items():
+                    if count > expected[kind].get(name, 0):
+                        regressions.append(f'{fleet} {stage}: {count} {name}, baseline {expected[kind].get(name, 0)}')
+
+    return regressions
+
+
+def format_results(results: Dict[str, Dict[str, StageResult]], baseline: Dict[str, Any]) -> str:
+    """Return a table of every stage's cost, next to its baseline wall time."""
+    lines = [f'{"fleet":>8} {"stage":<16} {"wall (s)":>9} {"baseline":>9} {"API calls":>10} {"spawns":>7}']
+    for fleet, stages in results.items():
+        for stage, result in stages.items():
+            expected = baseline.get(fleet, {}).get(stage)
+            baseline_seconds = f'{expected["wall_seconds"]:9.3f}' if expected else f'{"-":>9}'
+            lines.append(f'{fleet:>8} {stage:<16} {result.wall_seconds:9.3f} {baseline_seconds} '
+                         f'{sum(result.api_calls.values()):10d} {sum(result.spawns.values()):7d}')
+    return '\n'.join(lines) + '\n'
+
+
+@contextlib.contextmanager
+def stand_in_environment(args: argparse.Namespace) -> Iterator[None]:
+    """Put the stand-in binaries first on the PATH and configure them, restoring the environment afterwards."""
+    environ = dict(os.environ)
+    os.environ['PATH'] = FAKEBIN_DIR + os.pathsep + os.environ.get('PATH', '')
+    os.environ['FAKE_TERRAFORM_LATENCY'] = str(args.terraform_latency)
+    try:
+        yield
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+
+
+def main_benchmark(argv: Optional[List[str]] = None) -> int:
+    """Run the benchmark and return the process exit code: 1 if there are regressions."""
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline offline against local stand-ins.')
+    parser.add_argument('--fleet', nargs='+', default=DEFAULT_FLEETS, metavar='REGIONSxAZS',
+                        help='synthetic fleets to run, e.g. 64x6 for 64 regions of 6 AZs')
+    parser.add_argument('--terraform-latency', type=float, default=TERRAFORM_LATENCY_SECONDS,
+                        help='seconds every fake terraform command takes')
+    parser.add_argument('--api-latency', type=float, default=API_LATENCY_SECONDS,
+                        help='seconds every fake AWS API call takes')
+    parser.add_argument('--echo-rtt', type=float, default=ECHO_RTT_SECONDS,
+                        help='round-trip time of the fake echo responder, in seconds')
+    parser.add_argument('--max-parallel-regions', type=int, default=terraform_runner.MAX_PARALLEL_STACKS)
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='path of the stored baseline')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='relative wall time increase that counts as a regression')
+    parser.add_argument('--json', help='also write the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    random.seed(0)
+    results: Dict[str, Dict[str, StageResult]] = {}
+    with stand_in_environment(args):
+        for fleet in args.fleet:
+            results[fleet] = run_fleet(*parse_fleet(fleet), args)
+
+    serialized = {fleet: {stage: asdict(result) for stage, result in stages.items()}
+                  for fleet, stages in results.items()}
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as json_file:
+            json.dump(serialized, json_file, indent=2)
+
+    try:
+        with open(args.baseline, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+    except FileNotFoundError:
+        baseline = {}
+
+    sys.stdout.write(format_results(results, baseline))
+
+    if args.save_baseline:
+        tmp_path = f'{args.baseline}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as baseline_file:
+            json.dump({**baseline, **serialized}, baseline_file, indent=2)
+        os.replace(tmp_path, args.baseline)
+        sys.stdout.write(f'Saved the baseline to {args.baseline}.\n')
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        sys.stderr.write(f'Regression: {regression}\n')
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_benchmark())
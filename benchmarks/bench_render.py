@@ -0,0 +1,53 @@
+"""Micro-benchmark of Terraform template rendering for a synthetic global AZ set."""
+
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rendering import (TerraformRegionData, compile_templates, get_region_alias,  # noqa: E402
+                       render_terraform_files, write_terraform_files)
+
+
+def synthetic_terraform_data(region_count: int, azs_per_region: int) -> Dict[str, List[TerraformRegionData]]:
+    """Return Terraform data for a synthetic set of regions."""
+    terraform_data = {}
+    for region_idx in range(region_count):
+        region_name = f'xx-synthetic-{region_idx}'
+        terraform_data[region_name] = [TerraformRegionData(region_name, get_region_alias(region_name),
+                                                           'ami-0123456789abcdef0', f'{region_name}{chr(97 + az_idx)}',
+                                                           f'xxs{region_idx}-az{az_idx + 1}', 't3.micro')
+                                       for az_idx in range(azs_per_region)]
+    return terraform_data
+
+
+def main() -> None:
+    """Time compilation, rendering and (skipped) rewriting of the full AZ set."""
+    region_count = int(sys.argv[1]) if len(sys.argv) > 1 else 35
+    azs_per_region = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    terraform_data = synthetic_terraform_data(region_count, azs_per_region)
+
+    start = time.perf_counter()
+    compiled_templates = compile_templates()
+    compiled = time.perf_counter()
+    files = render_terraform_files(terraform_data, compiled_templates)
+    rendered = time.perf_counter()
+
+    with tempfile.TemporaryDirectory() as directory:
+        first_written = write_terraform_files(files, directory)
+        first_write = time.perf_counter()
+        second_written = write_terraform_files(files, directory)
+        second_write = time.perf_counter()
+
+    sys.stdout.write(f'{region_count} regions x {azs_per_region} AZs -> {len(files)} files\n'
+                     f'compile:       {(compiled - start) * 1000:8.2f} ms\n'
+                     f'render:        {(rendered - compiled) * 1000:8.2f} ms\n'
+                     f'first write:   {(first_write - rendered) * 1000:8.2f} ms ({first_written} written)\n'
+                     f'second write:  {(second_write - first_write) * 1000:8.2f} ms ({second_written} written)\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Micro-benchmark of report generation for a synthetic global dataset."""
+
+import os
+import sys
+import tempfile
+import time
+from decimal import Decimal
+from itertools import permutations
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from az_index import AzIndex  # noqa: E402
+from report import markdown_report, pair_measurements, translate_az_names, write_reports  # noqa: E402
+from synchronization import AwsAZ, AwsRegion  # noqa: E402
+
+
+def synthetic_regions(region_count: int, azs_per_region: int) -> List[AwsRegion]:
+    """Return a synthetic set of regions."""
+    return [AwsRegion(f'xx-synthetic-{region_idx}',
+                      [AwsAZ(f'xx-synthetic-{region_idx}{chr(97 + az_idx)}', f'xxs{region_idx}-az{az_idx + 1}',
+                             'ami-0123456789abcdef0')
+                       for az_idx in range(azs_per_region)])
+            for region_idx in range(region_count)]
+
+
+def synthetic_items(regions: List[AwsRegion]) -> List[Dict[str, Any]]:
+    """Return one metrics table item for every ordered AZ pair of every region."""
+    return [{'availability_zone_from': first.name, 'availability_zone_to': second.name,
+             'network_latency_ms': Decimal(str(round(0.5 + (idx % 97) / 50, 2))),
+             'bandwidth_gbps': Decimal('4.96')}
+            for region in regions for idx, (first, second) in enumerate(permutations(region.azs, 2))]
+
+
+def main() -> None:
+    """Time AZ name translation (per-entry replace vs. single pass) and writing all reports."""
+    region_count = int(sys.argv[1]) if len(sys.argv) > 1 else 35
+    azs_per_region = int(sys.argv[2]) if len(sys.argv) > 2 else 6
+    regions = synthetic_regions(region_count, azs_per_region)
+    items = synthetic_items(regions)
+    az_index = AzIndex.from_regions(regions)
+    mapping = az_index.name_to_id
+    # A table of names, as the old script embedded it
+    table = translate_az_names(markdown_report(pair_measurements(items, az_index)),
+                               {az_id: az_name for az_name, az_id in mapping.items()})
+
+    start = time.perf_counter()
+    replaced = table
+    for az_name, az_id in mapping.items():
+        replaced = replaced.replace(f'`{az_name}`', f'`{az_id}`')
+    replace_done = time.perf_counter()
+    translated = translate_az_names(table, mapping)
+    translate_done = time.perf_counter()
+    assert translated == replaced  # nosec (remove bandit warning)
+
+    with tempfile.TemporaryDirectory() as directory:
+        write_reports(items, az_index, directory)
+    reports_done = time.perf_counter()
+
+    sys.stdout.write(f'{region_count} regions x {azs_per_region} AZs -> {len(items)} measurements\n'
+                     f'str.replace per AZ:  {(replace_done - start) * 1000:8.2f} ms\n'
+                     f'single-pass:         {(translate_done - replace_done) * 1000:8.2f} ms\n'
+                     f'all reports:         {(reports_done - translate_done) * 1000:8.2f} ms\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""Startup time of the command line stages that should not load boto3 or NumPy."""
+
+import os
+import statistics
+import subprocess  # nosec (remove bandit warning)
+import sys
+import tempfile
+import time
+from typing import List
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from bench_render import synthetic_terraform_data  # noqa: E402
+from discovery import CachedRegion, save_topology_cache  # noqa: E402
+from synchronization import AwsAZ, AwsRegion  # noqa: E402
+
+HEAVY_MODULES = ('boto3', 'botocore', 'numpy')
+
+
+def time_command(args: List[str], cwd: str, repeat: int) -> float:
+    """Return the median wall time of running `main.py` with the given arguments, in milliseconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(ROOT_DIR, 'main.py'), *args],  # nosec (remove bandit warning)
+                       cwd=cwd, check=True, capture_output=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def heavy_imports(args: List[str], cwd: str) -> List[str]:
+    """Return the heavy modules imported when running `main.py` with the given arguments."""
+    result = subprocess.run([sys.executable, '-X', 'importtime',  # nosec (remove bandit warning)
+                             os.path.join(ROOT_DIR, 'main.py'), *args],
+                            cwd=cwd, check=True, capture_output=True, text=True)
+    imported = {line.split('|')[-1].strip() for line in result.stderr.splitlines() if line.startswith('import time:')}
+    return [module for module in HEAVY_MODULES if module in imported]
+
+
+def main() -> None:
+    """Time `--help` and `render` against a synthetic discovery cache."""
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    with tempfile.TemporaryDirectory() as directory:
+        now = time.time()
+        cache = {region_name: CachedRegion(AwsRegion(region_name, [AwsAZ(az.REGION_AZ_REPLACE_ME,
+                                                                         az.REGION_AZ_ID_REPLACE_ME,
+                                                                         az.REGION_AMI_REPLACE_ME)
+                                                                   for az in azs]), now)
+                 for region_name, azs in synthetic_terraform_data(35, 4).items()}
+        save_topology_cache(cache, os.path.join(directory, 'regions.json'))
+
+        for args in (['--help'], ['render']):
+            sys.stdout.write(f'main.py {" ".join(args):8} {time_command(args, directory, repeat):8.2f} ms  '
+                             f'heavy imports: {", ".join(heavy_imports(args, directory)) or "none"}\n')
+
+
+if __name__ == '__main__':
+    main()
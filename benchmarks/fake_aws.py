@@ -0,0 +1,241 @@
+"""In-process stand-in for the EC2, SSM, DynamoDB, SQS and S3 calls the pipeline makes.
+
+Every call is counted per service and operation and can be delayed by a fixed latency, so benchmarks can
+compare API call counts and see the effect of concurrency without an AWS account. Only the operations and
+parameters the pipeline uses are implemented; anything else raises NotImplementedError.
+"""
+
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+from unittest import mock
+
+import boto3
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+
+SCAN_PAGE_ITEMS = 100
+
+
+def synthetic_fleet(region_count: int, azs_per_region: int) -> Dict[str, int]:
+    """Return a fleet of synthetic regions, mapped to their AZ counts."""
+    return {f'xx-synthetic-{region_idx}': azs_per_region for region_idx in range(region_count)}
+
+
+class FakeEvents:
+    """Stand-in for a client's event system; handlers are accepted and never called."""
+
+    def register(self, *_: Any, **__: Any) -> None:
+        """Ignore the handler."""
+
+
+class FakePaginator:
+    """Paginator over an operation that returns everything in a single page."""
+
+    def __init__(self, client: 'FakeClient', operation: str) -> None:
+        """Create a paginator for the given operation."""
+        self.client = client
+        self.operation = operation
+
+    def paginate(self, **kwargs: Any) -> Iterator[Dict[str, Any]]:
+        """Yield the operation's single page."""
+        yield getattr(self.client, self.operation)(**kwargs)
+
+
+class FakeClient:
+    """Client of one service in one region, dispatching calls to the shared `FakeAws` state."""
+
+    def __init__(self, aws: 'FakeAws', service: str, region_name: Optional[str]) -> None:
+        """Create a client for the given service and region."""
+        self.aws = aws
+        self.service = service
+        self.region_name = region_name or 'us-east-1'
+        self.meta = mock.Mock(events=FakeEvents(), region_name=self.region_name)
+
+    def get_paginator(self, operation: str) -> FakePaginator:
+        """Return a paginator for the given operation."""
+        return FakePaginator(self, operation)
+
+    def __getattr__(self, operation: str) -> Any:
+        """Return a callable that counts, delays and handles a call of the given operation."""
+        handler = getattr(self.aws, f'_{self.service}_{operation}', None)
+        if handler is None:
+            raise NotImplementedError(f'{self.service}.{operation} is not implemented by the fake.')
+
+        def call(*args: Any, **kwargs: Any) -> Any:
+            self.aws.count(self.service, operation)
+            return handler(self.region_name, *args, **kwargs)
+
+        return call
+
+
+def matches(item: Dict[str, Any], condition: Any) -> bool:
+    """Return whether an item matches a boto3 key condition."""
+    expression = condition.get_expression()
+    if expression['operator'] == 'AND':
+        return all(matches(item, part) for part in expression['values'])
+
+    key, value = expression['values']
+    if expression['operator'] == '=':
+        return item.get(key.name) == value
+    if expression['operator'] == 'begins_with':
+        return str(item.get(key.name, '')).startswith(value)
+
+    raise NotImplementedError(f'{expression["operator"]} key conditions are not implemented by the fake.')
+
+
+class FakeTable:
+    """DynamoDB resource table."""
+
+    def __init__(self, aws: 'FakeAws', name: str) -> None:
+        """Create a handle for the given table."""
+        self.aws = aws
+        self.name = name
+
+    def query(self, **kwargs: Any) -> Dict[str, Any]:
+        """Return the items matching a key condition of equalities and prefixes, in a single page."""
+        self.aws.count('dynamodb', 'query')
+        condition = kwargs['KeyConditionExpression']
+        with self.aws.lock:
+            return {'Items': [dict(item) for item in self.aws.tables[self.name] if matches(item, condition)]}
+
+
+class FakeDynamoDbResource:
+    """DynamoDB resource, whose items are not serialized."""
+
+    def __init__(self, aws: 'FakeAws') -> None:
+        """Create a resource on the shared state."""
+        self.aws = aws
+        self.meta = mock.Mock(client=FakeClient(aws, 'dynamodb', 'us-east-1'))
+
+    def Table(self, name: str) -> FakeTable:  # pylint: disable=invalid-name
+        """Return a handle for the given table."""
+        return FakeTable(self.aws, name)
+
+    def batch_write_item(self, **kwargs: Any) -> Dict[str, Any]:
+        """Store the items of the batch."""
+        self.aws.count('dynamodb', 'batch_write_item')
+        self.aws.put_items({table: [request['PutRequest']['Item'] for request in requests]
+                            for table, requests in kwargs['RequestItems'].items()})
+        return {'UnprocessedItems': {}}
+
+
+class FakeSession:
+    """Stand-in for `boto3.session.Session`."""
+
+    def __init__(self, aws: 'FakeAws') -> None:
+        """Create a session on the shared state."""
+        self.aws = aws
+
+    def client(self, service: str, region_name: Optional[str] = None, **_: Any) -> FakeClient:
+        """Return a client for the given service."""
+        return FakeClient(self.aws, service, region_name)
+
+    def resource(self, service: str, region_name: Optional[str] = None, **_: Any) -> FakeDynamoDbResource:
+        """Return a resource for the given service (DynamoDB only)."""
+        if service != 'dynamodb':
+            raise NotImplementedError(f'{service} resources are not implemented by the fake.')
+        return FakeDynamoDbResource(self.aws)
+
+
+class FakeAws:
+    """Shared state of the fake services: a synthetic fleet of regions, tables, queues and call counters."""
+
+    def __init__(self, fleet: Dict[str, int], api_latency_seconds: float = 0.0,
+                 scan_page_items: int = SCAN_PAGE_ITEMS) -> None:
+        """Create fake services for a fleet mapping region names to AZ counts."""
+        self.fleet = fleet
+        self.api_latency_seconds = api_latency_seconds
+        self.scan_page_items = scan_page_items
+        self.lock = threading.Lock()
+        self.calls: Counter = Counter()
+        self.tables: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self.queues: Dict[str, Deque[str]] = defaultdict(deque)
+        self.objects: Dict[Tuple[str, str], str] = {}
+        self._serializer = TypeSerializer()
+        self._deserializer = TypeDeserializer()
+
+    def count(self, service: str, operation: str) -> None:
+        """Count a call and wait for the configured latency."""
+        with self.lock:
+            self.calls[f'{service}.{operation}'] += 1
+        if self.api_latency_seconds:
+            time.sleep(self.api_latency_seconds)
+
+    def ubuntu_ami(self, region_name: str) -> str:
+        """Return the synthetic Ubuntu AMI of a region."""
+        return f'ami-{list(self.fleet).index(region_name):017x}'
+
+    def put_items(self, request_items: Dict[str, List[Dict[str, Any]]]) -> None:
+        """Store unserialized items."""
+        with self.lock:
+            for table, items in request_items.items():
+                self.tables[table].extend(items)
+
+    @contextmanager
+    def patch(self) -> Iterator['FakeAws']:
+        """Route `boto3.session.Session`, `boto3.client` and `boto3.resource` to the fake services."""
+        with mock.patch.object(boto3.session, 'Session', lambda *_, **__: FakeSession(self)), \
+                mock.patch.object(boto3, 'client', FakeSession(self).client), \
+                mock.patch.object(boto3, 'resource', FakeSession(self).resource):
+            yield self
+
+    # Handlers receive the client's region and the call's arguments, named as in the AWS API
+
+    def _ec2_describe_regions(self, _: str, **__: Any) -> Dict[str, Any]:
+        return {'Regions': [{'RegionName': region_name} for region_name in self.fleet]}
+
+    def _ec2_describe_availability_zones(self, region_name: str, **_: Any) -> Dict[str, Any]:
+        region_idx = list(self.fleet).index(region_name)
+        return {'AvailabilityZones': [{'ZoneName': f'{region_name}{chr(97 + az_idx)}',
+                                       'ZoneId': f'xxs{region_idx}-az{az_idx + 1}',
+                                       'RegionName': region_name}
+                                      for az_idx in range(self.fleet[region_name])]}
+
+    def _ec2_describe_images(self, region_name: str, **_: Any) -> Dict[str, Any]:
+        return {'Images': [{'ImageId': self.ubuntu_ami(region_name), 'CreationDate': '2024-01-01T00:00:00.000Z'}]}
+
+    def _ssm_get_parameter(self, region_name: str, **kwargs: Any) -> Dict[str, Any]:
+        return {'Parameter': {'Name': kwargs['Name'], 'Value': self.ubuntu_ami(region_name)}}
+
+    def _dynamodb_batch_write_item(self, _: str, **kwargs: Any) -> Dict[str, Any]:
+        self.put_items({table: [{key: self._deserializer.deserialize(value)
+                                 for key, value in request['PutRequest']['Item'].items()}
+                                for request in requests]
+                        for table, requests in kwargs['RequestItems'].items()})
+        return {'UnprocessedItems': {}}
+
+    def _dynamodb_scan(self, _: str, **kwargs: Any) -> Dict[str, Any]:
+        with self.lock:
+            segment_items = self.tables[kwargs['TableName']][kwargs.get('Segment', 0)::kwargs.get('TotalSegments', 1)]
+        start = int(kwargs['ExclusiveStartKey']['offset']['N']) if 'ExclusiveStartKey' in kwargs else 0
+        end = start + self.scan_page_items
+        response: Dict[str, Any] = {'Items': [{key: self._serializer.serialize(value) for key, value in item.items()}
+                                              for item in segment_items[start:end]]}
+        if end < len(segment_items):
+            response['LastEvaluatedKey'] = {'offset': {'N': str(end)}}
+        return response
+
+    def _sqs_send_message(self, _: str, **kwargs: Any) -> Dict[str, Any]:
+        with self.lock:
+            self.queues[kwargs['QueueUrl']].append(kwargs['MessageBody'])
+        return {'MessageId': str(self.calls['sqs.send_message'])}
+
+    def _sqs_receive_message(self, _: str, **kwargs: Any) -> Dict[str, Any]:
+        with self.lock:
+            queue = self.queues[kwargs['QueueUrl']]
+            bodies = [queue.popleft() for _ in range(min(kwargs.get('MaxNumberOfMessages', 1), len(queue)))]
+        return {'Messages': [{'Body': body, 'ReceiptHandle': body, 'Attributes': {'SentTimestamp': '0'}}
+                             for body in bodies]}
+
+    def _sqs_delete_message_batch(self, _: str, **kwargs: Any) -> Dict[str, Any]:
+        return {'Successful': [{'Id': entry['Id']} for entry in kwargs['Entries']]}
+
+    def _s3_upload_file(self, _: str, filename: str, bucket: str, key: str, **__: Any) -> None:
+        self.objects[(bucket, key)] = filename
+
+    def _s3_generate_presigned_url(self, _: str, client_method: str, **kwargs: Any) -> str:
+        params = kwargs['Params']
+        return f'https://{params["Bucket"]}.s3.amazonaws.com/{params["Key"]}?X-Amz-Signature={client_method}'
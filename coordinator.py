@@ -0,0 +1,184 @@
+"""Event-driven coordination of a measurement run through the control queue."""
+
+import re
+import sys
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+import instrumentation
+from synchronization import AwsRegion
+
+
+CONTROL_QUEUE_REGION = 'us-east-1'
+REGION_TIMEOUT_SECONDS = 30 * 60
+MAX_PARALLEL_TEARDOWNS = 8
+# Messages sent this long before the run was seeded still count, in case the local clock is ahead of SQS
+CLOCK_SKEW_SECONDS = 60
+# e.g. "DONE - eu-west-1 run=20240101T000000Z-0a1b2c" or "PROGRESS 2/5 - eu-west-1 run=20240101T000000Z-0a1b2c"
+CONTROL_MESSAGE_PATTERN = re.compile(r'^(?P<kind>DONE|PROGRESS)(?: (?P<done>\d+)/(?P<total>\d+))? - (?P<region>\S+)'
+                                     r'(?: run=(?P<run_id>\S+))?$')
+
+
+@dataclass
+class RegionProgress:
+    """Progress of one region's measurements."""
+
+    name: str
+    azs: int
+    deadline: float
+    rounds_done: int = 0
+    rounds_total: Optional[int] = None
+    finished_at: Optional[float] = None
+    torn_down_at: Optional[float] = None
+    status: str = 'running'
+
+
+class RunCoordinator:
+    """Follows a run through the control queue and tears every region down as soon as it is finished.
+
+    The leader instance of every region reports each completed round and finally `DONE`. A region that does
+    not report any progress for `timeout_seconds` is considered stalled. Finished (and, if enabled, stalled)
+    regions are handed to `teardown` in the background while the queue keeps being polled. Without a
+    `teardown`, the coordinator only waits for the run to end.
+
+    Only messages of `run_id` that were sent after `seeded_at` count, so that the coordinator can join a run
+    that is already going without picking up leftovers of earlier runs or of earlier seeds of the same run.
+    Without a run ID, only messages sent after the coordinator started count.
+    """
+
+    def __init__(self, regions: List[AwsRegion], control_queue_url: str, teardown: Optional[Callable[[str], None]],
+                 timeout_seconds: float = REGION_TIMEOUT_SECONDS, teardown_stalled: bool = True,
+                 max_parallel_teardowns: int = MAX_PARALLEL_TEARDOWNS, endpoint_url: Optional[str] = None,
+                 run_id: Optional[str] = None, seeded_at: Optional[float] = None) -> None:
+        """Create a coordinator for the given regions."""
+        import boto3
+
+        self.sqs = instrumentation.instrument_client(
+            boto3.client('sqs', region_name=CONTROL_QUEUE_REGION, endpoint_url=endpoint_url))
+        self.control_queue_url = control_queue_url
+        self.teardown = teardown
+        self.timeout_seconds = timeout_seconds
+        self.teardown_stalled = teardown_stalled
+        self.max_parallel_teardowns = max_parallel_teardowns
+        self.started_at = time.time()
+        self.run_id = run_id
+        self.not_before = seeded_at - CLOCK_SKEW_SECONDS if seeded_at is not None else self.started_at
+        self.progress = {region.name: RegionProgress(region.name, len(region.azs), self.started_at + timeout_seconds)
+                         for region in regions}
+        self._teardowns: Dict[str, Future] = {}
+
+    def _poll(self) -> None:
+        """Long-poll the control queue for one batch of messages and delete them."""
+        messages = self.sqs.receive_message(
+            QueueUrl=self.control_queue_url,
+            MaxNumberOfMessages=10,
+            WaitTimeSeconds=20,
+            AttributeNames=['SentTimestamp'],
+        ).get('Messages', [])
+
+        if not messages:
+            return
+
+        self.sqs.delete_message_batch(
+            QueueUrl=self.control_queue_url,
+            Entries=[{'Id': str(idx), 'ReceiptHandle': message['ReceiptHandle']}
+                     for idx, message in enumerate(messages)]
+        )
+
+        for message in messages:
+            # Leftovers from earlier runs must not finish regions of this one
+            if int(message['Attributes']['SentTimestamp']) / 1000 < self.not_before:
+                continue
+
+            self._handle(message['Body'])
+
+    def _handle(self, body: str) -> None:
+        """Update a region's progress from a control message."""
+        match = CONTROL_MESSAGE_PATTERN.match(body)
+        if not match or match.group('region') not in self.progress:
+            sys.stderr.write(f'Ignoring unexpected control message: {body}\n')
+            return
+        if self.run_id is not None and match.group('run_id') != self.run_id:
+            return
+
+        progress = self.progress[match.group('region')]
+        if progress.status != 'running':
+            return
+
+        now = time.time()
+        progress.deadline = now + self.timeout_seconds
+        if match.group('kind') == 'PROGRESS':
+            progress.rounds_done = int(match.group('done'))
+            progress.rounds_total = int(match.group('total'))
+            return
+
+        progress.rounds_done = progress.rounds_total or progress.rounds_done
+        progress.finished_at = now
+        progress.status = 'done'
+        sys.stdout.write(f'{progress.name} finished after {now - self.started_at:.0f}s.\n')
+
+    def _check_deadlines(self) -> None:
+        """Mark regions without progress past their deadline as stalled."""
+        now = time.time()
+        for progress in self.progress.values():
+            if progress.status == 'running' and now > progress.deadline:
+                progress.status = 'stalled'
+                sys.stderr.write(f'{progress.name} stalled after round {progress.rounds_done}'
+                                 f'/{progress.rounds_total or "?"}.\n')
+
+    def _start_teardowns(self, executor: ThreadPoolExecutor) -> None:
+        """Start tearing down every region that finished or stalled."""
+        if self.teardown is None:
+            return
+
+        for progress in self.progress.values():
+            if progress.name in self._teardowns:
+                continue
+
+            if progress.status == 'done' or (progress.status == 'stalled' and self.teardown_stalled):
+                self._teardowns[progress.name] = executor.submit(self.teardown, progress.name)
+
+    def _reap_teardowns(self) -> None:
+        """Record the outcome of teardowns that have completed."""
+        for region_name, future in self._teardowns.items():
+            progress = self.progress[region_name]
+            if not future.done() or progress.torn_down_at is not None or progress.status == 'teardown_failed':
+                continue
+
+            try:
+                future.result()
+                progress.torn_down_at = time.time()
+            except ValueError as error:
+                sys.stderr.write(f'Teardown of {region_name} failed: {error}\n')
+                progress.status = 'teardown_failed'
+
+    def run(self) -> Dict[str, RegionProgress]:
+        """Coordinate the run until every region has finished or stalled and its teardown completed."""
+        with ThreadPoolExecutor(max_workers=self.max_parallel_teardowns) as executor:
+            while any(progress.status == 'running' for progress in self.progress.values()):
+                self._poll()
+                self._check_deadlines()
+                self._start_teardowns(executor)
+                self._reap_teardowns()
+
+        self._reap_teardowns()
+        self._write_summary()
+        return self.progress
+
+    def _write_summary(self) -> None:
+        """Print every region's outcome and the instance time saved by early teardowns."""
+        finish_times = [progress.finished_at for progress in self.progress.values() if progress.finished_at]
+        last_finish = max(finish_times, default=self.started_at)
+
+        saved_instance_minutes = 0.0
+        for progress in sorted(self.progress.values(), key=lambda progress: progress.name):
+            duration = (progress.finished_at or time.time()) - self.started_at
+            sys.stdout.write(f'  {progress.name}: {progress.status} after {duration:.0f}s '
+                             f'({progress.rounds_done}/{progress.rounds_total or "?"} rounds)\n')
+            if progress.finished_at and progress.torn_down_at:
+                saved_instance_minutes += max(0.0, last_finish - progress.torn_down_at) * progress.azs / 60
+
+        if self.teardown is not None:
+            sys.stdout.write(f'Early teardowns saved about {saved_instance_minutes:.0f} instance-minutes.\n')
@@ -0,0 +1,134 @@
+"""Discovery of AWS regions and availability zones."""
+
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import instrumentation
+from ami_resolver import AMI_CACHE_PATH, AmiResolver
+from az_index import AZ_INDEX_PATH, AzIndex
+from synchronization import AwsAZ, AwsRegion
+
+
+TOPOLOGY_CACHE_PATH = 'regions.json'
+# Version 1 entries paired AZ names and IDs by sort order and must not be reused
+TOPOLOGY_CACHE_VERSION = 2
+TOPOLOGY_CACHE_TTL_SECONDS = 24 * 60 * 60
+MAX_DISCOVERY_WORKERS = 16
+
+
+@dataclass
+class CachedRegion:
+    """Represents a discovered region together with the time it was fetched."""
+
+    region: AwsRegion
+    fetched_at: float
+
+    def is_stale(self, ttl_seconds: float, now: float) -> bool:
+        """Return whether this entry is older than the given TTL."""
+        return now - self.fetched_at > ttl_seconds
+
+
+def load_topology_cache(path: str = TOPOLOGY_CACHE_PATH) -> Dict[str, CachedRegion]:
+    """Load the on-disk topology cache, ignoring missing or outdated files."""
+    try:
+        with open(path, encoding='utf-8') as cache_file:
+            data = json.load(cache_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+    if data.get('version') != TOPOLOGY_CACHE_VERSION:
+        return {}
+
+    return {region_name: CachedRegion(AwsRegion(region_name, [AwsAZ(**az) for az in entry['azs']]),
+                                      entry['fetched_at'])
+            for region_name, entry in data['regions'].items()}
+
+
+def save_topology_cache(cache: Dict[str, CachedRegion], path: str = TOPOLOGY_CACHE_PATH) -> None:
+    """Atomically write the topology cache to disk."""
+    data: Dict[str, Any] = {
+        'version': TOPOLOGY_CACHE_VERSION,
+        'regions': {region_name: {'fetched_at': cached.fetched_at,
+                                  'azs': [{'name': az.name, 'id': az.id, 'ubuntu_ami': az.ubuntu_ami}
+                                          for az in cached.region.azs]}
+                    for region_name, cached in sorted(cache.items())}
+    }
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as cache_file:
+        json.dump(data, cache_file, indent=2)
+    os.replace(tmp_path, path)
+
+
+def discover_region(region_name: str, regional_ec2_client: Any, ubuntu_ami: str) -> AwsRegion:
+    """Return the AZs of a single region."""
+    azs = regional_ec2_client.describe_availability_zones()['AvailabilityZones']
+
+    # Names map to different IDs in every account, so each name is paired with the ID of its own record
+    region_azs = [AwsAZ(az['ZoneName'], az['ZoneId'], ubuntu_ami)
+                  for az in sorted(azs, key=lambda az: az['ZoneName'])]
+
+    return AwsRegion(region_name, region_azs)
+
+
+def all_regions(cache_path: Optional[str] = TOPOLOGY_CACHE_PATH,
+                ttl_seconds: float = TOPOLOGY_CACHE_TTL_SECONDS,
+                max_workers: int = MAX_DISCOVERY_WORKERS,
+                endpoint_url: Optional[str] = None,
+                index_path: Optional[str] = AZ_INDEX_PATH,
+                ami_cache_path: Optional[str] = AMI_CACHE_PATH) -> List[AwsRegion]:
+    """Return a list of all AWS regions.
+
+    Regions whose cache entry is younger than `ttl_seconds` are served from `cache_path`; the rest are
+    fetched concurrently, with one EC2 client per region. Pass `cache_path=None` to bypass the cache and
+    `endpoint_url` to point discovery at stub EC2 and SSM endpoints. AMIs are resolved through their own
+    per-region cache at `ami_cache_path`. The AZ index of the result is saved to `index_path` for the steps
+    that only need AZ names and IDs.
+    """
+    import boto3
+
+    session = boto3.session.Session()
+    ec2_client = instrumentation.instrument_client(session.client('ec2', endpoint_url=endpoint_url))
+    region_names = [region['RegionName'] for region in ec2_client.describe_regions()['Regions']]
+
+    cache = load_topology_cache(cache_path) if cache_path else {}
+    now = time.time()
+    stale_region_names = [region_name for region_name in region_names
+                          if region_name not in cache or cache[region_name].is_stale(ttl_seconds, now)]
+
+    if stale_region_names:
+        ami_resolver = AmiResolver(ami_cache_path)
+        # Clients are created up front because client creation on a shared session is not thread-safe
+        regional_ec2_clients = {region_name: instrumentation.instrument_client(
+                                    session.client('ec2', region_name=region_name, endpoint_url=endpoint_url))
+                                for region_name in stale_region_names}
+        regional_ssm_clients = {region_name: instrumentation.instrument_client(
+                                    session.client('ssm', region_name=region_name, endpoint_url=endpoint_url))
+                                for region_name in stale_region_names
+                                if ami_resolver.cached(region_name) is None}
+
+        def discover(region_name: str) -> AwsRegion:
+            with instrumentation.span('discover_region', region=region_name):
+                ubuntu_ami = ami_resolver.resolve(region_name, regional_ssm_clients.get(region_name),
+                                                  regional_ec2_clients[region_name])
+                return discover_region(region_name, regional_ec2_clients[region_name], ubuntu_ami)
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(stale_region_names))) as executor:
+            for region in executor.map(discover, stale_region_names):
+                cache[region.name] = CachedRegion(region, now)
+
+        ami_resolver.save()
+
+    cache = {region_name: cache[region_name] for region_name in region_names}
+    if cache_path:
+        save_topology_cache(cache, cache_path)
+
+    regions = [cache[region_name].region for region_name in region_names]
+    if index_path:
+        AzIndex.from_regions(regions).save(index_path)
+
+    return regions
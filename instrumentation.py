@@ -0,0 +1,267 @@
+"""Timed spans and event counters, exported as a JSON trace and a Prometheus textfile.
+
+Instrumentation is enabled by giving a trace path, a metrics path or both, either through `configure()` or
+the `LATENCY_TRACE` and `LATENCY_METRICS` environment variables (which also reach Terraform's worker
+processes). While it is disabled, `span()` returns a shared no-op context manager and the other helpers
+return immediately, so they can stay on hot paths.
+
+The trace uses the Chrome trace event format and opens in Perfetto or chrome://tracing. The textfile can be
+picked up by node_exporter's textfile collector.
+"""
+
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, ContextManager, Deque, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+
+TRACE_ENV = 'LATENCY_TRACE'
+METRICS_ENV = 'LATENCY_METRICS'
+METRIC_PREFIX = 'latency'
+# Daemon agents run for days; only the most recent trace events are kept
+MAX_TRACE_EVENTS = 100000
+THROTTLING_ERROR_CODES = {'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottled',
+                          'RequestThrottledException', 'RequestLimitExceeded', 'TooManyRequestsException',
+                          'ProvisionedThroughputExceededException', 'SlowDown'}
+
+Labels = Tuple[Tuple[str, str], ...]
+Function = TypeVar('Function', bound=Callable[..., Any])
+
+
+def label_key(labels: Dict[str, Any]) -> Labels:
+    """Return labels as a hashable, sorted tuple of string pairs."""
+    return tuple(sorted((label, str(label_value)) for label, label_value in labels.items()))
+
+
+@dataclass
+class SpanStats:
+    """Aggregated durations of all spans with the same name and labels."""
+
+    count: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+
+class Instrumentation:
+    """Collects spans and counters and writes them to the configured files."""
+
+    def __init__(self, trace_path: Optional[str] = None, metrics_path: Optional[str] = None) -> None:
+        """Create an empty collector; it is enabled if any output path is given."""
+        self.trace_path = trace_path
+        self.metrics_path = metrics_path
+        self.enabled = bool(trace_path or metrics_path)
+        self.lock = threading.Lock()
+        self.events: Deque[Dict[str, Any]] = deque(maxlen=MAX_TRACE_EVENTS)
+        self.spans: Dict[Tuple[str, Labels], SpanStats] = {}
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+
+    def record_span(self, name: str, started_at: float, seconds: float, labels: Dict[str, Any]) -> None:
+        """Record a finished span that started at the given wall-clock time."""
+        key = (name, label_key(labels))
+        with self.lock:
+            stats = self.spans.setdefault(key, SpanStats())
+            stats.count += 1
+            stats.total_seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            self.events.append({'name': name, 'ph': 'X', 'ts': int(started_at * 1e6), 'dur': int(seconds * 1e6),
+                                'pid': os.getpid(), 'tid': threading.get_ident(), 'args': dict(key[1])})
+
+    def count(self, name: str, value: float, labels: Dict[str, Any]) -> None:
+        """Add a value to a counter."""
+        key = (name, label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def reset(self) -> None:
+        """Drop everything collected so far, with a new lock in case the old one was held while forking."""
+        self.lock = threading.Lock()
+        self.events.clear()
+        self.spans.clear()
+        self.counters.clear()
+
+    def drain(self) -> Dict[str, Any]:
+        """Return everything collected so far as plain data, for another process to merge, and start over."""
+        with self.lock:
+            drained = {'events': list(self.events),
+                       'spans': [[name, labels, stats.count, stats.total_seconds, stats.max_seconds]
+                                 for (name, labels), stats in self.spans.items()],
+                       'counters': [[name, labels, value] for (name, labels), value in self.counters.items()]}
+            self.events.clear()
+            self.spans.clear()
+            self.counters.clear()
+        return drained
+
+    def merge(self, drained: Dict[str, Any]) -> None:
+        """Add data drained from another process."""
+        with self.lock:
+            self.events.extend(drained['events'])
+            for name, labels, count, total_seconds, max_seconds in drained['spans']:
+                stats = self.spans.setdefault((name, tuple(map(tuple, labels))), SpanStats())
+                stats.count += count
+                stats.total_seconds += total_seconds
+                stats.max_seconds = max(stats.max_seconds, max_seconds)
+            for name, labels, value in drained['counters']:
+                key = (name, tuple(map(tuple, labels)))
+                self.counters[key] = self.counters.get(key, 0) + value
+
+    def trace(self) -> Dict[str, Any]:
+        """Return the trace in the Chrome trace event format, with the counters alongside."""
+        with self.lock:
+            return {'traceEvents': list(self.events),
+                    'displayTimeUnit': 'ms',
+                    'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                                 for (name, labels), value in sorted(self.counters.items())]}
+
+    def prometheus_text(self) -> str:
+        """Return the spans and counters in the Prometheus text exposition format."""
+        span_metric = f'{METRIC_PREFIX}_span_seconds'
+        lines = [f'# HELP {span_metric} Time spent in instrumented spans.', f'# TYPE {span_metric} summary']
+        max_lines = [f'# HELP {span_metric}_max Longest instrumented span.', f'# TYPE {span_metric}_max gauge']
+        with self.lock:
+            for (name, labels), stats in sorted(self.spans.items()):
+                label_text = format_labels((('span', name),) + labels)
+                lines.append(f'{span_metric}_count{label_text} {stats.count}')
+                lines.append(f'{span_metric}_sum{label_text} {stats.total_seconds:.6f}')
+                max_lines.append(f'{span_metric}_max{label_text} {stats.max_seconds:.6f}')
+
+            counter_lines: Dict[str, List[str]] = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                counter_lines.setdefault(f'{METRIC_PREFIX}_{name}_total', []).append(
+                    f'{METRIC_PREFIX}_{name}_total{format_labels(labels)} {value:g}')
+
+        for metric, metric_lines in counter_lines.items():
+            lines.append(f'# TYPE {metric} counter')
+            lines.extend(metric_lines)
+
+        return '\n'.join(lines + max_lines) + '\n'
+
+    def flush(self) -> None:
+        """Atomically write the trace and the textfile to their paths."""
+        for path, content in ((self.trace_path, lambda: json.dumps(self.trace())),
+                              (self.metrics_path, self.prometheus_text)):
+            if not path:
+                continue
+
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as output_file:
+                output_file.write(content())
+            os.replace(tmp_path, path)
+
+
+def format_labels(labels: Labels) -> str:
+    """Return Prometheus label pairs, escaped."""
+    if not labels:
+        return ''
+
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{label}="{value}"' for (label, _), value in zip(labels, escaped)) + '}'
+
+
+_INSTRUMENTATION = Instrumentation(os.environ.get(TRACE_ENV), os.environ.get(METRICS_ENV))
+_NULL_SPAN = contextlib.nullcontext()
+# Forked workers start empty, so what they drain and hand back to their parent is only their own
+os.register_at_fork(after_in_child=lambda: _INSTRUMENTATION.reset())
+
+
+def configure(trace_path: Optional[str] = None, metrics_path: Optional[str] = None) -> None:
+    """Enable instrumentation with the given output paths, or disable it if there are none."""
+    global _INSTRUMENTATION  # pylint: disable=global-statement
+    _INSTRUMENTATION = Instrumentation(trace_path, metrics_path)
+
+
+def enabled() -> bool:
+    """Return whether instrumentation is enabled."""
+    return _INSTRUMENTATION.enabled
+
+
+@contextlib.contextmanager
+def _span(name: str, labels: Dict[str, Any]) -> Iterator[None]:
+    """Time the enclosed block."""
+    started_at = time.time()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _INSTRUMENTATION.record_span(name, started_at, time.perf_counter() - start, labels)
+
+
+def span(name: str, **labels: Any) -> ContextManager[None]:
+    """Return a context manager that records the enclosed block as a span."""
+    if not _INSTRUMENTATION.enabled:
+        return _NULL_SPAN
+    return _span(name, labels)
+
+
+def traced(name: str, **labels: Any) -> Callable[[Function], Function]:
+    """Decorate a function so that every call is recorded as a span."""
+    def decorator(function: Function) -> Function:
+        @functools.wraps(function)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with span(name, **labels):
+                return function(*args, **kwargs)
+        return wrapper  # type: ignore
+    return decorator
+
+
+def count(name: str, value: float = 1, **labels: Any) -> None:
+    """Add a value to the counter with the given name and labels."""
+    if _INSTRUMENTATION.enabled and value:
+        _INSTRUMENTATION.count(name, value, labels)
+
+
+def drain() -> Optional[Dict[str, Any]]:
+    """Return and reset everything collected in this process, or None if instrumentation is disabled."""
+    return _INSTRUMENTATION.drain() if _INSTRUMENTATION.enabled else None
+
+
+def merge(drained: Optional[Dict[str, Any]]) -> None:
+    """Add data drained from another process."""
+    if drained is not None and _INSTRUMENTATION.enabled:
+        _INSTRUMENTATION.merge(drained)
+
+
+def flush() -> None:
+    """Write the trace and the textfile, if instrumentation is enabled."""
+    if _INSTRUMENTATION.enabled:
+        _INSTRUMENTATION.flush()
+
+
+def _before_call(context: Dict[str, Any], **_: Any) -> None:
+    """Note when an API call starts (botocore `before-call` handler)."""
+    context['instrumentation_started_at'] = time.time()
+    context['instrumentation_start'] = time.perf_counter()
+
+
+def _after_call(model: Any, parsed: Dict[str, Any], context: Dict[str, Any], **_: Any) -> None:
+    """Record an API call, its retries and its error (botocore `after-call` handler)."""
+    if 'instrumentation_start' not in context:
+        return
+
+    labels = {'service': model.service_model.service_name, 'operation': model.name}
+    _INSTRUMENTATION.record_span('aws_call', context['instrumentation_started_at'],
+                                 time.perf_counter() - context['instrumentation_start'], labels)
+    count('aws_retries', parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0), **labels)
+    if 'Error' in parsed:
+        count('aws_errors', code=parsed['Error'].get('Code', ''), **labels)
+
+
+def _needs_retry(response: Optional[Tuple[Any, Dict[str, Any]]], operation: Any, **_: Any) -> None:
+    """Count throttled attempts, including those that are retried (botocore `needs-retry` handler)."""
+    if response is not None and response[1].get('Error', {}).get('Code') in THROTTLING_ERROR_CODES:
+        count('aws_throttles', service=operation.service_model.service_name, operation=operation.name)
+
+
+def instrument_client(client: Any) -> Any:
+    """Record every call of a boto3 client as a span and count its retries, throttles and errors."""
+    if _INSTRUMENTATION.enabled:
+        client.meta.events.register('before-call', _before_call)
+        client.meta.events.register('after-call', _after_call)
+        client.meta.events.register('needs-retry', _needs_retry)
+
+    return client
@@ -0,0 +1,192 @@
+"""UDP echo based latency prober, used by the instances instead of `ping`.
+
+Run `python3 latency_probe.py serve` next to `iperf3 -s` to answer probes.
+"""
+
+import math
+import random
+import select
+import socket
+import struct
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from sampling import AdaptiveSampler
+
+
+ECHO_PORT = 5202
+# Session ID, sequence number and send timestamp in nanoseconds
+PACKET_FORMAT = struct.Struct('!QIQ')
+RECEIVE_BUFFER_SIZE = 2048
+
+
+@dataclass
+class LatencyStats:
+    """Round-trip statistics of one probe run, in milliseconds."""
+
+    sent: int
+    received: int
+    reordered: int
+    min_ms: float
+    p50_ms: float
+    p90_ms: float
+    p99_ms: float
+    max_ms: float
+    mean_ms: float
+    jitter_ms: float
+
+    @property
+    def loss(self) -> float:
+        """Return the fraction of probes that got no reply."""
+        return 1 - self.received / self.sent
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Return the nearest-rank percentile of already sorted values."""
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def latency_stats(sent: int, rtts_ns: Dict[int, int], reordered: int) -> LatencyStats:
+    """Summarize round-trip times keyed by sequence number."""
+    in_order = [rtts_ns[seq] / 1e6 for seq in sorted(rtts_ns)]
+    ordered = sorted(in_order)
+
+    # Mean absolute difference between consecutive probes, as in RFC 3550 (without its smoothing)
+    deltas = [abs(current - previous) for previous, current in zip(in_order, in_order[1:])]
+    jitter = sum(deltas) / len(deltas) if deltas else 0.0
+
+    return LatencyStats(sent=sent,
+                        received=len(ordered),
+                        reordered=reordered,
+                        min_ms=ordered[0],
+                        p50_ms=percentile(ordered, 0.5),
+                        p90_ms=percentile(ordered, 0.9),
+                        p99_ms=percentile(ordered, 0.99),
+                        max_ms=ordered[-1],
+                        mean_ms=sum(ordered) / len(ordered),
+                        jitter_ms=jitter)
+
+
+def probe_latency(host: str, port: int = ECHO_PORT, count: int = 100, interval: float = 0.01,
+                  batch_size: int = 1, timeout: float = 1.0, sampler: Optional[AdaptiveSampler] = None,
+                  sock: Optional[socket.socket] = None) -> LatencyStats:
+    """Measure round-trip latency to an echo responder.
+
+    Sends `count` probes in batches of `batch_size`, one batch every `interval` seconds, and waits up to
+    `timeout` seconds after the last batch for outstanding replies. Each probe carries its own send
+    timestamp, so replies may arrive in any order; duplicates and replies to other sessions are ignored.
+    With a `sampler`, every round-trip time is fed to it and no more batches are sent once it stops.
+    A `sock` connected to the responder is reused instead of opening a new one; every call uses its own
+    session ID, so late replies to earlier calls are ignored.
+    """
+    if sock is None:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe_socket:
+            probe_socket.connect((host, port))
+            return probe_latency(host, port, count, interval, batch_size, timeout, sampler, probe_socket)
+
+    session_id = random.getrandbits(64)
+    interval_ns = int(interval * 1e9)
+    rtts_ns: Dict[int, int] = {}
+    highest_seq = -1
+    reordered = 0
+    sent = 0
+
+    sock.setblocking(False)
+    next_send = time.perf_counter_ns()
+    deadline: Optional[int] = None
+    while True:
+        now = time.perf_counter_ns()
+        if sent < count and sampler is not None and sampler.should_stop():
+            count = sent
+            deadline = now + int(timeout * 1e9)
+
+        if sent < count and now >= next_send:
+            for _ in range(min(batch_size, count - sent)):
+                try:
+                    sock.send(PACKET_FORMAT.pack(session_id, sent, time.perf_counter_ns()))
+                except ConnectionRefusedError:
+                    # An earlier probe was refused (the responder may not be up yet); this one counts as lost
+                    pass
+                sent += 1
+
+            next_send += interval_ns
+            if sent == count:
+                deadline = now + int(timeout * 1e9)
+
+        if deadline is not None and (len(rtts_ns) == count or now >= deadline):
+            break
+
+        wait_ns = (next_send if deadline is None else deadline) - time.perf_counter_ns()
+        readable, _, _ = select.select([sock], [], [], max(wait_ns, 0) / 1e9)
+        if not readable:
+            continue
+
+        while True:
+            try:
+                data = sock.recv(RECEIVE_BUFFER_SIZE)
+            except (BlockingIOError, ConnectionRefusedError):
+                # A refused probe (ICMP port unreachable) simply counts as lost
+                break
+
+            received_at = time.perf_counter_ns()
+            if len(data) != PACKET_FORMAT.size:
+                continue
+
+            reply_session_id, seq, sent_at = PACKET_FORMAT.unpack(data)
+            if reply_session_id != session_id or seq in rtts_ns:
+                continue
+
+            rtts_ns[seq] = received_at - sent_at
+            if sampler is not None:
+                sampler.add(rtts_ns[seq] / 1e6)
+            if seq < highest_seq:
+                reordered += 1
+            highest_seq = max(highest_seq, seq)
+
+    if sampler is not None:
+        sampler.should_stop()
+
+    if not rtts_ns:
+        raise ValueError(f'No echo replies from {host}:{port}.')
+
+    return latency_stats(sent, rtts_ns, reordered)
+
+
+def serve_echo(sock: socket.socket, stop: Optional[threading.Event] = None) -> None:
+    """Echo every datagram received on the socket back to its sender."""
+    sock.settimeout(0.5)
+    while stop is None or not stop.is_set():
+        try:
+            data, address = sock.recvfrom(RECEIVE_BUFFER_SIZE)
+        except socket.timeout:
+            continue
+
+        sock.sendto(data, address)
+
+
+def start_echo_server(host: str = '127.0.0.1', port: int = 0) -> Tuple[int, threading.Event]:
+    """Start an echo responder in a background thread, returning its port and an event that stops it."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((host, port))
+    stop = threading.Event()
+
+    def serve() -> None:
+        with sock:
+            serve_echo(sock, stop)
+
+    threading.Thread(target=serve, daemon=True).start()
+    return sock.getsockname()[1], stop
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] != ['serve']:
+        sys.stderr.write(f'Usage: {sys.argv[0]} serve\n')
+        sys.exit(1)
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as echo_socket:
+        echo_socket.bind(('0.0.0.0', ECHO_PORT))  # nosec (remove bandit warning)
+        serve_echo(echo_socket)
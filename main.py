@@ -1,208 +1,564 @@
-"""Manages cross-AZ latency testing."""
+"""Manages cross-AZ latency testing.
 
-import boto3
-import pickle  # nosec (remove bandit warning)
+Every stage is a subcommand that reads the artifacts of the stages before it, so a failed stage can be
+re-run on its own:
+
+    discover   -> regions.json, az-index.json, amis.json
+    render     -> tf/global/main.tf, tf/<region>/main.tf
+    apply      -> tf/applied-regions.json
+    seed       -> tf/run.json
+    coordinate, resume, destroy, report
+
+Without a subcommand the whole pipeline runs. Modules that need boto3 or NumPy are imported by the stages
+that use them, so `--help` and `render` start without loading either. Set LATENCY_TRACE and/or
+LATENCY_METRICS to record every stage, AWS call and Terraform command (see instrumentation.py).
+"""
+
+import argparse
+import json
 import os
 import shutil
-import subprocess  # nosec (remove bandit warning)
 import sys
-from dataclasses import dataclass
-from enum import Enum
-from typing import Dict, List, Optional
+import time
+from dataclasses import replace
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import instrumentation
+from coordinator import REGION_TIMEOUT_SECONDS
+from discovery import TOPOLOGY_CACHE_TTL_SECONDS, load_topology_cache
+from pair_planner import DEFAULT_MAX_PAIRS_PER_INSTANCE, plan_global_pairs, plan_pairs
+from reconcile import diff_regions, load_applied_regions, resource_addresses, save_applied_regions
+from rendering import (GLOBAL_STACK, TERRAFORM_DIR, CompiledTemplate, TerraformRegionData, compile_templates,
+                       get_region_alias, render_terraform_files, write_terraform_files)
+from run_progress import RunRecord, load_run, new_run_id, save_run
+from synchronization import AwsAZ, AwsRegion
+from terraform_runner import (MAX_PARALLEL_STACKS, destroy_terraform, get_terraform_output, region_stacks,
+                              run_stacks, run_terraform, stack_dir)
+
+
+GLOBAL_VARIABLES = ['ec2_instance_iam_profile_name',
+                    'sqs_control_queue_url',
+                    'ec2_instance_metrics_table_name',
+                    'ec2_instance_instructions_table_name',
+                    'ec2_instance_metrics_series_table_name',
+                    'ec2_instance_pair_progress_table_name']
+AGENT_MODES = ['once', 'daemon']
+ALL_SHARDS = 'all'
+
+
+def get_terraform_data(region: AwsRegion) -> List[TerraformRegionData]:
+    """Return the Terraform data of every AZ in the given region."""
+    return [TerraformRegionData(region.name, get_region_alias(region.name), az.ubuntu_ami, az.name, az.id,
+                                't3.micro')
+            for az in region.azs]
+
+
+def global_variables_files(regions: List[AwsRegion],
+                           agent_settings: Optional[Dict[str, Any]] = None) -> Dict[str, str]:
+    """Return the variable files that pass the global stack's outputs, agent bundle URL and agent settings on."""
+    from agent_bundle import publish_bundle
+
+    variables: Dict[str, Any] = {name: get_terraform_output(name) for name in GLOBAL_VARIABLES}
+    variables.update(agent_settings or {})
+    variables['agent_bundle_url'] = publish_bundle(get_terraform_output('agent_bundle_bucket_name'))
+    content = json.dumps(variables, indent=2)
+    return {os.path.join(region.name, 'globals.auto.tfvars.json'): content for region in regions}
+
+
+def select_regions(regions: List[AwsRegion], region_names: Optional[List[str]]) -> List[AwsRegion]:
+    """Return the regions with the given names, or all of them if no names are given."""
+    if not region_names:
+        return regions
+
+    unknown = set(region_names) - {region.name for region in regions}
+    if unknown:
+        raise ValueError(f'Unknown regions: {", ".join(sorted(unknown))}.')
+
+    return [region for region in regions if region.name in region_names]
+
+
+def discovered_regions() -> List[AwsRegion]:
+    """Return the regions found by the last `discover` stage."""
+    regions = [cached.region for cached in load_topology_cache().values()]
+    if not regions:
+        raise ValueError('No discovered regions, run `main.py discover` first.')
+
+    return regions
+
+
+def applied_regions() -> List[AwsRegion]:
+    """Return the regions recorded by the last `apply` stage."""
+    regions = list(load_applied_regions().values())
+    if not regions:
+        raise ValueError('No applied regions, run `main.py apply` first.')
+
+    return regions
+
+
+@instrumentation.traced('stage', stage='discover')
+def discover(refresh: bool = False) -> List[AwsRegion]:
+    """Discover all regions and their AZs, reusing cached regions unless `refresh` is set."""
+    from discovery import all_regions
 
-from synchronization import write_azs_to_dynamodb, AwsAZ, AwsRegion
+    regions = all_regions(ttl_seconds=0 if refresh else TOPOLOGY_CACHE_TTL_SECONDS)
+    sys.stdout.write(f'Discovered {sum(len(region.azs) for region in regions)} AZs in {len(regions)} regions.\n')
+    return regions
+
+
+@instrumentation.traced('stage', stage='render')
+def render(regions: List[AwsRegion], compiled_templates: List[CompiledTemplate]) -> None:
+    """Render the Terraform stacks of the given regions."""
+    terraform_files = render_terraform_files({region.name: get_terraform_data(region) for region in regions},
+                                             compiled_templates)
+    written = write_terraform_files(terraform_files)
+    sys.stdout.write(f'Rendered {len(terraform_files)} Terraform files ({written} changed).\n')
 
 
-def get_ubuntu_ami(regional_ec2_client: boto3.client) -> str:
-    """Return the latest Ubuntu 22.04 LTS AMI in the given region."""
-    response = regional_ec2_client.describe_images(
-        Owners=['amazon'],
-        Filters=[{'Name': 'description', 'Values': ['*Ubuntu*22.04*LTS*']}]
-    )
+def apply_regions(regions: List[AwsRegion], max_parallel_regions: int,
+                  agent_settings: Optional[Dict[str, Any]] = None) -> List[AwsRegion]:
+    """Apply the global stack, then the given regions' stacks in parallel.
 
-    ubuntu_images = [img for img in response['Images'] if 'UNSUPPORTED' not in img['Description']
-                     and 'Pro' not in img['Description'] and 'Minimal' not in img['Description']]
-    ubuntu_ami = sorted(ubuntu_images, key=lambda x: x['CreationDate'], reverse=True)[0]['ImageId']
+    Returns the regions whose stacks were applied successfully, which are added to the applied record.
+    """
+    run_terraform(GLOBAL_STACK)
+    write_terraform_files(global_variables_files(regions, agent_settings))
 
-    return ubuntu_ami
+    failures = run_stacks(run_terraform, {region.name: None for region in regions}, max_parallel_regions)
+    succeeded = [region for region in regions if region.name not in failures]
 
+    applied = load_applied_regions()
+    applied.update({region.name: region for region in succeeded})
+    save_applied_regions(list(applied.values()))
 
-def all_regions() -> List[AwsRegion]:
-    """Return a list of all AWS regions."""
-    ec2_client = boto3.client('ec2')
-    region_names = [region['RegionName'] for region in ec2_client.describe_regions()['Regions']]
+    return succeeded
 
-    regions = []
+
+@instrumentation.traced('stage', stage='destroy')
+def destroy_regions(region_names: List[str], max_parallel_regions: int) -> None:
+    """Destroy the given region stacks in parallel and drop them from the applied record."""
+    failures = run_stacks(destroy_terraform, {region_name: None for region_name in region_names},
+                          max_parallel_regions)
+
+    applied = load_applied_regions()
     for region_name in region_names:
-        regional_ec2_client = boto3.client('ec2', region_name=region_name)
-        azs = regional_ec2_client.describe_availability_zones()['AvailabilityZones']
-        az_zone_names = sorted([az['ZoneName'] for az in azs])
-        az_ids = sorted([az['ZoneId'] for az in azs])
-        ubuntu_ami = get_ubuntu_ami(regional_ec2_client)
+        if region_name not in failures:
+            applied.pop(region_name, None)
+    save_applied_regions(list(applied.values()))
 
-        region_azs = [AwsAZ(az_zone_name, az_id, ubuntu_ami)
-                      for az_zone_name, az_id in zip(az_zone_names, az_ids)]
+    if failures:
+        raise ValueError(f'terraform destroy failed for {", ".join(sorted(failures))}.')
 
-        regions.append(AwsRegion(region_name, region_azs))
 
-    return regions
+def destroy_all(max_parallel_regions: int) -> None:
+    """Destroy every region stack in parallel, then the global stack."""
+    destroy_regions(region_stacks(), max_parallel_regions)
 
+    if os.path.isfile(os.path.join(stack_dir(GLOBAL_STACK), 'main.tf')):
+        destroy_terraform(GLOBAL_STACK)
 
-def get_region_alias(region: str) -> str:
-    """Return the Terraform alias for the given region."""
-    return region.replace('-', '_')
 
+def reconcile_terraform(regions: List[AwsRegion], compiled_templates: List[CompiledTemplate],
+                        max_parallel_regions: int,
+                        agent_settings: Optional[Dict[str, Any]] = None) -> List[AwsRegion]:
+    """Bring the deployment in line with `regions`, touching only the stacks that changed since the last apply.
 
-@dataclass
-class TerraformRegionData:
-    """Represents Terraform data for a region."""
+    Removed regions' stacks are destroyed and deleted, and the instances and queues of changed regions are
+    replaced so that they measure again. Returns the regions that were applied and need seeding.
+    """
+    applied = load_applied_regions()
+    diff = diff_regions(applied, regions)
+    if diff.is_empty:
+        sys.stdout.write('All regions are up to date.\n')
+        return []
 
-    REGION_NAME_REPLACE_ME: str
-    REGION_ALIAS_REPLACE_ME: str
-    REGION_AMI_REPLACE_ME: str
-    REGION_AZ_REPLACE_ME: str
-    INSTANCE_TYPE_REPLACE_ME: str
+    destroy_targets: Dict[str, Optional[List[str]]] = {region.name: None for region in diff.removed}
+    destroy_targets.update({region.name: resource_addresses(compiled_templates, get_terraform_data(region),
+                                                            per_az_only=True)
+                            for region in diff.changed_applied})
+    destroy_failures = run_stacks(destroy_terraform, destroy_targets, max_parallel_regions)
 
-    def __post_init__(self) -> None:
-        """Post init - us-east-1e doesn't have t3.micro available."""
-        if self.REGION_AZ_REPLACE_ME == 'us-east-1e':
-            self.INSTANCE_TYPE_REPLACE_ME = 't2.micro'
+    for region in diff.removed:
+        if region.name not in destroy_failures:
+            shutil.rmtree(stack_dir(region.name))
+            del applied[region.name]
+    save_applied_regions(list(applied.values()))
 
+    render(regions, compiled_templates)
 
-class TerraformTemplateType(Enum):
-    """Represents the type of Terraform template."""
+    # Regions that fail keep their previous record, so the next reconcile retries them
+    reconciled = apply_regions([region for region in diff.added + diff.changed
+                                if region.name not in destroy_failures], max_parallel_regions, agent_settings)
+    sys.stdout.write(f'Reconciled {len(diff.added)} added, {len(diff.changed)} changed and '
+                     f'{len(diff.removed)} removed regions.\n')
 
-    PER_AZ = 1
-    PER_REGION = 2
-    GLOBAL = 3
+    return reconciled
 
 
-@dataclass
-class TerraformTemplate:
-    """Represents Terraform template data."""
+@instrumentation.traced('stage', stage='apply')
+def apply(regions: List[AwsRegion], max_parallel_regions: int, reconcile: bool = False,
+          agent_settings: Optional[Dict[str, Any]] = None) -> List[AwsRegion]:
+    """Apply the rendered stacks of the given regions, or with `reconcile` only those that changed."""
+    from terraform_progress import write_timing_report
 
-    name: str
-    template_type: TerraformTemplateType
+    if reconcile:
+        applied = reconcile_terraform(regions, compile_templates(), max_parallel_regions, agent_settings)
+    else:
+        applied = apply_regions(regions, max_parallel_regions, agent_settings)
+
+    if os.path.isdir(TERRAFORM_DIR):
+        write_timing_report()
+
+    return applied
 
-    @property
-    def file_name(self) -> str:
-        """Return the name of the template."""
-        return f'{self.name}.tpl.tf'
 
+@instrumentation.traced('stage', stage='seed')
+def seed(regions: List[AwsRegion], shard: Optional[int] = None,
+         max_pairs_per_instance: int = DEFAULT_MAX_PAIRS_PER_INSTANCE) -> None:
+    """Write the instructions of the given regions and start their instances.
+
+    By default every region measures its own AZ pairs. With a `shard`, that shard of the global plan over
+    all AZ pairs across the given regions is measured instead. The run gets a new ID, under which the agents
+    record the progress of every pair, and is recorded so that it can be resumed.
+    """
+    from synchronization import seed_regions
+
+    if not regions:
+        sys.stdout.write('No regions to seed.\n')
+        return
+
+    plan = None
+    if shard is not None:
+        shards = plan_global_pairs(regions).shard(max_pairs_per_instance)
+        if not 0 <= shard < len(shards):
+            raise ValueError(f'Shard {shard} does not exist; the global plan has shards 0 to {len(shards) - 1}.')
+
+        plan = shards[shard]
+        sys.stdout.write(f'Seeding shard {shard} of 0-{len(shards) - 1}: {plan.pair_count} pairs '
+                         f'in {len(plan.rounds)} rounds.\n')
+
+    run = RunRecord(new_run_id(), [region.name for region in regions], shard,
+                    max_pairs_per_instance if shard is not None else None, time.time())
+    seed_regions(regions, plan=plan, run_id=run.run_id)
+    save_run(run)
+    sys.stdout.write(f'Started run {run.run_id}.\n')
+
+
+def wait_for_run(regions: List[AwsRegion], region_timeout_seconds: float) -> None:
+    """Wait for the last seeded run to finish in every region, without tearing anything down."""
+    from coordinator import RunCoordinator
+
+    run = load_run()
+    progress = RunCoordinator(regions, get_terraform_output('sqs_control_queue_url'), None,
+                              timeout_seconds=region_timeout_seconds,
+                              run_id=run.run_id if run else None, seeded_at=run.seeded_at if run else None).run()
+
+    stalled = sorted(name for name, region_progress in progress.items() if region_progress.status != 'done')
+    if stalled:
+        raise ValueError(f'Regions stalled: {", ".join(stalled)}.')
+
+
+def seed_shards(regions: List[AwsRegion], region_timeout_seconds: float,
+                max_pairs_per_instance: int = DEFAULT_MAX_PAIRS_PER_INSTANCE) -> None:
+    """Seed every shard of the global plan onto the same instances, each once the one before it finished.
+
+    Agents wait for the next run after finishing one, so the fleet is only applied once. If a shard stalls,
+    the remaining shards are not seeded; resume the stalled one, then seed the rest with `--global-shard`.
+    """
+    shard_count = len(plan_global_pairs(regions).shard(max_pairs_per_instance))
+    for shard in range(shard_count):
+        if shard:
+            try:
+                wait_for_run(regions, region_timeout_seconds)
+            except ValueError as error:
+                raise ValueError(f'Shard {shard - 1} did not finish: {error} Resume it, then seed shards {shard} '
+                                 f'to {shard_count - 1} with `main.py seed --global-shard`.') from error
+
+        seed(regions, shard, max_pairs_per_instance)
+
+
+def run_pairs(regions: List[AwsRegion], run: RunRecord) -> List[Tuple[AwsAZ, AwsAZ]]:
+    """Return every pair that a run measures."""
+    if run.shard is None:
+        return [pair for region in regions for pair in [(az, az) for az in region.azs] + region.pairs()]
+
+    return plan_global_pairs(regions).shard(run.max_pairs_per_instance or DEFAULT_MAX_PAIRS_PER_INSTANCE)[
+        run.shard].pairs()
+
+
+@instrumentation.traced('stage', stage='resume')
+def resume(max_parallel_regions: int) -> List[AwsRegion]:
+    """Measure the pairs of the last run that are not done yet, restarting only the AZs that take part in them.
+
+    Pairs that were attempted `MAX_PAIR_ATTEMPTS` times are given up. The AZs of the remaining pairs get new
+    instances and queues (regions that were torn down are applied again), and the pairs are planned into
+    rounds of their own under the same run ID. Returns the regions that were restarted, with only their
+    restarted AZs.
+    """
+    import boto3
+
+    from run_progress import MAX_PAIR_ATTEMPTS, PAIR_DONE, pair_key, read_run_progress
+    from synchronization import seed_regions
+
+    run = load_run()
+    if run is None:
+        raise ValueError('There is no run to resume; seed one first.')
+    if not run.regions:
+        raise ValueError(f'Run {run.run_id} has no regions to resume.')
+
+    regions = select_regions(discovered_regions(), run.regions)
+    dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+    instrumentation.instrument_client(dynamodb.meta.client)
+    progress = read_run_progress(dynamodb.Table(get_terraform_output('ec2_instance_pair_progress_table_name')),
+                                 run.run_id)
+
+    remaining = []
+    for from_az, to_az in run_pairs(regions, run):
+        pair_progress = progress.get(pair_key(from_az.name, to_az.name), {})
+        if pair_progress.get('status') == PAIR_DONE:
+            continue
+        if int(pair_progress.get('attempts', 0)) >= MAX_PAIR_ATTEMPTS:
+            sys.stderr.write(f'Giving up on {from_az.name} -> {to_az.name} after {MAX_PAIR_ATTEMPTS} attempts: '
+                             f'{pair_progress.get("error")}\n')
+            continue
+        remaining.append((from_az, to_az))
+
+    sys.stdout.write(f'Run {run.run_id}: {len(remaining)} pairs left to measure.\n')
+    if not remaining:
+        return []
+
+    involved = {az.name for pair in remaining for az in pair}
+    restarted = [region for region in regions if any(az.name in involved for az in region.azs)]
+    applied = load_applied_regions()
+    compiled_templates = compile_templates()
+    destroy_targets: Dict[str, Optional[List[str]]] = {
+        region.name: resource_addresses(compiled_templates, [data for data in get_terraform_data(region)
+                                                             if data.REGION_AZ_REPLACE_ME in involved],
+                                        per_az_only=True)
+        for region in restarted if region.name in applied}
+    destroy_failures = run_stacks(destroy_terraform, destroy_targets, max_parallel_regions)
+
+    render(restarted, compiled_templates)
+    applied_names = {region.name for region in apply_regions([region for region in restarted
+                                                              if region.name not in destroy_failures],
+                                                             max_parallel_regions)}
+
+    # Pairs with an AZ in a region that failed to apply are left for the next resume
+    az_regions = {az.name: region.name for region in regions for az in region.azs}
+    pairs = [(from_az, to_az) for from_az, to_az in remaining
+             if az_regions[from_az.name] in applied_names and az_regions[to_az.name] in applied_names]
+    involved = {az.name for pair in pairs for az in pair}
+    resumed = [AwsRegion(region.name, [az for az in region.azs if az.name in involved])
+               for region in restarted if any(az.name in involved for az in region.azs)]
+    # Control messages of the run's earlier seeds must not finish the resumed regions
+    save_run(replace(run, seeded_at=time.time()))
+    seed_regions(resumed, plan=plan_pairs(pairs), run_id=run.run_id)
+
+    if len(pairs) < len(remaining):
+        failed_region_names = sorted({region.name for region in restarted} - applied_names)
+        raise ValueError(f'Regions failed to apply: {", ".join(failed_region_names)}; resume again to measure '
+                         f'their {len(remaining) - len(pairs)} pairs.')
+
+    return resumed
+
+
+@instrumentation.traced('stage', stage='coordinate')
+def coordinate(regions: List[AwsRegion], region_timeout_seconds: float, max_parallel_regions: int) -> None:
+    """Follow the last seeded run through the control queue, destroying every region's stack as soon as it
+    finishes."""
+    from coordinator import RunCoordinator
+
+    run = load_run()
+    coordinator = RunCoordinator(regions, get_terraform_output('sqs_control_queue_url'), destroy_terraform,
+                                 timeout_seconds=region_timeout_seconds,
+                                 max_parallel_teardowns=max_parallel_regions,
+                                 run_id=run.run_id if run else None, seeded_at=run.seeded_at if run else None)
+    progress = coordinator.run()
+
+    # Torn down regions have to be applied again by the next reconcile
+    applied = load_applied_regions()
+    for region_name, region_progress in progress.items():
+        if region_progress.torn_down_at is not None:
+            applied.pop(region_name, None)
+    save_applied_regions(list(applied.values()))
+
+
+@instrumentation.traced('stage', stage='report')
+def report(table_name: Optional[str], output_dir: Optional[str], endpoint_url: Optional[str]) -> None:
+    """Write the reports of the metrics table."""
+    from az_index import get_az_index
+    from report import REPORT_DIR, scan_table, write_reports
+
+    table_name = table_name or get_terraform_output('ec2_instance_metrics_table_name')
+    write_reports(scan_table(table_name, endpoint_url=endpoint_url), get_az_index(), output_dir or REPORT_DIR)
+
+
+def agent_settings_of(args: argparse.Namespace) -> Dict[str, Any]:
+    """Return the agent settings given on the command line."""
+    return {'agent_mode': args.agent_mode, 'agent_period_seconds': args.agent_period}
+
+
+def main(reconcile: bool = False, max_parallel_regions: int = MAX_PARALLEL_STACKS, coordinate_run: bool = False,
+         region_timeout_seconds: float = REGION_TIMEOUT_SECONDS,
+         agent_settings: Optional[Dict[str, Any]] = None, shard: Optional[Union[int, str]] = None,
+         max_pairs_per_instance: int = DEFAULT_MAX_PAIRS_PER_INSTANCE) -> None:
+    """Run every stage.
+
+    By default everything is destroyed and re-applied; with `reconcile` only regions that were added,
+    removed or changed since the last apply are touched. Regions are applied as separate Terraform stacks,
+    up to `max_parallel_regions` at a time, and a failing region does not stop the others. With
+    `coordinate_run` the run is followed to its end and every region is destroyed as soon as it finishes or
+    stalls. Agents in daemon mode never finish, so they cannot be coordinated. With a `shard`, that shard of
+    the global plan over the applied regions is measured (see `seed`), or with `ALL_SHARDS` every shard one
+    after another on the same instances (see `seed_shards`).
+    """
+    if coordinate_run and (agent_settings or {}).get('agent_mode') == 'daemon':
+        raise ValueError('Daemon agents never finish; run them without --coordinate and destroy them when done.')
+
+    regions = discover()
+    compiled_templates = compile_templates()
+
+    if reconcile:
+        newly_applied = apply(regions, max_parallel_regions, reconcile=True, agent_settings=agent_settings)
+    else:
+        if os.path.isdir(TERRAFORM_DIR):
+            destroy_all(max_parallel_regions)
+
+        region_names = {region.name for region in regions}
+        for stack in region_stacks():
+            if stack not in region_names:
+                shutil.rmtree(stack_dir(stack))
 
-def generate_terraform_file(template_str: str,
-                            data: Optional[TerraformRegionData],
-                            terraform_template: TerraformTemplate) -> None:
-    """Generate a Terraform file from the given template and data."""
-    template = template_str
-    if data:
-        for param in data.__dict__:
-            template = template.replace(param, str(getattr(data, param)))
+        render(regions, compiled_templates)
+        newly_applied = apply(regions, max_parallel_regions, agent_settings=agent_settings)
 
-    if terraform_template.template_type == TerraformTemplateType.PER_AZ:
-        assert data  # nosec (remove bandit warning)
-        prefix = data.REGION_AZ_REPLACE_ME
-    elif terraform_template.template_type == TerraformTemplateType.PER_REGION:
-        assert data  # nosec (remove bandit warning)
-        prefix = data.REGION_NAME_REPLACE_ME
+    if shard == ALL_SHARDS:
+        seed_shards(newly_applied, region_timeout_seconds, max_pairs_per_instance)
     else:
-        prefix = 'global'
-
-    with open(f'tf/{prefix}-{terraform_template.file_name.replace(".tpl", "")}', 'w', encoding='utf-8') \
-            as terraform_file:
-        terraform_file.write(template)
-
-
-def run_terraform() -> None:
-    """Run terraform."""
-    with subprocess.Popen(['terraform', 'init'],  # nosec (remove bandit warning)
-                          cwd='tf', stdout=subprocess.PIPE, stderr=subprocess.PIPE) as process:
-        _, stderr = process.communicate()
-        if process.returncode != 0:
-            sys.stderr.write(stderr.decode('utf-8'))
-            raise ValueError('terraform init failed in tf.')
-
-    sys.stdout.write('Terraform init successful.\n')
-
-    with subprocess.Popen(['terraform', 'apply', '-auto-approve', '-parallelism=50'],  # nosec (remove bandit warning)
-                          cwd='tf', stdout=subprocess.PIPE, stderr=subprocess.PIPE) as process:
-        _, stderr = process.communicate()
-        if process.returncode != 0:
-            sys.stderr.write(stderr.decode('utf-8'))
-            raise ValueError('terraform apply -auto-approve failed in tf.')
-
-    sys.stdout.write('Terraform apply successful.\n')
-
-
-def destroy_terraform() -> None:
-    """Run terraform."""
-    with subprocess.Popen(['terraform', 'destroy', '-auto-approve', '-parallelism=50'],  # nosec (remove bandit warning)
-                          cwd='tf', stdout=subprocess.PIPE, stderr=subprocess.PIPE) as process:
-        _, stderr = process.communicate()
-        if process.returncode != 0:
-            sys.stderr.write(stderr.decode('utf-8'))
-            raise ValueError('terraform destroy -auto-approve failed in tf.')
-
-    sys.stdout.write('Terraform destroy successful.\n')
-
-
-def main() -> None:
-    """Run the main logic."""
-    regions = all_regions()
-
-    with open('regions.pickle', 'wb') as regions_pickle_file:
-        pickle.dump(regions, regions_pickle_file)
-
-    # with open('regions.pickle', 'rb') as regions_pickle_file:
-    #     regions: List[AwsRegion] = pickle.load(regions_pickle_file)  # nosec (remove bandit warning)
-
-    terraform_data: Dict[str, List[TerraformRegionData]] = {}
-    for region in regions:
-        terraform_data[region.name] = []
-        for az in region.azs:
-            terraform_data[region.name].append(TerraformRegionData(region.name,
-                                                                   get_region_alias(region.name),
-                                                                   az.ubuntu_ami,
-                                                                   az.name,
-                                                                   't3.micro'))
-
-    templates = [TerraformTemplate('ec2_instance', TerraformTemplateType.PER_AZ),
-                 TerraformTemplate('ec2_instance_key_pair', TerraformTemplateType.PER_REGION),
-                 TerraformTemplate('ec2_instance_role', TerraformTemplateType.GLOBAL),
-                 TerraformTemplate('dynamodb_table', TerraformTemplateType.GLOBAL),
-                 TerraformTemplate('output_dynamodb_table', TerraformTemplateType.GLOBAL),
-                 TerraformTemplate('provider', TerraformTemplateType.PER_REGION),
-                 TerraformTemplate('security_group', TerraformTemplateType.PER_REGION),
-                 TerraformTemplate('sqs_queue', TerraformTemplateType.PER_AZ),
-                 TerraformTemplate('sqs_control_queue', TerraformTemplateType.GLOBAL),
-                 TerraformTemplate('output_ec2_instance', TerraformTemplateType.PER_AZ),
-                 TerraformTemplate('output_sqs', TerraformTemplateType.PER_AZ)]
-
-    if os.path.exists('tf') and os.path.isdir('tf'):
-        destroy_terraform()
-
-    shutil.rmtree('tf', ignore_errors=True)
-    os.makedirs('tf', exist_ok=True)
-
-    for template in templates:
-        with open(f'templates/{template.file_name}', encoding='utf-8') as terraform_template_file:
-            original_terraform_template = terraform_template_file.read()
-            if template.template_type == TerraformTemplateType.PER_REGION:
-                for region_azs in terraform_data.values():
-                    generate_terraform_file(original_terraform_template, region_azs[0],
-                                            template)
-            elif template.template_type == TerraformTemplateType.PER_AZ:
-                for region_azs in terraform_data.values():
-                    for az_data in region_azs:
-                        generate_terraform_file(original_terraform_template, az_data, template)
-            elif template.template_type == TerraformTemplateType.GLOBAL:
-                generate_terraform_file(original_terraform_template, None, template)
-
-    run_terraform()
-
-    for region in regions:
-        write_azs_to_dynamodb(region)
+        seed(newly_applied, shard, max_pairs_per_instance)
+
+    applied_record = load_applied_regions()
+    failed_region_names = [region.name for region in regions if applied_record.get(region.name) != region]
+
+    if coordinate_run:
+        coordinate(newly_applied, region_timeout_seconds, max_parallel_regions)
+
+    if failed_region_names:
+        raise ValueError(f'Regions failed to apply: {", ".join(failed_region_names)}.')
+
+
+def shard_argument(value: str) -> Union[int, str]:
+    """Parse a shard number or `all`."""
+    if value == ALL_SHARDS:
+        return value
+
+    try:
+        return int(value)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(f'invalid shard: {value!r}') from error
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Return the command line parser."""
+    parallel = argparse.ArgumentParser(add_help=False)
+    parallel.add_argument('--max-parallel-regions', type=int, default=MAX_PARALLEL_STACKS,
+                          help='maximum number of region stacks applied or destroyed at the same time')
+    regions = argparse.ArgumentParser(add_help=False)
+    regions.add_argument('--regions', nargs='+', metavar='REGION', help='only these regions')
+    timeout = argparse.ArgumentParser(add_help=False)
+    timeout.add_argument('--region-timeout', type=float, default=REGION_TIMEOUT_SECONDS,
+                         help='seconds without progress after which a region is considered stalled')
+    agent = argparse.ArgumentParser(add_help=False)
+    agent.add_argument('--agent-mode', choices=AGENT_MODES, default='once',
+                       help='measure every pair once, or keep measuring them as a daemon')
+    agent.add_argument('--agent-period', type=float, default=300,
+                       help='seconds between a daemon agent\'s measurement cycles')
+    pairs = argparse.ArgumentParser(add_help=False)
+    pairs.add_argument('--global-shard', type=shard_argument, metavar='SHARD',
+                       help='measure this shard of all AZ pairs across regions instead of each region\'s own pairs, '
+                            'or "all" for every shard one after another; instances that finished a shard wait for '
+                            'the next one to be seeded')
+    pairs.add_argument('--max-pairs-per-instance', type=int, default=DEFAULT_MAX_PAIRS_PER_INSTANCE,
+                       help='maximum number of pairs an instance takes part in per shard of the global plan')
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', metavar='COMMAND')
+
+    run_parser = subparsers.add_parser('run', parents=[parallel, timeout, agent, pairs],
+                                       help='run every stage (the default)')
+    run_parser.add_argument('--reconcile', action='store_true',
+                            help='only apply regions and AZs that changed since the last run')
+    run_parser.add_argument('--coordinate', action='store_true',
+                            help='wait for the measurements and destroy every region as soon as it is done')
+
+    discover_parser = subparsers.add_parser('discover', help='discover regions, AZs and AMIs')
+    discover_parser.add_argument('--refresh', action='store_true', help='ignore the cached topology')
+
+    subparsers.add_parser('render', parents=[regions], help='render the discovered regions\' Terraform stacks')
+
+    apply_parser = subparsers.add_parser('apply', parents=[parallel, regions, agent],
+                                         help='apply the global stack and the rendered region stacks')
+    apply_parser.add_argument('--reconcile', action='store_true',
+                              help='only apply regions and AZs that changed since the last apply')
+
+    subparsers.add_parser('seed', parents=[regions, timeout, pairs],
+                          help='write the applied regions\' instructions and start them')
+    resume_parser = subparsers.add_parser('resume', parents=[parallel, timeout],
+                                          help='measure the pairs of the last run that are not done yet')
+    resume_parser.add_argument('--coordinate', action='store_true',
+                               help='wait for the measurements and destroy every region as soon as it is done')
+    subparsers.add_parser('coordinate', parents=[parallel, regions, timeout],
+                          help='follow the run and destroy every region as soon as it is done')
+    subparsers.add_parser('destroy', parents=[parallel, regions],
+                          help='destroy the given region stacks, or everything including the global stack')
+
+    report_parser = subparsers.add_parser('report', help='write reports of the measurements')
+    report_parser.add_argument('--table', help='metrics table name (defaults to the Terraform output)')
+    report_parser.add_argument('--output-dir', help='directory to write the reports to')
+    report_parser.add_argument('--endpoint-url', help='DynamoDB endpoint, e.g. a local stand-in')
+
+    return parser
+
+
+def run_command(args: argparse.Namespace) -> None:
+    """Run the stage selected on the command line."""
+    if args.command == 'run':
+        main(args.reconcile, args.max_parallel_regions, args.coordinate, args.region_timeout, agent_settings_of(args),
+             args.global_shard, args.max_pairs_per_instance)
+    elif args.command == 'discover':
+        discover(args.refresh)
+    elif args.command == 'render':
+        render(select_regions(discovered_regions(), args.regions), compile_templates())
+    elif args.command == 'apply':
+        apply(select_regions(discovered_regions(), args.regions), args.max_parallel_regions, args.reconcile,
+              agent_settings_of(args))
+    elif args.command == 'seed':
+        if args.global_shard == ALL_SHARDS:
+            seed_shards(select_regions(applied_regions(), args.regions), args.region_timeout,
+                        args.max_pairs_per_instance)
+        else:
+            seed(select_regions(applied_regions(), args.regions), args.global_shard, args.max_pairs_per_instance)
+    elif args.command == 'resume':
+        resumed = resume(args.max_parallel_regions)
+        if args.coordinate:
+            coordinate(resumed, args.region_timeout, args.max_parallel_regions)
+    elif args.command == 'coordinate':
+        coordinate(select_regions(applied_regions(), args.regions), args.region_timeout, args.max_parallel_regions)
+    elif args.command == 'destroy':
+        if args.regions:
+            destroy_regions(args.regions, args.max_parallel_regions)
+        else:
+            destroy_all(args.max_parallel_regions)
+    elif args.command == 'report':
+        report(args.table, args.output_dir, args.endpoint_url)
 
 
 if __name__ == '__main__':
-    main()
+    argv = sys.argv[1:]
+    # `main.py [--reconcile] ...` keeps running every stage
+    if not argv or (argv[0].startswith('-') and argv[0] not in ('-h', '--help')):
+        argv = ['run', *argv]
+
+    try:
+        run_command(build_parser().parse_args(argv))
+    finally:
+        instrumentation.flush()
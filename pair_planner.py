@@ -0,0 +1,141 @@
+"""Planning of measurement pairs across all regions, sharded into runs that fit per-instance limits.
+
+The global plan covers every AZ against itself and every pair of AZs, in and across regions. Pairs are
+arranged into rounds of disjoint pairs with the circle method over all AZs in region and name order, so an
+instance takes part in at most one pair at a time (iperf3 servers only serve one test at a time), and the
+first AZ of each pair in that order measures the second, which keys the metrics table the same way as the
+per-region plan. The rounds are split into shards; each shard is seeded as a run of its own onto the same
+instances, which measure it once they finished the previous one, and writes into the same metrics table.
+
+Instances synchronize pairwise instead of region-wide: at the end of a round each AZ only waits for its
+partners of this round and the next one, so the number of barrier messages grows linearly with the AZs.
+"""
+
+import math
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+from synchronization import AwsAZ, AwsRegion, RegionInstructions, round_robin
+
+
+# About 25 seconds per pair keeps a shard of a full run under 15 minutes
+DEFAULT_MAX_PAIRS_PER_INSTANCE = 32
+
+
+@dataclass
+class PairPlan:
+    """Rounds of disjoint AZ pairs, in which the first AZ of each pair measures the second."""
+
+    rounds: List[List[Tuple[AwsAZ, AwsAZ]]]
+
+    @property
+    def pair_count(self) -> int:
+        """Return the number of pairs in the plan."""
+        return sum(len(round_pairs) for round_pairs in self.rounds)
+
+    def pairs(self) -> List[Tuple[AwsAZ, AwsAZ]]:
+        """Return every pair of the plan, round by round."""
+        return [pair for round_pairs in self.rounds for pair in round_pairs]
+
+    def pairs_per_az(self) -> Counter:
+        """Return how many pairs every AZ takes part in, either measuring or being measured."""
+        counts: Counter = Counter()
+        for round_pairs in self.rounds:
+            for from_az, to_az in round_pairs:
+                counts[from_az.name] += 1
+                if to_az is not from_az:
+                    counts[to_az.name] += 1
+        return counts
+
+    def shard(self, max_pairs_per_instance: int = DEFAULT_MAX_PAIRS_PER_INSTANCE) -> List['PairPlan']:
+        """Split the plan into the fewest shards in which no AZ takes part in more than `max_pairs_per_instance`
+        pairs, with round counts that differ by at most one."""
+        if max_pairs_per_instance < 1:
+            raise ValueError('max_pairs_per_instance must be at least 1.')
+
+        # Every AZ is in at most one pair per round, so capping the rounds caps the pairs
+        shard_count = max(1, math.ceil(len(self.rounds) / max_pairs_per_instance))
+        shard_rounds, extra_rounds = divmod(len(self.rounds), shard_count)
+
+        shards = []
+        start = 0
+        for shard_idx in range(shard_count):
+            end = start + shard_rounds + (shard_idx < extra_rounds)
+            shards.append(PairPlan(self.rounds[start:end]))
+            start = end
+
+        return shards
+
+
+def plan_global_pairs(regions: List[AwsRegion], include_self: bool = True) -> PairPlan:
+    """Return a plan of every AZ pair across the given regions, starting with every AZ against itself."""
+    azs = [az for region in sorted(regions, key=lambda region: region.name) for az in region.azs]
+
+    rounds = [[(az, az) for az in azs]] if include_self else []
+    rounds.extend(round_robin(azs))
+    return PairPlan(rounds)
+
+
+def plan_pairs(pairs: List[Tuple[AwsAZ, AwsAZ]]) -> PairPlan:
+    """Return a plan of the given pairs, each put into the first round in which neither of its AZs is busy.
+
+    Used for arbitrary subsets of pairs, such as the unfinished pairs of a resumed run.
+    """
+    rounds: List[List[Tuple[AwsAZ, AwsAZ]]] = []
+    busy: List[Set[str]] = []
+    for from_az, to_az in pairs:
+        round_idx = next((idx for idx, round_busy in enumerate(busy)
+                          if from_az.name not in round_busy and to_az.name not in round_busy), len(rounds))
+        if round_idx == len(rounds):
+            rounds.append([])
+            busy.append(set())
+
+        rounds[round_idx].append((from_az, to_az))
+        busy[round_idx].update((from_az.name, to_az.name))
+
+    return PairPlan(rounds)
+
+
+def build_plan_instructions(plan: PairPlan, regions: List[AwsRegion],
+                            endpoints: Dict[str, Tuple[Dict[str, str], Dict[str, str]]]) -> List[RegionInstructions]:
+    """Build the instruction items of every AZ for a plan.
+
+    `endpoints` maps every region to the public IPs and SQS queues of its AZs. Besides the fields of the
+    per-region instructions, every item lists the queues to synchronize with at the end of each round, and
+    `peer_queues` is only used for a final region-wide barrier before the leader reports the region done.
+    """
+    az_ips = {az_name: ip for ips, _ in endpoints.values() for az_name, ip in ips.items()}
+    az_queues = {az_name: queue for _, queues in endpoints.values() for az_name, queue in queues.items()}
+
+    round_count = len(plan.rounds)
+    measures: Dict[str, List[str]] = {az_name: [''] * round_count for az_name in az_ips}
+    partners: Dict[str, List[Optional[str]]] = {az_name: [None] * (round_count + 1) for az_name in az_ips}
+    for round_idx, round_pairs in enumerate(plan.rounds):
+        for from_az, to_az in round_pairs:
+            measures[from_az.name][round_idx] = to_az.name
+            if to_az is not from_az:
+                partners[from_az.name][round_idx] = to_az.name
+                partners[to_az.name][round_idx] = from_az.name
+
+    instructions = []
+    for region in regions:
+        items = []
+        for idx, az in enumerate(region.azs):
+            az_partners = partners[az.name]
+            # This round's partner must be done measuring, and the next round's partner must be free
+            round_peer_queues = [','.join(az_queues[peer] for peer in sorted({az_partners[round_idx],
+                                                                              az_partners[round_idx + 1]} - {None}))
+                                 for round_idx in range(round_count)]
+            items.append({
+                'availability_zone': az.name,
+                'availability_zone_id': az.id,
+                'rounds': ','.join(f'{az_ips[to_az]}:{to_az}' if to_az else '' for to_az in measures[az.name]),
+                'round_peer_queues': '|'.join(round_peer_queues),
+                'peer_queues': ','.join(az_queues[peer.name] for peer in region.azs if peer.name != az.name),
+                'is_leader': idx == 0,
+            })
+
+        instructions.append(RegionInstructions(region, items, [az_queues[az.name] for az in region.azs]))
+
+    return instructions
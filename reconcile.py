@@ -0,0 +1,86 @@
+"""Incremental reconciliation of deployed regions against newly discovered ones."""
+
+import json
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from rendering import CompiledTemplate, TerraformRegionData, TerraformTemplateType
+from synchronization import AwsAZ, AwsRegion
+
+
+APPLIED_REGIONS_PATH = os.path.join('tf', 'applied-regions.json')
+RESOURCE_PATTERN = re.compile(r'^resource "([^"]+)" "([^"]+)"', re.MULTILINE)
+
+
+@dataclass
+class RegionsDiff:
+    """Represents the difference between the applied regions and the discovered ones."""
+
+    added: List[AwsRegion] = field(default_factory=list)
+    removed: List[AwsRegion] = field(default_factory=list)
+    # Both the applied and the discovered definition of every changed region
+    changed: List[AwsRegion] = field(default_factory=list)
+    changed_applied: List[AwsRegion] = field(default_factory=list)
+
+    @property
+    def is_empty(self) -> bool:
+        """Return whether nothing needs to be reconciled."""
+        return not (self.added or self.removed or self.changed)
+
+
+def load_applied_regions(path: str = APPLIED_REGIONS_PATH) -> Dict[str, AwsRegion]:
+    """Return the regions recorded by the last successful apply."""
+    try:
+        with open(path, encoding='utf-8') as applied_file:
+            data = json.load(applied_file)
+    except FileNotFoundError:
+        return {}
+
+    return {region_name: AwsRegion(region_name, [AwsAZ(**az) for az in azs]) for region_name, azs in data.items()}
+
+
+def save_applied_regions(regions: List[AwsRegion], path: str = APPLIED_REGIONS_PATH) -> None:
+    """Record the regions that were successfully applied."""
+    data = {region.name: [{'name': az.name, 'id': az.id, 'ubuntu_ami': az.ubuntu_ami} for az in region.azs]
+            for region in regions}
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as applied_file:
+        json.dump(data, applied_file, indent=2)
+
+
+def diff_regions(applied: Dict[str, AwsRegion], regions: List[AwsRegion]) -> RegionsDiff:
+    """Return which regions were added, removed or changed since the last apply."""
+    diff = RegionsDiff()
+    discovered_names = {region.name for region in regions}
+
+    for region in regions:
+        if region.name not in applied:
+            diff.added.append(region)
+        elif applied[region.name] != region:
+            diff.changed.append(region)
+            diff.changed_applied.append(applied[region.name])
+
+    diff.removed = [region for region_name, region in applied.items() if region_name not in discovered_names]
+
+    return diff
+
+
+def resource_addresses(compiled_templates: List[CompiledTemplate],
+                       region_azs: List[TerraformRegionData],
+                       per_az_only: bool = False) -> List[str]:
+    """Return the Terraform addresses of the resources a region's templates declare.
+
+    With `per_az_only`, resources shared by the whole region (key pair, security groups) are left out.
+    """
+    rendered = []
+    for compiled in compiled_templates:
+        if compiled.template.template_type == TerraformTemplateType.PER_AZ:
+            rendered.extend(compiled.render(az_data) for az_data in region_azs)
+        elif compiled.template.template_type == TerraformTemplateType.PER_REGION and not per_az_only:
+            rendered.append(compiled.render(region_azs[0]))
+
+    return [f'{resource_type}.{resource_name}'
+            for resource_type, resource_name in RESOURCE_PATTERN.findall('\n'.join(rendered))]
@@ -0,0 +1,163 @@
+"""Rendering of Terraform templates."""
+
+import hashlib
+import os
+import re
+from dataclasses import dataclass, fields
+from enum import Enum
+from typing import Dict, List, Optional
+
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+TERRAFORM_DIR = 'tf'
+GLOBAL_STACK = 'global'
+
+
+def get_region_alias(region: str) -> str:
+    """Return the Terraform alias for the given region."""
+    return region.replace('-', '_')
+
+
+@dataclass
+class TerraformRegionData:
+    """Represents Terraform data for a region."""
+
+    REGION_NAME_REPLACE_ME: str
+    REGION_ALIAS_REPLACE_ME: str
+    REGION_AMI_REPLACE_ME: str
+    REGION_AZ_REPLACE_ME: str
+    REGION_AZ_ID_REPLACE_ME: str
+    INSTANCE_TYPE_REPLACE_ME: str
+
+    def __post_init__(self) -> None:
+        """Post init - us-east-1e doesn't have t3.micro available."""
+        if self.REGION_AZ_REPLACE_ME == 'us-east-1e':
+            self.INSTANCE_TYPE_REPLACE_ME = 't2.micro'
+
+
+# Longest names first so that no placeholder can shadow another one it is a prefix of
+PLACEHOLDER_PATTERN = re.compile('(' + '|'.join(sorted((field.name for field in fields(TerraformRegionData)),
+                                                       key=len, reverse=True)) + ')')
+
+
+class TerraformTemplateType(Enum):
+    """Represents the type of Terraform template."""
+
+    PER_AZ = 1
+    PER_REGION = 2
+    GLOBAL = 3
+
+
+@dataclass
+class TerraformTemplate:
+    """Represents Terraform template data."""
+
+    name: str
+    template_type: TerraformTemplateType
+
+    @property
+    def file_name(self) -> str:
+        """Return the name of the template."""
+        return f'{self.name}.tpl.tf'
+
+
+TEMPLATES = [TerraformTemplate('global_provider', TerraformTemplateType.GLOBAL),
+             TerraformTemplate('variables', TerraformTemplateType.PER_REGION),
+             TerraformTemplate('ec2_instance', TerraformTemplateType.PER_AZ),
+             TerraformTemplate('ec2_instance_key_pair', TerraformTemplateType.PER_REGION),
+             TerraformTemplate('ec2_instance_role', TerraformTemplateType.GLOBAL),
+             TerraformTemplate('dynamodb_table', TerraformTemplateType.GLOBAL),
+             TerraformTemplate('output_dynamodb_table', TerraformTemplateType.GLOBAL),
+             TerraformTemplate('provider', TerraformTemplateType.PER_REGION),
+             TerraformTemplate('security_group', TerraformTemplateType.PER_REGION),
+             TerraformTemplate('sqs_queue', TerraformTemplateType.PER_AZ),
+             TerraformTemplate('sqs_control_queue', TerraformTemplateType.GLOBAL),
+             TerraformTemplate('output_sqs_control_queue', TerraformTemplateType.GLOBAL),
+             TerraformTemplate('output_ec2_instance_role', TerraformTemplateType.GLOBAL),
+             TerraformTemplate('agent_bundle_bucket', TerraformTemplateType.GLOBAL),
+             TerraformTemplate('output_agent_bundle_bucket', TerraformTemplateType.GLOBAL),
+             TerraformTemplate('output_ec2_instance', TerraformTemplateType.PER_AZ),
+             TerraformTemplate('output_sqs', TerraformTemplateType.PER_AZ)]
+
+
+class CompiledTemplate:
+    """A Terraform template pre-split into literal text and placeholders.
+
+    Even positions of `segments` hold literal text and odd positions hold placeholder names, so rendering
+    is a single join instead of one `str.replace` pass per placeholder.
+    """
+
+    def __init__(self, template: TerraformTemplate, source: str) -> None:
+        """Compile the given template source."""
+        self.template = template
+        self.segments = PLACEHOLDER_PATTERN.split(source)
+
+    @classmethod
+    def load(cls, template: TerraformTemplate, templates_dir: str = TEMPLATES_DIR) -> 'CompiledTemplate':
+        """Read and compile a template from the templates directory."""
+        with open(os.path.join(templates_dir, template.file_name), encoding='utf-8') as terraform_template_file:
+            return cls(template, terraform_template_file.read())
+
+    def render(self, data: Optional[TerraformRegionData]) -> str:
+        """Render the template with the given data."""
+        if len(self.segments) == 1:
+            return self.segments[0]
+
+        if data is None:
+            raise ValueError(f'Template {self.template.name} has placeholders but no data was given.')
+
+        values = vars(data)
+        rendered = list(self.segments)
+        rendered[1::2] = [str(values[placeholder]) for placeholder in self.segments[1::2]]
+        return ''.join(rendered)
+
+
+def compile_templates(templates_dir: str = TEMPLATES_DIR) -> List[CompiledTemplate]:
+    """Read and compile all templates."""
+    return [CompiledTemplate.load(template, templates_dir) for template in TEMPLATES]
+
+
+def render_terraform_files(terraform_data: Dict[str, List[TerraformRegionData]],
+                           compiled_templates: List[CompiledTemplate]) -> Dict[str, str]:
+    """Render all templates into one `main.tf` for the global stack and one for every region's stack.
+
+    Returns a mapping of file path, relative to the Terraform directory, to content.
+    """
+    global_blocks = [compiled.render(None) for compiled in compiled_templates
+                     if compiled.template.template_type == TerraformTemplateType.GLOBAL]
+    files = {os.path.join(GLOBAL_STACK, 'main.tf'): '\n'.join(global_blocks)}
+
+    for region_name, region_azs in terraform_data.items():
+        region_blocks = []
+        for compiled in compiled_templates:
+            if compiled.template.template_type == TerraformTemplateType.PER_REGION:
+                region_blocks.append(compiled.render(region_azs[0]))
+            elif compiled.template.template_type == TerraformTemplateType.PER_AZ:
+                region_blocks.extend(compiled.render(az_data) for az_data in region_azs)
+
+        files[os.path.join(region_name, 'main.tf')] = '\n'.join(region_blocks)
+
+    return files
+
+
+def write_terraform_files(files: Dict[str, str], directory: str = TERRAFORM_DIR) -> int:
+    """Write rendered files, skipping files whose content hash is unchanged.
+
+    Returns the number of files that were written.
+    """
+    written = 0
+    for file_name, content in files.items():
+        path = os.path.join(directory, file_name)
+        encoded = content.encode('utf-8')
+        try:
+            with open(path, 'rb') as terraform_file:
+                if hashlib.sha256(terraform_file.read()).digest() == hashlib.sha256(encoded).digest():
+                    continue
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with open(path, 'wb') as terraform_file:
+            terraform_file.write(encoded)
+        written += 1
+
+    return written
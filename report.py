@@ -0,0 +1,243 @@
+"""Report of the measured latencies and bandwidths, read straight from the metrics table."""
+
+import argparse
+import csv
+import io
+import json
+import math
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import boto3
+import numpy as np
+from boto3.dynamodb.types import TypeDeserializer
+
+import instrumentation
+from az_index import AzIndex, get_az_index
+
+
+REPORT_DIR = 'report'
+SCAN_SEGMENTS = 8
+# e.g. "us-east-1a" or "us-gov-west-1b"
+AZ_NAME_PATTERN = re.compile(r'\b[a-z]{2}(?:-[a-z]+)+-\d+[a-z]\b')
+
+
+@dataclass
+class PairMeasurement:
+    """Latency and bandwidth measured from one AZ to another."""
+
+    from_region: str
+    to_region: str
+    from_az: str
+    to_az: str
+    from_az_id: str
+    to_az_id: str
+    latency_ms: float
+    bandwidth_gbps: float
+
+    @property
+    def cross_region(self) -> bool:
+        """Return whether the two AZs are in different regions."""
+        return self.from_region != self.to_region
+
+
+@dataclass
+class RegionMatrices:
+    """Dense matrices of measurements, indexed by AZ ID (measuring AZ first)."""
+
+    az_ids: List[str]
+    latency_ms: np.ndarray
+    bandwidth_gbps: np.ndarray
+
+
+def scan_segment(dynamodb_client: Any, table_name: str, segment: int, total_segments: int) -> List[Dict[str, Any]]:
+    """Return every item of one segment of a parallel scan."""
+    deserializer = TypeDeserializer()
+    items = []
+    scan_kwargs: Dict[str, Any] = {'TableName': table_name, 'Segment': segment, 'TotalSegments': total_segments}
+    while True:
+        response = dynamodb_client.scan(**scan_kwargs)
+        items.extend({key: deserializer.deserialize(value) for key, value in item.items()}
+                     for item in response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return items
+
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def scan_table(table_name: str, segments: int = SCAN_SEGMENTS, region_name: str = 'us-east-1',
+               endpoint_url: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Return every item of a table, scanning `segments` segments concurrently."""
+    session = boto3.session.Session()
+    # Clients are created up front because client creation on a shared session is not thread-safe
+    clients = [instrumentation.instrument_client(session.client('dynamodb', region_name=region_name,
+                                                                endpoint_url=endpoint_url))
+               for _ in range(segments)]
+
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        segment_items = executor.map(lambda segment: scan_segment(clients[segment], table_name, segment, segments),
+                                     range(segments))
+        return [item for items in segment_items for item in items]
+
+
+def translate_az_names(text: str, az_name_to_id: Dict[str, str]) -> str:
+    """Replace every known AZ name in the text by its AZ ID, in a single pass."""
+    return AZ_NAME_PATTERN.sub(lambda match: az_name_to_id.get(match.group(), match.group()), text)
+
+
+def pair_measurements(items: List[Dict[str, Any]], az_index: AzIndex) -> List[PairMeasurement]:
+    """Return the measurements of the metrics table items, sorted from the highest latency down."""
+    measurements = []
+    for item in items:
+        from_az, to_az = item['availability_zone_from'], item['availability_zone_to']
+        if from_az not in az_index or to_az not in az_index:
+            sys.stderr.write(f'Skipping measurement between unknown AZs {from_az} and {to_az}.\n')
+            continue
+
+        bandwidth = item.get('bandwidth_gbps')
+        measurements.append(PairMeasurement(from_region=az_index.region_of(from_az),
+                                            to_region=az_index.region_of(to_az),
+                                            from_az=from_az,
+                                            to_az=to_az,
+                                            from_az_id=az_index.id_of(from_az),
+                                            to_az_id=az_index.id_of(to_az),
+                                            latency_ms=float(item['network_latency_ms']),
+                                            bandwidth_gbps=float(bandwidth) if bandwidth is not None else math.nan))
+
+    return sorted(measurements, key=lambda measurement: (-measurement.latency_ms, measurement.from_az_id,
+                                                         measurement.to_az_id))
+
+
+def pair_matrices(measurements: List[PairMeasurement]) -> RegionMatrices:
+    """Return the latency and bandwidth matrices of the measurements, NaN where a pair was not measured."""
+    az_ids = sorted({az_id for measurement in measurements
+                     for az_id in (measurement.from_az_id, measurement.to_az_id)})
+    matrices = RegionMatrices(az_ids,
+                              np.full((len(az_ids), len(az_ids)), np.nan),
+                              np.full((len(az_ids), len(az_ids)), np.nan))
+
+    indices = {az_id: idx for idx, az_id in enumerate(az_ids)}
+    for measurement in measurements:
+        from_idx, to_idx = indices[measurement.from_az_id], indices[measurement.to_az_id]
+        matrices.latency_ms[from_idx, to_idx] = measurement.latency_ms
+        matrices.bandwidth_gbps[from_idx, to_idx] = measurement.bandwidth_gbps
+
+    return matrices
+
+
+def region_matrices(measurements: List[PairMeasurement]) -> Dict[str, RegionMatrices]:
+    """Return every region's matrices of the pairs measured within it, ignoring cross-region pairs."""
+    region_measurements: Dict[str, List[PairMeasurement]] = {}
+    for measurement in measurements:
+        if not measurement.cross_region:
+            region_measurements.setdefault(measurement.from_region, []).append(measurement)
+
+    return {region_name: pair_matrices(region_measurements[region_name])
+            for region_name in sorted(region_measurements)}
+
+
+def inter_region_matrices(measurements: List[PairMeasurement]) -> Optional[RegionMatrices]:
+    """Return the matrices of the pairs measured between regions, or None if there are none."""
+    cross_region = [measurement for measurement in measurements if measurement.cross_region]
+    return pair_matrices(cross_region) if cross_region else None
+
+
+def format_number(value: float) -> str:
+    """Format a measurement for the text reports."""
+    return '' if math.isnan(value) else f'{value:.2f}'
+
+
+def markdown_table(measurements: List[PairMeasurement]) -> List[str]:
+    """Return the lines of a markdown table of the measurements."""
+    lines = ['| availability_zone_from | availability_zone_to | Latency (ms) | Bandwidth (Gb/s) |',
+             '|------------------------|----------------------|--------------|------------------|']
+    lines.extend(f'| `{measurement.from_az_id}` | `{measurement.to_az_id}` | {format_number(measurement.latency_ms)} '
+                 f'| {format_number(measurement.bandwidth_gbps)} |' for measurement in measurements)
+    return lines
+
+
+def markdown_report(measurements: List[PairMeasurement]) -> str:
+    """Return the ranking as a markdown table, with the cross-region pairs ranked in a table of their own."""
+    intra_region = [measurement for measurement in measurements if not measurement.cross_region]
+    cross_region = [measurement for measurement in measurements if measurement.cross_region]
+    if not cross_region:
+        return '\n'.join(markdown_table(intra_region)) + '\n'
+
+    lines = ['## Within regions', '', *markdown_table(intra_region), '',
+             '## Between regions', '', *markdown_table(cross_region)]
+    return '\n'.join(lines) + '\n'
+
+
+def csv_report(measurements: List[PairMeasurement]) -> str:
+    """Return the ranking as CSV."""
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator='\n')
+    writer.writerow(['region_from', 'region_to', 'availability_zone_from', 'availability_zone_to', 'az_id_from',
+                     'az_id_to', 'latency_ms', 'bandwidth_gbps'])
+    writer.writerows([measurement.from_region, measurement.to_region, measurement.from_az, measurement.to_az, measurement.from_az_id,
+                      measurement.to_az_id, format_number(measurement.latency_ms),
+                      format_number(measurement.bandwidth_gbps)] for measurement in measurements)
+    return output.getvalue()
+
+
+def json_report(measurements: List[PairMeasurement], matrices: Dict[str, RegionMatrices],
+                inter_region: Optional[RegionMatrices] = None) -> str:
+    """Return the ranking, the per-region matrices and the inter-region matrices as JSON."""
+    def matrix_to_list(matrix: np.ndarray) -> List[List[Optional[float]]]:
+        return [[None if math.isnan(value) else round(float(value), 4) for value in row] for row in matrix]
+
+    def matrices_to_dict(region: RegionMatrices) -> Dict[str, Any]:
+        return {'az_ids': region.az_ids,
+                'latency_ms': matrix_to_list(region.latency_ms),
+                'bandwidth_gbps': matrix_to_list(region.bandwidth_gbps)}
+
+    return json.dumps({
+        'ranking': [{'region_from': measurement.from_region,
+                     'region_to': measurement.to_region,
+                     'az_id_from': measurement.from_az_id,
+                     'az_id_to': measurement.to_az_id,
+                     'latency_ms': round(measurement.latency_ms, 4),
+                     'bandwidth_gbps': None if math.isnan(measurement.bandwidth_gbps)
+                     else round(measurement.bandwidth_gbps, 4)}
+                    for measurement in measurements],
+        'regions': {region_name: matrices_to_dict(region) for region_name, region in matrices.items()},
+        'inter_region': matrices_to_dict(inter_region) if inter_region is not None else None,
+    }, indent=2)
+
+
+def write_reports(items: List[Dict[str, Any]], az_index: AzIndex, directory: str = REPORT_DIR) -> None:
+    """Write the markdown, CSV and JSON reports of the metrics table items."""
+    measurements = pair_measurements(items, az_index)
+    matrices = region_matrices(measurements)
+    inter_region = inter_region_matrices(measurements)
+
+    os.makedirs(directory, exist_ok=True)
+    reports = {'latencies.md': markdown_report(measurements),
+               'latencies.csv': csv_report(measurements),
+               'latencies.json': json_report(measurements, matrices, inter_region)}
+    for file_name, content in reports.items():
+        with open(os.path.join(directory, file_name), 'w', encoding='utf-8') as report_file:
+            report_file.write(content)
+
+    sys.stdout.write(f'Wrote reports of {len(measurements)} measurements in {len(matrices)} regions to '
+                     f'{directory}.\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write latency and bandwidth reports from the metrics table.')
+    parser.add_argument('--table', help='metrics table name (defaults to the Terraform output)')
+    parser.add_argument('--output-dir', default=REPORT_DIR, help='directory to write the reports to')
+    parser.add_argument('--segments', type=int, default=SCAN_SEGMENTS, help='number of parallel scan segments')
+    parser.add_argument('--endpoint-url', help='DynamoDB endpoint, e.g. a local stand-in')
+    args = parser.parse_args()
+
+    if args.table is None:
+        from terraform_runner import get_terraform_output
+        args.table = get_terraform_output('ec2_instance_metrics_table_name')
+
+    write_reports(scan_table(args.table, args.segments, endpoint_url=args.endpoint_url), get_az_index(),
+                  args.output_dir)
@@ -0,0 +1,306 @@
+"""Append-only columnar store of measurement runs, backed by memory-mapped NumPy arrays.
+
+Every column is a flat binary file of fixed-width values. Rows of one run are contiguous, and the bandwidth
+intervals (raw samples) of a row are a contiguous slice of the interval columns. Every row also points to
+the previous row of the same AZ pair, and `meta.json` to the last row of every pair, so a pair's history
+is read without touching any other pair's rows. `meta.json` records how many rows and intervals are
+committed; anything written past that (an interrupted append) is ignored and truncated by the next append.
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import boto3
+import numpy as np
+
+
+RESULTS_STORE_DIR = 'results'
+RESULTS_STORE_VERSION = 1
+# Column name -> dtype of the per-measurement columns
+ROW_COLUMNS = {
+    'run': '<u4',
+    'from_az': '<u2',
+    'to_az': '<u2',
+    'measured_at': '<f8',
+    'latency_mean_ms': '<f4',
+    'latency_min_ms': '<f4',
+    'latency_p50_ms': '<f4',
+    'latency_p90_ms': '<f4',
+    'latency_p99_ms': '<f4',
+    'latency_max_ms': '<f4',
+    'jitter_ms': '<f4',
+    'loss': '<f4',
+    'latency_ci_ms': '<f4',
+    'latency_samples': '<u4',
+    'bandwidth_gbps': '<f4',
+    'bandwidth_ci_gbps': '<f4',
+    'bandwidth_samples': '<u4',
+    'bandwidth_streams': '<u2',
+    'bandwidth_retransmits': '<u4',
+    'interval_offset': '<u8',
+    'interval_count': '<u4',
+    # Previous row of the same AZ pair, or -1
+    'pair_prev_row': '<i8',
+}
+# Column name -> dtype of the per-interval (raw bandwidth sample) columns
+INTERVAL_COLUMNS = {
+    'interval_end': '<f4',
+    'interval_gbps': '<f4',
+    'interval_retransmits': '<u4',
+}
+# Store column -> attribute of an `EC2InstanceMetrics` item; older items lack most of them
+ITEM_ATTRIBUTES = {
+    'measured_at': 'measured_at',
+    'latency_mean_ms': 'network_latency_ms',
+    'latency_min_ms': 'network_latency_min_ms',
+    'latency_p50_ms': 'network_latency_p50_ms',
+    'latency_p90_ms': 'network_latency_p90_ms',
+    'latency_p99_ms': 'network_latency_p99_ms',
+    'latency_max_ms': 'network_latency_max_ms',
+    'jitter_ms': 'network_jitter_ms',
+    'loss': 'network_loss',
+    'latency_ci_ms': 'network_latency_ci_ms',
+    'latency_samples': 'network_latency_samples',
+    'bandwidth_gbps': 'bandwidth_gbps',
+    'bandwidth_ci_gbps': 'bandwidth_ci_gbps',
+    'bandwidth_samples': 'bandwidth_samples',
+    'bandwidth_streams': 'bandwidth_streams',
+    'bandwidth_retransmits': 'bandwidth_retransmits',
+}
+
+
+def item_value(item: Dict[str, Any], attribute: str, dtype: str) -> Any:
+    """Return an item's attribute as a column value, NaN or 0 when it is missing."""
+    value = item.get(attribute)
+    if value is None:
+        return math.nan if np.dtype(dtype).kind == 'f' else 0
+
+    return float(value) if np.dtype(dtype).kind == 'f' else int(value)
+
+
+def pair_id(from_idx: int, to_idx: int) -> str:
+    """Return the key of an AZ pair in the store's index of the last row of every pair."""
+    return f'{from_idx},{to_idx}'
+
+
+def fingerprint_items(items: List[Dict[str, Any]]) -> str:
+    """Return a digest identifying a set of measurements, so that the same run is not ingested twice."""
+    keys = sorted(f'{item["availability_zone_from"]}|{item["availability_zone_to"]}|{item.get("measured_at")}|'
+                  f'{item.get("network_latency_ms")}|{item.get("bandwidth_gbps")}' for item in items)
+    return hashlib.sha256('\n'.join(keys).encode()).hexdigest()
+
+
+class ResultsStore:
+    """A directory of column files plus `meta.json`.
+
+    AZs are numbered densely in the order they are first seen, so `from_az`/`to_az` index straight into
+    per-run matrices. Columns are opened as read-only memory maps, so loading any amount of history costs
+    neither time nor memory until the data is touched.
+    """
+
+    def __init__(self, path: str = RESULTS_STORE_DIR) -> None:
+        """Open the store at `path`, creating it if needed."""
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.meta = self._load_meta()
+        self._az_indexes = {az_name: idx for idx, az_name in enumerate(self.meta['azs'])}
+
+    def _load_meta(self) -> Dict[str, Any]:
+        """Load the store's metadata, starting an empty store if there is none."""
+        try:
+            with open(os.path.join(self.path, 'meta.json'), encoding='utf-8') as meta_file:
+                meta = json.load(meta_file)
+        except FileNotFoundError:
+            return {'version': RESULTS_STORE_VERSION, 'azs': [], 'runs': [], 'rows': 0, 'intervals': 0,
+                    'pair_last_rows': {}}
+
+        if meta.get('version') != RESULTS_STORE_VERSION:
+            raise ValueError(f'Unsupported results store version {meta.get("version")} in {self.path}.')
+
+        return meta
+
+    def _save_meta(self) -> None:
+        """Atomically commit the store's metadata."""
+        path = os.path.join(self.path, 'meta.json')
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as meta_file:
+            json.dump(self.meta, meta_file, indent=2)
+        os.replace(tmp_path, path)
+
+    def _column_path(self, name: str) -> str:
+        """Return the file of a column."""
+        return os.path.join(self.path, f'{name}.bin')
+
+    @property
+    def azs(self) -> List[str]:
+        """Return the AZ names in index order."""
+        return self.meta['azs']
+
+    @property
+    def runs(self) -> List[Dict[str, Any]]:
+        """Return the metadata of every ingested run, oldest first."""
+        return self.meta['runs']
+
+    def az_index(self, az_name: str) -> int:
+        """Return the dense index of an AZ, assigning the next one to an AZ not seen before."""
+        if az_name not in self._az_indexes:
+            self._az_indexes[az_name] = len(self.meta['azs'])
+            self.meta['azs'].append(az_name)
+
+        return self._az_indexes[az_name]
+
+    def column(self, name: str) -> np.ndarray:
+        """Return a read-only memory map of a column's committed values."""
+        dtype = ROW_COLUMNS.get(name) or INTERVAL_COLUMNS[name]
+        length = self.meta['rows'] if name in ROW_COLUMNS else self.meta['intervals']
+        if length == 0:
+            return np.empty(0, dtype=dtype)
+
+        return np.memmap(self._column_path(name), dtype=dtype, mode='r', shape=(length,))
+
+    def _append_columns(self, columns: Dict[str, np.ndarray], dtypes: Dict[str, str], committed: int) -> None:
+        """Append values to column files, first dropping anything past the committed length."""
+        for name, dtype in dtypes.items():
+            with open(self._column_path(name), 'ab') as column_file:
+                column_file.truncate(committed * np.dtype(dtype).itemsize)
+                column_file.write(np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+                column_file.flush()
+                os.fsync(column_file.fileno())
+
+    def append_run(self, items: List[Dict[str, Any]], ingested_at: Optional[float] = None) -> Optional[int]:
+        """Append one run's `EC2InstanceMetrics` items, returning the new run's ID.
+
+        Returns None without writing anything when the same measurements were already ingested.
+        """
+        fingerprint = fingerprint_items(items)
+        if not items or any(run['fingerprint'] == fingerprint for run in self.runs):
+            return None
+
+        ingested_at = time.time() if ingested_at is None else ingested_at
+        run_id = len(self.runs)
+        rows, intervals = self.meta['rows'], self.meta['intervals']
+
+        row_values: Dict[str, List[Any]] = {name: [] for name in ROW_COLUMNS}
+        interval_values: Dict[str, List[Any]] = {name: [] for name in INTERVAL_COLUMNS}
+        last_rows = dict(self.meta['pair_last_rows'])
+        for row, item in enumerate(items, rows):
+            row_values['run'].append(run_id)
+            row_values['from_az'].append(self.az_index(item['availability_zone_from']))
+            row_values['to_az'].append(self.az_index(item['availability_zone_to']))
+            pair = pair_id(row_values['from_az'][-1], row_values['to_az'][-1])
+            row_values['pair_prev_row'].append(last_rows.get(pair, -1))
+            last_rows[pair] = row
+            for name, attribute in ITEM_ATTRIBUTES.items():
+                row_values[name].append(item_value(item, attribute, ROW_COLUMNS[name]))
+            if math.isnan(row_values['measured_at'][-1]):
+                row_values['measured_at'][-1] = ingested_at
+
+            interval_gbps = item.get('bandwidth_interval_gbps') or []
+            row_values['interval_offset'].append(intervals + len(interval_values['interval_gbps']))
+            row_values['interval_count'].append(len(interval_gbps))
+            interval_values['interval_end'].extend(float(end) for end in item.get('bandwidth_interval_ends') or [])
+            interval_values['interval_gbps'].extend(float(gbps) for gbps in interval_gbps)
+            interval_values['interval_retransmits'].extend(
+                int(retransmits) for retransmits in item.get('bandwidth_interval_retransmits') or [])
+
+        if len({len(values) for values in interval_values.values()}) > 1:
+            raise ValueError('Bandwidth interval attributes have different lengths.')
+
+        self._append_columns({name: np.asarray(values) for name, values in row_values.items()}, ROW_COLUMNS, rows)
+        self._append_columns({name: np.asarray(values) for name, values in interval_values.items()},
+                             INTERVAL_COLUMNS, intervals)
+
+        self.runs.append({'id': run_id, 'ingested_at': ingested_at, 'fingerprint': fingerprint,
+                          'rows': [rows, rows + len(items)],
+                          'intervals': [intervals, intervals + len(interval_values['interval_gbps'])]})
+        self.meta['rows'] += len(items)
+        self.meta['intervals'] += len(interval_values['interval_gbps'])
+        self.meta['pair_last_rows'] = last_rows
+        self._save_meta()
+
+        return run_id
+
+    def run_rows(self, run_id: int) -> slice:
+        """Return the rows of a run."""
+        start, end = self.runs[run_id]['rows']
+        return slice(start, end)
+
+    def run_matrix(self, run_id: int, column: str) -> np.ndarray:
+        """Return an AZ-by-AZ matrix of a column for one run, NaN where a pair was not measured."""
+        rows = self.run_rows(run_id)
+        matrix = np.full((len(self.azs), len(self.azs)), np.nan)
+        matrix[self.column('from_az')[rows], self.column('to_az')[rows]] = self.column(column)[rows]
+        return matrix
+
+    def pair_rows(self, az_from: str, az_to: str) -> np.ndarray:
+        """Return the rows of one AZ pair over all runs, oldest first, following the pair's chain of rows."""
+        unknown = {az_from, az_to} - set(self._az_indexes)
+        if unknown:
+            raise ValueError(f'Unknown AZs: {", ".join(sorted(unknown))}.')
+
+        prev_rows = self.column('pair_prev_row')
+        rows = []
+        row = self.meta['pair_last_rows'].get(pair_id(self._az_indexes[az_from], self._az_indexes[az_to]), -1)
+        while row >= 0:
+            rows.append(row)
+            row = prev_rows.item(row)
+
+        return np.array(rows[::-1], dtype=np.int64)
+
+    def pair_history(self, az_from: str, az_to: str, column: str) -> np.ndarray:
+        """Return a two-column array of `measured_at` and a column's values for one AZ pair over all runs."""
+        rows = self.pair_rows(az_from, az_to)
+        return np.column_stack((self.column('measured_at')[rows], self.column(column)[rows]))
+
+    def intervals(self, row: int) -> np.ndarray:
+        """Return the raw bandwidth samples (interval end and Gb/s) of one row."""
+        start = int(self.column('interval_offset')[row])
+        end = start + int(self.column('interval_count')[row])
+        return np.column_stack((self.column('interval_end')[start:end], self.column('interval_gbps')[start:end]))
+
+
+def scan_metrics_table(table_name: str, region_name: str = 'us-east-1',
+                       endpoint_url: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Return every item of the metrics table."""
+    table = boto3.resource('dynamodb', region_name=region_name, endpoint_url=endpoint_url).Table(table_name)
+
+    items: List[Dict[str, Any]] = []
+    scan_kwargs: Dict[str, Any] = {}
+    while True:
+        response = table.scan(**scan_kwargs)
+        items.extend(response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return items
+
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def ingest(table_name: str, store_path: str = RESULTS_STORE_DIR, endpoint_url: Optional[str] = None) -> None:
+    """Append the current contents of the metrics table to the local results store."""
+    store = ResultsStore(store_path)
+    items = scan_metrics_table(table_name, endpoint_url=endpoint_url)
+    run_id = store.append_run(items)
+    if run_id is None:
+        sys.stdout.write(f'No new measurements in {table_name}.\n')
+    else:
+        sys.stdout.write(f'Ingested {len(items)} measurements as run {run_id} into {store_path}.\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Ingest the metrics table into the local results store.')
+    parser.add_argument('--table', help='metrics table name (defaults to the Terraform output)')
+    parser.add_argument('--store', default=RESULTS_STORE_DIR, help='results store directory')
+    parser.add_argument('--endpoint-url', help='DynamoDB endpoint, e.g. a local stand-in')
+    args = parser.parse_args()
+
+    if args.table is None:
+        from terraform_runner import get_terraform_output
+        args.table = get_terraform_output('ec2_instance_metrics_table_name')
+
+    ingest(args.table, args.store, args.endpoint_url)
@@ -0,0 +1,99 @@
+"""Per-pair progress of measurement runs, so that an interrupted run can be resumed.
+
+Every run gets an ID when it is seeded. Agents record every pair they measure in the progress table, keyed
+by the run ID and the pair, as done or failed along with its attempts so far, and skip pairs that are
+already done. `main.py resume` measures the pairs of the last run that are not done yet, restarting only
+the AZs that take part in them. This module is part of the agent bundle, so it only needs the standard
+library and boto3.
+"""
+
+import json
+import os
+import secrets
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional
+
+
+RUN_PATH = os.path.join('tf', 'run.json')
+PAIR_DONE = 'done'
+PAIR_FAILED = 'failed'
+# Attempts of a pair over all resumes of a run, after which it is given up
+MAX_PAIR_ATTEMPTS = 9
+PROGRESS_RETENTION_SECONDS = 30 * 24 * 60 * 60
+
+
+@dataclass
+class RunRecord:
+    """The last seeded run: its ID, its regions, for runs of the global plan its shard, and when it was last
+    seeded or resumed."""
+
+    run_id: str
+    regions: List[str]
+    shard: Optional[int] = None
+    max_pairs_per_instance: Optional[int] = None
+    seeded_at: Optional[float] = None
+
+
+def new_run_id() -> str:
+    """Return a new run ID, sortable by the time the run was seeded."""
+    return f'{time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())}-{secrets.token_hex(3)}'
+
+
+def save_run(run: RunRecord, path: str = RUN_PATH) -> None:
+    """Record the last seeded run."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as run_file:
+        json.dump(asdict(run), run_file, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_run(path: str = RUN_PATH) -> Optional[RunRecord]:
+    """Return the last seeded run, or None if no run was seeded."""
+    try:
+        with open(path, encoding='utf-8') as run_file:
+            return RunRecord(**json.load(run_file))
+    except FileNotFoundError:
+        return None
+
+
+def pair_key(from_az: str, to_az: str) -> str:
+    """Return the progress table's sort key of a pair."""
+    return f'{from_az}|{to_az}'
+
+
+def progress_item(run_id: str, from_az: str, to_az: str, status: str, attempts: int,
+                  error: Optional[str] = None) -> Dict[str, Any]:
+    """Return the progress table item of a pair."""
+    item: Dict[str, Any] = {
+        'run_id': run_id,
+        'pair': pair_key(from_az, to_az),
+        'status': status,
+        'attempts': attempts,
+        'updated_at': int(time.time()),
+        'expires_at': int(time.time()) + PROGRESS_RETENTION_SECONDS,
+    }
+    if error:
+        item['error'] = error[:1000]
+
+    return item
+
+
+def read_run_progress(table: Any, run_id: str, from_az: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """Return the progress items of a run, optionally only of the pairs measured by `from_az`, by pair key."""
+    from boto3.dynamodb.conditions import Key
+
+    condition = Key('run_id').eq(run_id)
+    if from_az is not None:
+        condition = condition & Key('pair').begins_with(pair_key(from_az, ''))
+
+    progress: Dict[str, Dict[str, Any]] = {}
+    kwargs: Dict[str, Any] = {'KeyConditionExpression': condition}
+    while True:
+        response = table.query(**kwargs)
+        progress.update({item['pair']: item for item in response.get('Items', [])})
+        if 'LastEvaluatedKey' not in response:
+            return progress
+
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
@@ -0,0 +1,98 @@
+"""Adaptive sampling that stops a measurement once its confidence interval is narrow enough."""
+
+import math
+import time
+from dataclasses import dataclass
+from statistics import NormalDist
+from typing import Optional
+
+
+@dataclass
+class SamplingPolicy:
+    """Stopping rules for an adaptive measurement.
+
+    Sampling stops once the confidence interval's half-width is within `relative_tolerance` of the mean (or
+    within `absolute_tolerance`, whichever is looser) and at least `min_samples` were taken, or when either
+    `max_samples` or `max_seconds` is exhausted.
+    """
+
+    relative_tolerance: float = 0.02
+    absolute_tolerance: float = 0.0
+    confidence: float = 0.95
+    min_samples: int = 20
+    max_samples: int = 1000
+    max_seconds: float = 10.0
+
+
+@dataclass
+class SamplingResult:
+    """How an adaptive measurement ended and how precise it was."""
+
+    stop_reason: str
+    samples: int
+    mean: float
+    half_width: float
+    elapsed_seconds: float
+
+    @property
+    def relative_half_width(self) -> float:
+        """Return the half-width of the confidence interval relative to the mean."""
+        return self.half_width / abs(self.mean) if self.mean else math.inf
+
+
+class AdaptiveSampler:
+    """Running mean and variance (Welford's algorithm) with a stopping decision after every sample."""
+
+    def __init__(self, policy: SamplingPolicy) -> None:
+        """Create an empty sampler."""
+        self.policy = policy
+        self.z_value = NormalDist().inv_cdf((1 + policy.confidence) / 2)
+        self.started_at = time.monotonic()
+        self.count = 0
+        self.mean = 0.0
+        self._squared_deviations = 0.0
+        self.stop_reason: Optional[str] = None
+
+    def add(self, value: float) -> None:
+        """Add one sample."""
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._squared_deviations += delta * (value - self.mean)
+
+    @property
+    def half_width(self) -> float:
+        """Return the half-width of the confidence interval of the mean."""
+        if self.count < 2:
+            return math.inf
+
+        variance = self._squared_deviations / (self.count - 1)
+        return self.z_value * math.sqrt(variance / self.count)
+
+    @property
+    def elapsed_seconds(self) -> float:
+        """Return the time since sampling started."""
+        return time.monotonic() - self.started_at
+
+    def should_stop(self) -> bool:
+        """Return whether sampling should stop, recording the reason the first time it should."""
+        if self.stop_reason is not None:
+            return True
+
+        tolerance = max(self.policy.relative_tolerance * abs(self.mean), self.policy.absolute_tolerance)
+        if self.count >= self.policy.min_samples and self.half_width <= tolerance:
+            self.stop_reason = 'converged'
+        elif self.count >= self.policy.max_samples:
+            self.stop_reason = 'max_samples'
+        elif self.elapsed_seconds >= self.policy.max_seconds:
+            self.stop_reason = 'time_budget'
+
+        return self.stop_reason is not None
+
+    def result(self) -> SamplingResult:
+        """Return the outcome of sampling so far."""
+        return SamplingResult(stop_reason=self.stop_reason or 'incomplete',
+                              samples=self.count,
+                              mean=self.mean,
+                              half_width=self.half_width,
+                              elapsed_seconds=self.elapsed_seconds)
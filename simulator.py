@@ -0,0 +1,584 @@
+"""Discrete-event simulation of a measurement run, for planning its wall-clock time, instance-hours and cost.
+
+The simulation replays a run on a topology of regions and AZs. Terraform applies the global stack, then the
+region stacks, a limited number at a time. Seeding writes the instructions and sends 'Go'. Every agent
+measures its partner of each round and passes the barrier of its instructions through SQS. Leaders report
+progress and DONE to the control queue, and the coordinator tears every finished region down.
+
+The shards of the global plan are seeded one after another onto the same instances, each once the one
+before it finished everywhere, as `main.py run --global-shard all` does.
+
+Instructions are built by the same code that seeds real runs, from synthetic endpoints. The durations of
+Terraform, boots, measurements and AWS calls come from a `TimingModel`. Runs are deterministic for a given
+random seed.
+
+    python simulator.py                          # the discovered regions, each measuring its own pairs
+    python simulator.py --fleet 100x4            # 100 synthetic regions of 4 AZs
+    python simulator.py --global-pairs           # every shard of the global plan, on the same instances
+    python simulator.py --latency-seconds 0.5 2 10 --bandwidth-seconds 2 5 10
+"""
+
+import argparse
+import heapq
+import itertools
+import json
+import math
+import random
+import sys
+from collections import Counter, defaultdict
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, Generator, List, Optional, Tuple
+
+from coordinator import MAX_PARALLEL_TEARDOWNS
+from pair_planner import DEFAULT_MAX_PAIRS_PER_INSTANCE, PairPlan, build_plan_instructions, plan_global_pairs
+from synchronization import MAX_BATCH_ITEMS, MAX_SEEDING_WORKERS, AwsAZ, AwsRegion, build_region_instructions
+from terraform_runner import MAX_PARALLEL_STACKS
+
+
+LONG_POLL_SECONDS = 20.0
+MAX_RECEIVE_MESSAGES = 10
+# Agents flush buffered results when their oldest one is this old (see agent_clients.BatchResultWriter)
+RESULT_MAX_AGE_SECONDS = 60.0
+SLOWEST_REGIONS = 10
+
+Process = Generator[Any, None, None]
+
+
+@dataclass
+class TimingModel:
+    """Durations of the steps of a run in seconds, and the prices that turn usage into cost.
+
+    Measurement durations are triangular distributions of (low, mode, high). The high ends default to the
+    agent's sampling budgets.
+    """
+
+    global_apply_seconds: float = 60.0
+    region_apply_seconds: float = 90.0
+    az_apply_seconds: float = 10.0
+    region_destroy_seconds: float = 120.0
+    terraform_output_seconds: float = 3.0
+    boot_seconds: float = 120.0
+    latency_seconds: Tuple[float, float, float] = (0.5, 1.5, 10.0)
+    bandwidth_seconds: Tuple[float, float, float] = (2.0, 4.0, 10.0)
+    sqs_call_seconds: float = 0.02
+    dynamodb_call_seconds: float = 0.01
+    sqs_delivery_seconds: float = 0.05
+    cross_region_seconds: float = 0.1
+    instance_hourly_usd: float = 0.0104
+    sqs_usd_per_million: float = 0.40
+    dynamodb_write_usd_per_million: float = 1.25
+    dynamodb_read_usd_per_million: float = 0.25
+
+
+@dataclass
+class RegionTimeline:
+    """When a region reached every step of the run, in seconds since the run started."""
+
+    name: str
+    azs: int
+    applied_at: float = 0.0
+    started_at: float = 0.0
+    done_at: Optional[float] = None
+    torn_down_at: float = 0.0
+
+    @property
+    def instance_hours(self) -> float:
+        """Return the instance-hours of the region's AZs, from the end of its apply to its teardown."""
+        return self.azs * (self.torn_down_at - self.applied_at) / 3600
+
+
+@dataclass
+class SimulationResult:
+    """Predicted wall-clock time, instance-hours and API usage of one run."""
+
+    wall_seconds: float
+    pairs: int
+    regions: Dict[str, RegionTimeline]
+    calls: Counter = field(default_factory=Counter)
+    items_written: int = 0
+
+    @property
+    def instance_hours(self) -> float:
+        """Return the instance-hours of all regions."""
+        return sum(timeline.instance_hours for timeline in self.regions.values())
+
+    def cost_usd(self, timing: TimingModel) -> float:
+        """Return the estimated cost of the instances and the SQS and DynamoDB requests."""
+        sqs_calls = sum(count for call, count in self.calls.items() if call.startswith('sqs.'))
+        return (self.instance_hours * timing.instance_hourly_usd
+                + sqs_calls * timing.sqs_usd_per_million / 1e6
+                + self.items_written * timing.dynamodb_write_usd_per_million / 1e6
+                + self.calls['dynamodb.query'] * timing.dynamodb_read_usd_per_million / 1e6)
+
+
+class Signal:
+    """One-shot event that processes can wait for."""
+
+    def __init__(self, loop: 'EventLoop') -> None:
+        """Create a signal that has not fired."""
+        self.loop = loop
+        self.fired = False
+        self.waiters: List[Callable[[], None]] = []
+
+    def fire(self) -> None:
+        """Resume every waiting process at the current time."""
+        if self.fired:
+            return
+
+        self.fired = True
+        for waiter in self.waiters:
+            self.loop.call_at(self.loop.now, waiter)
+        self.waiters.clear()
+
+
+class EventLoop:
+    """Discrete-event scheduler of generator processes, which yield a delay in seconds or a `Signal`."""
+
+    def __init__(self) -> None:
+        """Create a loop at time zero."""
+        self.now = 0.0
+        self._events: List[Tuple[float, int, Callable[[], None]]] = []
+        self._sequence = itertools.count()
+
+    def call_at(self, at: float, callback: Callable[[], None]) -> None:
+        """Run a callback at the given time."""
+        heapq.heappush(self._events, (at, next(self._sequence), callback))
+
+    def start(self, process: Process) -> None:
+        """Run a process until it first waits."""
+        try:
+            command = next(process)
+        except StopIteration:
+            return
+
+        if isinstance(command, Signal):
+            if command.fired:
+                self.call_at(self.now, lambda: self.start(process))
+            else:
+                command.waiters.append(lambda: self.start(process))
+        else:
+            self.call_at(self.now + command, lambda: self.start(process))
+
+    def run(self) -> None:
+        """Process events until there are none left."""
+        while self._events:
+            self.now, _, callback = heapq.heappop(self._events)
+            callback()
+
+
+class Pool:
+    """Limited number of slots, such as parallel Terraform stacks, granted in request order."""
+
+    def __init__(self, loop: EventLoop, size: int) -> None:
+        """Create a pool with all slots free."""
+        self.loop = loop
+        self.free = size
+        self._pending: List[Signal] = []
+
+    def acquire(self) -> Signal:
+        """Return a signal that fires once a slot is granted."""
+        signal = Signal(self.loop)
+        if self.free:
+            self.free -= 1
+            signal.fire()
+        else:
+            self._pending.append(signal)
+        return signal
+
+    def release(self) -> None:
+        """Free a slot, granting it to the oldest pending request."""
+        if self._pending:
+            self._pending.pop(0).fire()
+        else:
+            self.free += 1
+
+
+class SimQueue:
+    """An AZ's SQS queue: which round announcements and how many 'Go' are visible, and who waits for them."""
+
+    def __init__(self) -> None:
+        """Create an empty queue."""
+        self.goes = 0
+        self.arrivals: Dict[Tuple[int, int], int] = defaultdict(int)
+        self.unreceived = 0
+        self.waiting: Optional[Tuple[Callable[[], bool], Signal]] = None
+
+    def deliver(self, shard_idx: int, round_idx: Optional[int]) -> None:
+        """Make 'Go' (for no round) or a round announcement of a shard visible, waking the agent if it waited
+        for it."""
+        if round_idx is None:
+            self.goes += 1
+        else:
+            self.arrivals[(shard_idx, round_idx)] += 1
+        self.unreceived += 1
+
+        if self.waiting is not None and self.waiting[0]():
+            self.waiting[1].fire()
+            self.waiting = None
+
+
+@dataclass
+class AgentSchedule:
+    """What an agent does, parsed from its instruction item the way the agent parses it."""
+
+    az: AwsAZ
+    region_name: str
+    partners: List[str]
+    round_peers: List[List[str]]
+    final_peers: List[str]
+    is_leader: bool
+
+
+def agent_schedule(item: Dict[str, Any], az: AwsAZ, region_name: str) -> AgentSchedule:
+    """Return the schedule of an instruction item whose IPs and queues are AZ names."""
+    partners = [partner.split(':')[1] if partner else '' for partner in item['rounds'].split(',')]
+    peers = [queue for queue in item['peer_queues'].split(',') if queue]
+    if 'round_peer_queues' not in item:
+        return AgentSchedule(az, region_name, partners, [peers] * len(partners), [], item['is_leader'])
+
+    round_peers = [[queue for queue in round_queues.split(',') if queue]
+                   for round_queues in item['round_peer_queues'].split('|')]
+    return AgentSchedule(az, region_name, partners, round_peers, peers, item['is_leader'])
+
+
+def region_schedules(regions: List[AwsRegion], plan: Optional[PairPlan]) -> List[AgentSchedule]:
+    """Build every AZ's instructions, with AZ names standing in for IPs and queue URLs."""
+    endpoints = {region.name: ({az.name: az.name for az in region.azs}, {az.name: az.name for az in region.azs})
+                 for region in regions}
+    if plan is None:
+        instructions = [build_region_instructions(region, endpoints[region.name]) for region in regions]
+    else:
+        instructions = build_plan_instructions(plan, regions, endpoints)
+
+    azs = {az.name: az for region in regions for az in region.azs}
+    return [agent_schedule(item, azs[item['availability_zone']], region_instructions.region.name)
+            for region_instructions in instructions for item in region_instructions.items]
+
+
+class RunSimulation:
+    """One run of the pipeline, from the first apply to the last teardown."""
+
+    def __init__(self, regions: List[AwsRegion], timing: TimingModel, plans: Optional[List[PairPlan]] = None,
+                 coordinate: bool = True, max_parallel_regions: int = MAX_PARALLEL_STACKS,
+                 max_parallel_teardowns: int = MAX_PARALLEL_TEARDOWNS, seed: int = 0) -> None:
+        """Prepare a run of the given regions, measuring each region's own pairs unless the shards of a plan
+        are given."""
+        self.regions = [region for region in regions if region.azs]
+        self.timing = timing
+        self.plans: List[Optional[PairPlan]] = list(plans) if plans else [None]
+        self.coordinate = coordinate
+        # Someone polls the control queue: the coordinator, or the seeding of the next shard
+        self.following = coordinate or len(self.plans) > 1
+        self.random = random.Random(seed)
+        self.loop = EventLoop()
+        self.stacks = Pool(self.loop, max_parallel_regions)
+        self.teardowns = Pool(self.loop, max_parallel_teardowns)
+        self.calls: Counter = Counter()
+        self.items_written = 0
+        self.queues = {az.name: SimQueue() for region in self.regions for az in region.azs}
+        self.az_regions = {az.name: region.name for region in self.regions for az in region.azs}
+        self.timelines = {region.name: RegionTimeline(region.name, len(region.azs)) for region in self.regions}
+        self.applied = {region.name: Signal(self.loop) for region in self.regions}
+        self.shard_done = [Signal(self.loop) for _ in self.plans]
+        self.shard_done_regions: List[List[str]] = [[] for _ in self.plans]
+        self.shard_done_at: List[Optional[float]] = [None for _ in self.plans]
+        self.done: List[str] = []
+
+    def call(self, name: str, count: int = 1) -> float:
+        """Count AWS calls and return how long they take one after another."""
+        self.calls[name] += count
+        return count * (self.timing.sqs_call_seconds if name.startswith('sqs.') else self.timing.dynamodb_call_seconds)
+
+    def send(self, from_region: Optional[str], queue: Optional[str], shard_idx: int, round_idx: Optional[int],
+             after: float = 0.0) -> float:
+        """Send a message of a shard to an AZ's queue, or to the control queue for no AZ, `after` seconds from
+        now; returns the call's duration.
+
+        Messages from no region are sent by the machine running the pipeline.
+        """
+        duration = self.call('sqs.send_message')
+        delivery = after + duration + self.timing.sqs_delivery_seconds
+        if queue is None:
+            # Whoever follows the run receives every control message
+            if self.following:
+                self.calls['sqs.receive_message'] += 1
+                self.calls['sqs.delete_message_batch'] += 1
+            return duration
+
+        if self.az_regions[queue] != from_region:
+            delivery += self.timing.cross_region_seconds
+        self.loop.call_at(self.loop.now + delivery, lambda: self.queues[queue].deliver(shard_idx, round_idx))
+        return duration
+
+    def receive_until(self, queue: SimQueue, condition: Callable[[], bool]) -> Process:
+        """Long-poll a queue until the condition holds, counting empty polls, receives and deletes."""
+        started_at = self.loop.now
+        if not condition():
+            signal = Signal(self.loop)
+            queue.waiting = (condition, signal)
+            yield signal
+
+        batches = max(1, math.ceil(queue.unreceived / MAX_RECEIVE_MESSAGES))
+        self.calls['sqs.receive_message'] += int((self.loop.now - started_at) // LONG_POLL_SECONDS)
+        queue.unreceived = 0
+        yield self.call('sqs.receive_message', batches) + self.call('sqs.delete_message_batch', batches)
+
+    def apply_region(self, region: AwsRegion) -> Process:
+        """Apply a region's stack once a slot is free."""
+        yield self.timing.global_apply_seconds
+        yield self.stacks.acquire()
+        yield self.timing.region_apply_seconds + self.timing.az_apply_seconds * len(region.azs)
+        self.stacks.release()
+        self.timelines[region.name].applied_at = self.loop.now
+        self.applied[region.name].fire()
+
+    def seed(self, shard_idx: int, schedules: List[AgentSchedule]) -> Process:
+        """Once every region is applied and the shard before finished, write a shard's instructions and send
+        'Go' to every AZ."""
+        for signal in self.applied.values():
+            yield signal
+        if shard_idx:
+            yield self.shard_done[shard_idx - 1]
+
+        # Outputs are read, items written and 'Go' sent by a pool of workers
+        workers = MAX_SEEDING_WORKERS
+        batches = math.ceil(len(schedules) / MAX_BATCH_ITEMS)
+        self.calls['dynamodb.batch_write_item'] += batches
+        self.items_written += len(schedules)
+        yield (math.ceil(len(self.regions) / workers) * self.timing.terraform_output_seconds
+               + math.ceil(batches / workers) * self.timing.dynamodb_call_seconds)
+
+        for idx in range(0, len(schedules), workers):
+            yield max(self.send(None, schedule.az.name, shard_idx, None) for schedule in schedules[idx:idx + workers])
+
+        if not shard_idx:
+            for timeline in self.timelines.values():
+                timeline.started_at = self.loop.now
+
+    def measure(self) -> float:
+        """Return the duration of one pair's latency and bandwidth tests."""
+        return (self.random.triangular(self.timing.latency_seconds[0], self.timing.latency_seconds[2],
+                                       self.timing.latency_seconds[1])
+                + self.random.triangular(self.timing.bandwidth_seconds[0], self.timing.bandwidth_seconds[2],
+                                         self.timing.bandwidth_seconds[1]))
+
+    def flush(self, buffered: int) -> float:
+        """Write buffered results and their progress items; returns the calls' duration."""
+        if not buffered:
+            return 0.0
+
+        self.items_written += 2 * buffered
+        return 2 * self.call('dynamodb.batch_write_item', math.ceil(buffered / MAX_BATCH_ITEMS))
+
+    def barrier(self, schedule: AgentSchedule, shard_idx: int, round_idx: int, peers: List[str]) -> Process:
+        """Announce a round to the peers and wait for all of their announcements."""
+        # Announcements are sent one after another
+        sending = 0.0
+        for peer in peers:
+            sending += self.send(schedule.region_name, peer, shard_idx, round_idx, sending)
+        yield sending
+
+        queue = self.queues[schedule.az.name]
+        yield from self.receive_until(queue, lambda: queue.arrivals[(shard_idx, round_idx)] >= len(peers))
+
+    def agent(self, schedules: List[AgentSchedule]) -> Process:
+        """Boot an AZ's instance and run its agent through every round of every shard."""
+        yield self.applied[schedules[0].region_name]
+        yield self.timing.boot_seconds
+
+        for shard_idx, schedule in enumerate(schedules):
+            yield from self.agent_shard(schedule, shard_idx)
+
+    def agent_shard(self, schedule: AgentSchedule, shard_idx: int) -> Process:
+        """Run an AZ's agent through every round of a shard."""
+        queue = self.queues[schedule.az.name]
+        yield from self.receive_until(queue, lambda: queue.goes > shard_idx)
+        # The instructions, then the progress of this AZ's pairs
+        yield self.call('dynamodb.query', 2)
+
+        buffered, oldest_at = 0, 0.0
+        last_round = len(schedule.partners) - 1
+        for round_idx, partner in enumerate(schedule.partners):
+            if partner:
+                yield self.measure()
+                if not buffered:
+                    oldest_at = self.loop.now
+                buffered += 1
+                if buffered >= MAX_BATCH_ITEMS or self.loop.now - oldest_at >= RESULT_MAX_AGE_SECONDS:
+                    yield self.flush(buffered)
+                    buffered = 0
+
+            if round_idx == last_round:
+                yield self.flush(buffered)
+                buffered = 0
+
+            yield from self.barrier(schedule, shard_idx, round_idx, schedule.round_peers[round_idx])
+            if schedule.is_leader and round_idx < last_round:
+                yield self.send(schedule.region_name, None, shard_idx, None)
+
+        if schedule.final_peers:
+            yield from self.barrier(schedule, shard_idx, len(schedule.partners), schedule.final_peers)
+
+        if schedule.is_leader:
+            yield self.send(schedule.region_name, None, shard_idx, None)
+            done_at = self.loop.now + self.timing.sqs_delivery_seconds
+            self.loop.call_at(done_at, lambda: self.region_done(schedule.region_name, shard_idx))
+
+    def region_done(self, region_name: str, shard_idx: int) -> None:
+        """Note a region's DONE of a shard on the control queue and, after the last shard and if coordinating,
+        tear the region down."""
+        self.shard_done_regions[shard_idx].append(region_name)
+        if len(self.shard_done_regions[shard_idx]) == len(self.regions):
+            self.shard_done_at[shard_idx] = self.loop.now
+            self.shard_done[shard_idx].fire()
+        if shard_idx < len(self.plans) - 1:
+            return
+
+        self.timelines[region_name].done_at = self.loop.now
+        self.done.append(region_name)
+
+        if self.coordinate:
+            self.loop.start(self.destroy_region(region_name, self.teardowns))
+        elif len(self.done) == len(self.regions):
+            # Without a coordinator, everything is destroyed once the last region is done
+            for done_region_name in self.done:
+                self.loop.start(self.destroy_region(done_region_name, self.stacks))
+
+    def destroy_region(self, region_name: str, pool: Pool) -> Process:
+        """Destroy one region's stack once a slot is free."""
+        yield pool.acquire()
+        yield self.timing.region_destroy_seconds
+        pool.release()
+        self.timelines[region_name].torn_down_at = self.loop.now
+
+    def run(self) -> SimulationResult:
+        """Simulate the run and return its predicted cost."""
+        shard_schedules = [region_schedules(self.regions, plan) for plan in self.plans]
+        for region in self.regions:
+            self.loop.start(self.apply_region(region))
+        for shard_idx, schedules in enumerate(shard_schedules):
+            self.loop.start(self.seed(shard_idx, schedules))
+        az_schedules: Dict[str, List[AgentSchedule]] = defaultdict(list)
+        for schedules in shard_schedules:
+            for schedule in schedules:
+                az_schedules[schedule.az.name].append(schedule)
+        for schedules in az_schedules.values():
+            self.loop.start(self.agent(schedules))
+
+        self.loop.run()
+
+        stuck = [timeline.name for timeline in self.timelines.values() if timeline.done_at is None]
+        if stuck:
+            raise ValueError(f'The simulated run never finished in {", ".join(stuck)}.')
+
+        if self.following:
+            # The control queue is long-polled from the first seed to the last DONE followed
+            # (the coordinator follows the last shard; otherwise only the shards before it are waited for)
+            last_done = self.shard_done_at[-1 if self.coordinate else -2] or 0.0
+            coordinated_seconds = last_done - min(timeline.started_at for timeline in self.timelines.values())
+            self.calls['sqs.receive_message'] += int(coordinated_seconds // LONG_POLL_SECONDS)
+
+        pairs = sum(1 for schedules in shard_schedules for schedule in schedules
+                    for partner in schedule.partners if partner)
+        return SimulationResult(self.loop.now, pairs, self.timelines, self.calls, self.items_written)
+
+
+def simulate(regions: List[AwsRegion], timing: TimingModel, global_pairs: bool = False,
+             max_pairs_per_instance: int = DEFAULT_MAX_PAIRS_PER_INSTANCE, **kwargs: Any) -> List[SimulationResult]:
+    """Simulate a run of each region's own pairs, or of every shard of the global plan."""
+    if not global_pairs:
+        return [RunSimulation(regions, timing, **kwargs).run()]
+
+    return [RunSimulation(regions, timing, plans=plan_global_pairs(regions).shard(max_pairs_per_instance),
+                          **kwargs).run()]
+
+
+def synthetic_regions(fleet: str) -> List[AwsRegion]:
+    """Return synthetic regions for a fleet of REGIONSxAZS."""
+    region_count, azs_per_region = (int(count) for count in fleet.lower().split('x'))
+    return [AwsRegion(f'xx-synthetic-{region_idx}',
+                      [AwsAZ(f'xx-synthetic-{region_idx}-az{az_idx + 1}', f'xxs{region_idx}-az{az_idx + 1}', '')
+                       for az_idx in range(azs_per_region)])
+            for region_idx in range(region_count)]
+
+
+def format_duration(seconds: float) -> str:
+    """Return a duration as hours, minutes and seconds."""
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}h{minutes:02d}m{seconds:02d}s' if hours else f'{minutes}m{seconds:02d}s'
+
+
+def format_results(results: List[SimulationResult], timing: TimingModel) -> str:
+    """Return a summary of every run, the slowest regions of each and the totals."""
+    lines = []
+    for run_idx, result in enumerate(results):
+        lines.append(f'Run {run_idx}: {len(result.regions)} regions, {result.pairs} pairs, '
+                     f'{format_duration(result.wall_seconds)}, {result.instance_hours:.1f} instance-hours, '
+                     f'${result.cost_usd(timing):.2f}')
+        slowest = sorted(result.regions.values(), key=lambda timeline: timeline.torn_down_at,
+                         reverse=True)[:SLOWEST_REGIONS]
+        for timeline in slowest:
+            lines.append(f'  {timeline.name:<24} {timeline.azs:3d} AZs  applied {format_duration(timeline.applied_at)}'
+                         f'  done {format_duration(timeline.done_at or 0.0)}'
+                         f'  torn down {format_duration(timeline.torn_down_at)}')
+
+    calls: Counter = sum((result.calls for result in results), Counter())
+    lines.append(f'Total: {format_duration(sum(result.wall_seconds for result in results))}, '
+                 f'{sum(result.instance_hours for result in results):.1f} instance-hours, '
+                 f'${sum(result.cost_usd(timing) for result in results):.2f}, '
+                 f'{sum(calls.values())} API calls')
+    lines.extend(f'  {call:<28} {count:10d}' for call, count in sorted(calls.items()))
+    return '\n'.join(lines) + '\n'
+
+
+def main() -> None:
+    """Simulate a run of the discovered or synthetic regions and print its predicted cost."""
+    defaults = TimingModel()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fleet', metavar='REGIONSxAZS', help='synthetic regions instead of the discovered ones')
+    parser.add_argument('--global-pairs', action='store_true',
+                        help='measure every AZ pair across regions, one shard after another')
+    parser.add_argument('--max-pairs-per-instance', type=int, default=DEFAULT_MAX_PAIRS_PER_INSTANCE,
+                        help='maximum number of pairs an instance takes part in per shard of the global plan')
+    parser.add_argument('--no-coordinate', dest='coordinate', action='store_false',
+                        help='destroy everything once the last region is done, instead of each region when done')
+    parser.add_argument('--max-parallel-regions', type=int, default=MAX_PARALLEL_STACKS,
+                        help='maximum number of region stacks applied at the same time')
+    parser.add_argument('--max-parallel-teardowns', type=int, default=MAX_PARALLEL_TEARDOWNS,
+                        help='maximum number of finished regions destroyed at the same time')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the measurement durations')
+    parser.add_argument('--json', help='also write the results to this JSON file')
+    for name, default in asdict(defaults).items():
+        if isinstance(default, tuple):
+            parser.add_argument(f'--{name.replace("_", "-")}', type=float, nargs=3, default=default,
+                                metavar=('LOW', 'MODE', 'HIGH'))
+        else:
+            parser.add_argument(f'--{name.replace("_", "-")}', type=float, default=default)
+    args = parser.parse_args()
+
+    if args.fleet:
+        regions = synthetic_regions(args.fleet)
+    else:
+        from main import discovered_regions
+
+        regions = discovered_regions()
+
+    timing = TimingModel(**{name: tuple(getattr(args, name)) if isinstance(default, tuple) else getattr(args, name)
+                            for name, default in asdict(defaults).items()})
+    results = simulate(regions, timing, args.global_pairs, args.max_pairs_per_instance, coordinate=args.coordinate,
+                       max_parallel_regions=args.max_parallel_regions,
+                       max_parallel_teardowns=args.max_parallel_teardowns, seed=args.seed)
+    sys.stdout.write(format_results(results, timing))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as json_file:
+            json.dump([{'wall_seconds': result.wall_seconds, 'pairs': result.pairs,
+                        'instance_hours': result.instance_hours, 'cost_usd': result.cost_usd(timing),
+                        'calls': dict(result.calls), 'items_written': result.items_written,
+                        'regions': {name: asdict(timeline) for name, timeline in result.regions.items()}}
+                       for result in results], json_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,25 @@
 """Synchronization between tests."""
 
-import boto3
-import subprocess  # nosec (remove bandit warning)
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from itertools import combinations
-from typing import Dict, List, Tuple
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+import instrumentation
+from terraform_runner import get_terraform_output
+
+if TYPE_CHECKING:
+    from pair_planner import PairPlan
+
+
+# The global stack creates the DynamoDB tables in us-east-1
+INSTRUCTIONS_TABLE_REGION = 'us-east-1'
+MAX_SEEDING_WORKERS = 16
+# DynamoDB accepts at most 25 items per BatchWriteItem call
+MAX_BATCH_ITEMS = 25
+MAX_UNPROCESSED_RETRIES = 8
 
 
 @dataclass
@@ -28,68 +42,156 @@ class AwsRegion:
         """Return a list of all AZ pairs in this region."""
         return list(combinations(self.azs, 2))
 
-
-def get_terraform_output(output_name: str) -> str:
-    """Return the Terraform output for the given output name."""
-    with subprocess.Popen(['terraform', 'output', output_name],  # nosec (remove bandit warning)
-                          cwd='tf', stdout=subprocess.PIPE) as process:
-        stdout, stderr = process.communicate()
-        if process.returncode != 0:
-            sys.stderr.write(stderr.decode('utf-8'))
-            raise ValueError(f'terraform output {output_name} failed.')
-
-        return stdout.decode('utf-8').strip().strip('"')
+    def rounds(self) -> List[List[Tuple[AwsAZ, AwsAZ]]]:
+        """Partition `pairs()` into rounds of disjoint pairs."""
+        return round_robin(self.azs)
 
 
-def write_azs_to_dynamodb(region: AwsRegion) -> None:
-    """Write AZs to DynamoDB."""
-    az_pairs = region.pairs()
+def round_robin(azs: List[AwsAZ]) -> List[List[Tuple[AwsAZ, AwsAZ]]]:
+    """Partition all pairs of the given AZs into rounds of disjoint pairs.
 
-    # Convert pairs to dictionary of "from" AZ to "to" AZ
-    az_pairs_dict: Dict[str, List[str]] = {}
-    for az_pair in az_pairs:
-        from_az = az_pair[0].name
-        if from_az not in az_pairs_dict:
-            az_pairs_dict[from_az] = [from_az]  # Make sure each AZ also has itself
+    Uses the circle method for round-robin tournaments, so every AZ takes part in at most one pair per
+    round and all pairs are covered in n - 1 rounds (n rounds for an odd number of AZs). Pairs keep the
+    orientation of `combinations(azs, 2)`.
+    """
+    order = {az.name: idx for idx, az in enumerate(azs)}
+    players: List[Optional[AwsAZ]] = list(azs)
+    if len(players) % 2:
+        players.append(None)  # The AZ paired with None sits the round out
 
-        to_az = az_pair[1].name
-        # This if is necessary for an edge case where an AZ is not a "from"
-        # AZ for any other AZs
-        if to_az not in az_pairs_dict:
-            az_pairs_dict[to_az] = [to_az]
+    rounds = []
+    for _ in range(len(players) - 1):
+        round_pairs = []
+        for idx in range(len(players) // 2):
+            first, second = players[idx], players[-1 - idx]
+            if first is None or second is None:
+                continue
+            if order[first.name] > order[second.name]:
+                first, second = second, first
+            round_pairs.append((first, second))
 
-        az_pairs_dict[from_az].append(to_az)
+        if round_pairs:
+            rounds.append(round_pairs)
+        players = [players[0], players[-1]] + players[1:-1]
 
-    dynamodb = boto3.resource('dynamodb',
-                              region_name='us-east-1'  # TODO!
-                              )
+    return rounds
 
-    table = dynamodb.Table(get_terraform_output('ec2_instance_instructions_table_name'))
 
-    keys = list(az_pairs_dict.keys())
-    for idx, az in enumerate(keys):
-        if idx + 1 < len(keys):
-            next_az = keys[idx + 1]
-        else:
-            next_az = 'DONE'
-
-        azs = ','.join(':'.join([get_terraform_output(f'instance_ip_{to_az}'), to_az]) for to_az in az_pairs_dict[az])
-
-        item = {
-            'availability_zone': az,
-            'azs': azs,
-            'next_az_queue': next_az if next_az == 'DONE' else get_terraform_output(f'az_sqs_queue-{next_az}')
-        }
-
-        table.put_item(Item=item)
-
-    first_az = keys[0]
-    # Trigger "Go" command for the first AZ
-    sqs = boto3.client('sqs',
-                       region_name=region.name
-                       )
-
-    sqs.send_message(
-        QueueUrl=get_terraform_output(f'az_sqs_queue-{first_az}'),
-        MessageBody='Go'
-    )
+@dataclass
+class RegionInstructions:
+    """Instruction items of one region's AZs, together with the queues that start them."""
+
+    region: AwsRegion
+    items: List[Dict[str, Any]]
+    queues: List[str]
+
+
+def region_endpoints(region: AwsRegion) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """Return the public IP and the SQS queue of every AZ in the region, from the region's Terraform outputs."""
+    az_ips = {az.name: get_terraform_output(f'instance_ip_{az.name}', region.name) for az in region.azs}
+    az_queues = {az.name: get_terraform_output(f'az_sqs_queue-{az.name}', region.name) for az in region.azs}
+    return az_ips, az_queues
+
+
+def build_region_instructions(region: AwsRegion,
+                              endpoints: Optional[Tuple[Dict[str, str], Dict[str, str]]] = None) -> RegionInstructions:
+    """Build the instruction items of every AZ in the region, from its Terraform outputs unless `endpoints`
+    gives the public IPs and SQS queues of its AZs."""
+    # Round 0 has every AZ test against itself; each later round is one round of `region.rounds()`, with
+    # the first AZ of each pair running the tests against the second. An empty entry means the AZ only
+    # serves (or idles) in that round.
+    az_rounds: Dict[str, List[str]] = {az.name: [az.name] for az in region.azs}
+    for round_pairs in region.rounds():
+        for partners in az_rounds.values():
+            partners.append('')
+
+        for from_az, to_az in round_pairs:
+            az_rounds[from_az.name][-1] = to_az.name
+
+    az_ips, az_queues = endpoints or region_endpoints(region)
+
+    items = []
+    for idx, az in enumerate(region.azs):
+        items.append({
+            'availability_zone': az.name,
+            'availability_zone_id': az.id,
+            'rounds': ','.join(f'{az_ips[to_az]}:{to_az}' if to_az else '' for to_az in az_rounds[az.name]),
+            'peer_queues': ','.join(queue for peer_az, queue in az_queues.items() if peer_az != az.name),
+            # The first AZ reports the region as done once the last round's barrier is passed
+            'is_leader': idx == 0,
+        })
+
+    return RegionInstructions(region, items, list(az_queues.values()))
+
+
+def batch_write_items(dynamodb: Any, table_name: str, items: List[Dict[str, Any]]) -> int:
+    """Write up to 25 items with BatchWriteItem, retrying unprocessed items. Returns the number of calls."""
+    from boto3.dynamodb.types import TypeSerializer
+
+    serializer = TypeSerializer()
+    request_items = {table_name: [{'PutRequest': {'Item': {key: serializer.serialize(value)
+                                                           for key, value in item.items()}}}
+                                  for item in items]}
+
+    for attempt in range(MAX_UNPROCESSED_RETRIES + 1):
+        request_items = dynamodb.batch_write_item(RequestItems=request_items).get('UnprocessedItems') or {}
+        if not request_items:
+            return attempt + 1
+
+        instrumentation.count('dynamodb_unprocessed_retries', table=table_name)
+        time.sleep(min(0.05 * 2 ** attempt, 5.0))
+
+    raise ValueError(f'{len(request_items[table_name])} items were left unprocessed in {table_name}.')
+
+
+def seed_regions(regions: List[AwsRegion], max_workers: int = MAX_SEEDING_WORKERS,
+                 dynamodb_endpoint_url: Optional[str] = None, sqs_endpoint_url: Optional[str] = None,
+                 plan: Optional['PairPlan'] = None, run_id: Optional[str] = None) -> None:
+    """Write every region's instructions to DynamoDB, then start all of their AZs.
+
+    Instructions are built for all regions in parallel and written in batches of 25 items. 'Go' is only
+    sent once every item is durable, so no instance can start before its peers' instructions exist.
+    The endpoint URLs allow seeding against local DynamoDB and SQS stand-ins. With a `plan` from
+    `pair_planner`, its pairs across all the regions are seeded instead of each region's own pairs. With a
+    `run_id`, agents record the progress of every pair under that run (see `run_progress`).
+    """
+    if not regions:
+        return
+
+    import boto3
+
+    session = boto3.session.Session()
+    dynamodb = instrumentation.instrument_client(
+        session.client('dynamodb', region_name=INSTRUCTIONS_TABLE_REGION, endpoint_url=dynamodb_endpoint_url))
+    sqs_clients = {region.name: instrumentation.instrument_client(
+        session.client('sqs', region_name=region.name, endpoint_url=sqs_endpoint_url)) for region in regions}
+    table_name = get_terraform_output('ec2_instance_instructions_table_name')
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        with instrumentation.span('seed_build'):
+            if plan is None:
+                instructions = list(executor.map(build_region_instructions, regions))
+            else:
+                from pair_planner import build_plan_instructions
+
+                endpoints = dict(zip((region.name for region in regions), executor.map(region_endpoints, regions)))
+                instructions = build_plan_instructions(plan, regions, endpoints)
+
+        items = [item for region_instructions in instructions for item in region_instructions.items]
+        if run_id is not None:
+            for item in items:
+                item['run_id'] = run_id
+        batches = [items[idx:idx + MAX_BATCH_ITEMS] for idx in range(0, len(items), MAX_BATCH_ITEMS)]
+        with instrumentation.span('seed_write'):
+            calls = sum(executor.map(lambda batch: batch_write_items(dynamodb, table_name, batch), batches))
+
+        # Trigger "Go" command for every AZ - the rounds are synchronized by the instances themselves
+        go_messages = [(region_instructions.region.name, queue)
+                       for region_instructions in instructions for queue in region_instructions.queues]
+        go_body = f'Go {run_id}' if run_id is not None else 'Go'
+        with instrumentation.span('seed_go'):
+            list(executor.map(lambda message: sqs_clients[message[0]].send_message(QueueUrl=message[1],
+                                                                                   MessageBody=go_body),
+                              go_messages))
+
+    sys.stdout.write(f'Seeded {len(items)} AZs in {len(regions)} regions with {calls} BatchWriteItem calls.\n')
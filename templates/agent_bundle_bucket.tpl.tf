@@ -0,0 +1,6 @@
+resource "aws_s3_bucket" "agent_bundle_bucket" {
+  bucket_prefix = "latency-agent-bundle-"
+  force_destroy = true
+
+  provider = aws.us_east_1
+}
@@ -18,6 +18,54 @@ resource "aws_dynamodb_table" "ec2_instance_metrics" {
   provider = aws.us_east_1
 }
 
+resource "aws_dynamodb_table" "ec2_instance_metrics_series" {
+  name         = "EC2InstanceMetricsSeries"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "availability_zone_pair"
+  range_key    = "measured_at"
+
+  attribute {
+    name = "availability_zone_pair"
+    type = "S"
+  }
+
+  attribute {
+    name = "measured_at"
+    type = "N"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+
+  provider = aws.us_east_1
+}
+
+resource "aws_dynamodb_table" "ec2_instance_pair_progress" {
+  name         = "EC2InstancePairProgress"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "run_id"
+  range_key    = "pair"
+
+  attribute {
+    name = "run_id"
+    type = "S"
+  }
+
+  attribute {
+    name = "pair"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+
+  provider = aws.us_east_1
+}
+
 resource "aws_dynamodb_table" "ec2_instance_instructions" {
   name         = "EC2InstanceInstructions"
   billing_mode = "PAY_PER_REQUEST"
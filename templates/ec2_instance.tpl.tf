@@ -1,3 +1,20 @@
+locals {
+  agent_config_REGION_AZ_REPLACE_ME = jsonencode({
+    sqs_queue_url           = aws_sqs_queue.sqs_queue_REGION_AZ_REPLACE_ME.url
+    control_sqs_queue_url   = var.sqs_control_queue_url
+    dynamodb_write_table    = var.ec2_instance_metrics_table_name
+    dynamodb_read_table     = var.ec2_instance_instructions_table_name
+    dynamodb_series_table   = var.ec2_instance_metrics_series_table_name
+    dynamodb_progress_table = var.ec2_instance_pair_progress_table_name
+    mode                    = var.agent_mode
+    period_seconds          = var.agent_period_seconds
+    trace_path              = "/home/ubuntu/agent-trace.json"
+    metrics_path            = "/home/ubuntu/agent-metrics.prom"
+    region                  = "REGION_NAME_REPLACE_ME"
+    az                      = "REGION_AZ_REPLACE_ME"
+  })
+}
+
 resource "aws_instance" "ec2_instance_REGION_AZ_REPLACE_ME" {
   provider          = aws.REGION_ALIAS_REPLACE_ME
   instance_type     = "INSTANCE_TYPE_REPLACE_ME" # Necessary because "t3.micro" is unavailable in us-east-1e
@@ -8,28 +25,23 @@ resource "aws_instance" "ec2_instance_REGION_AZ_REPLACE_ME" {
     aws_security_group.allow_ssh_security_group_REGION_ALIAS_REPLACE_ME.id,
     aws_security_group.allow_all_outbound_traffic_security_group_REGION_ALIAS_REPLACE_ME.id,
     aws_security_group.allow_iperf3_traffic_REGION_ALIAS_REPLACE_ME.id,
+    aws_security_group.allow_latency_probe_traffic_REGION_ALIAS_REPLACE_ME.id,
     aws_security_group.allow_ping_traffic_REGION_ALIAS_REPLACE_ME.id
   ]
-  iam_instance_profile = aws_iam_instance_profile.ec2_instance_iam_profile.name
+  iam_instance_profile = var.ec2_instance_iam_profile_name
 
   user_data = <<-EOF
               #!/bin/bash
-              echo "${aws_sqs_queue.sqs_queue_REGION_AZ_REPLACE_ME.url}" > /sqs-queue
-              echo "${aws_sqs_queue.sqs_control_queue.url}" > /control-sqs-queue
-              echo "${aws_dynamodb_table.ec2_instance_metrics.name}" > /dynamodb-write-table
-              echo "${aws_dynamodb_table.ec2_instance_instructions.name}" > /dynamodb-read-table
-              echo "REGION_NAME_REPLACE_ME" > /region
-              echo "REGION_AZ_REPLACE_ME" > /az
-
-              chmod 777 /sqs-queue /dynamodb-table /region
-              apt update -y
-              apt install iperf3 python3-pip -y
+              echo '${local.agent_config_REGION_AZ_REPLACE_ME}' > /etc/latency-agent.json
 
-              iperf3 -s &
+              # The bundle carries the iperf3 packages, so nothing is fetched from the Ubuntu mirrors at boot
+              curl -fsSL --retry 5 -o /opt/latency-agent.pyz "${var.agent_bundle_url}"
+              python3 /opt/latency-agent.pyz debs /opt/latency-agent-debs
+              DEBIAN_FRONTEND=noninteractive dpkg -i /opt/latency-agent-debs/*.deb
+              iperf3 -s -D
 
-              su - ubuntu -c "pip3 install boto3"
-              su - ubuntu -c "git clone https://github.com/danielkleinstein/aws-availability-zones-latencies.git repo"
-              su - ubuntu -c "cd repo && python3 user-data.py > log.txt 2>&1"
+              su - ubuntu -c "nohup python3 /opt/latency-agent.pyz serve > echo.log 2>&1 &"
+              su - ubuntu -c "python3 /opt/latency-agent.pyz > log.txt 2>&1"
               EOF
 
   root_block_device {
@@ -42,6 +54,7 @@ resource "aws_instance" "ec2_instance_REGION_AZ_REPLACE_ME" {
   }
 
   tags = {
-    Name = "Instance_REGION_AZ_REPLACE_ME"
+    Name               = "Instance_REGION_AZ_REPLACE_ME"
+    AvailabilityZoneId = "REGION_AZ_ID_REPLACE_ME"
   }
 }
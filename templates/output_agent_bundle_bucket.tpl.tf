@@ -0,0 +1,3 @@
+output "agent_bundle_bucket_name" {
+  value = aws_s3_bucket.agent_bundle_bucket.bucket
+}
@@ -5,3 +5,11 @@ output "ec2_instance_metrics_table_name" {
 output "ec2_instance_instructions_table_name" {
   value = aws_dynamodb_table.ec2_instance_instructions.name
 }
+
+output "ec2_instance_metrics_series_table_name" {
+  value = aws_dynamodb_table.ec2_instance_metrics_series.name
+}
+
+output "ec2_instance_pair_progress_table_name" {
+  value = aws_dynamodb_table.ec2_instance_pair_progress.name
+}
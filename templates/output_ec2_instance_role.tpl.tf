@@ -0,0 +1,3 @@
+output "ec2_instance_iam_profile_name" {
+  value = aws_iam_instance_profile.ec2_instance_iam_profile.name
+}
@@ -0,0 +1,3 @@
+output "sqs_control_queue_url" {
+  value = aws_sqs_queue.sqs_control_queue.url
+}
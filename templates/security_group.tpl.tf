@@ -24,6 +24,19 @@ resource "aws_security_group" "allow_iperf3_traffic_REGION_ALIAS_REPLACE_ME" {
   }
 }
 
+resource "aws_security_group" "allow_latency_probe_traffic_REGION_ALIAS_REPLACE_ME" {
+  name        = "allow_latency_probe_traffic_REGION_ALIAS_REPLACE_ME"
+  description = "Allow latency probe inbound traffic for REGION_ALIAS_REPLACE_ME"
+  provider    = aws.REGION_ALIAS_REPLACE_ME
+
+  ingress {
+    from_port   = 5202
+    to_port     = 5202
+    protocol    = "udp"
+    cidr_blocks = ["0.0.0.0/0"]
+  }
+}
+
 resource "aws_security_group" "allow_ping_traffic_REGION_ALIAS_REPLACE_ME" {
   name        = "allow_ping_traffic_REGION_ALIAS_REPLACE_ME"
   description = "Allow ping inbound traffic for REGION_ALIAS_REPLACE_ME"
@@ -0,0 +1,37 @@
+variable "ec2_instance_iam_profile_name" {
+  type = string
+}
+
+variable "sqs_control_queue_url" {
+  type = string
+}
+
+variable "ec2_instance_metrics_table_name" {
+  type = string
+}
+
+variable "ec2_instance_instructions_table_name" {
+  type = string
+}
+
+variable "ec2_instance_metrics_series_table_name" {
+  type = string
+}
+
+variable "ec2_instance_pair_progress_table_name" {
+  type = string
+}
+
+variable "agent_bundle_url" {
+  type = string
+}
+
+variable "agent_mode" {
+  type    = string
+  default = "once"
+}
+
+variable "agent_period_seconds" {
+  type    = number
+  default = 300
+}
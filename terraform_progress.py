@@ -0,0 +1,145 @@
+"""Live progress and per-resource timing of Terraform runs, built from `-json` machine-readable events."""
+
+import glob
+import json
+import os
+import sys
+import time
+from collections import deque
+from dataclasses import asdict, dataclass
+from typing import Any, Deque, Dict, List, Optional
+
+from rendering import TERRAFORM_DIR
+
+
+TIMINGS_FILE_PATTERN = 'timings-*.json'
+TIMING_REPORT_PATH = os.path.join(TERRAFORM_DIR, 'timing-report.json')
+SLOWEST_RESOURCES = 20
+MAX_ERROR_LINES = 50
+
+
+@dataclass
+class ResourceTiming:
+    """Represents the provisioning of one resource during a Terraform run."""
+
+    address: str
+    action: str
+    started_at: float
+    finished_at: Optional[float] = None
+    status: str = 'running'
+
+    @property
+    def duration(self) -> float:
+        """Return how long the resource took, or has taken so far."""
+        return (self.finished_at or time.time()) - self.started_at
+
+
+class TerraformProgress:
+    """Live per-resource state table of a single Terraform command."""
+
+    def __init__(self, stack: str, command: str) -> None:
+        """Create an empty table for the given stack and command."""
+        self.stack = stack
+        self.command = command
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.resources: Dict[str, ResourceTiming] = {}
+        self.errors: Deque[str] = deque(maxlen=MAX_ERROR_LINES)
+
+    @property
+    def running(self) -> int:
+        """Return the number of resources that are still in progress."""
+        return sum(1 for resource in self.resources.values() if resource.status == 'running')
+
+    def handle_line(self, line: str) -> None:
+        """Update the table from one line of Terraform output."""
+        try:
+            event = json.loads(line)
+        except json.JSONDecodeError:
+            # Anything that is not a machine-readable event (e.g. a crash) is kept for error reporting
+            if line.strip():
+                self.errors.append(line.rstrip())
+            return
+
+        self.handle_event(event)
+
+    def handle_event(self, event: Dict[str, Any]) -> None:
+        """Update the table from a Terraform `-json` event."""
+        event_type = event.get('type')
+        hook = event.get('hook', {})
+        now = time.time()
+
+        if event_type == 'apply_start':
+            address = hook['resource']['addr']
+            self.resources[address] = ResourceTiming(address, hook.get('action', ''), now)
+        elif event_type in ('apply_complete', 'apply_errored'):
+            address = hook['resource']['addr']
+            resource = self.resources.setdefault(
+                address, ResourceTiming(address, hook.get('action', ''), now - hook.get('elapsed_seconds', 0)))
+            resource.finished_at = now
+            resource.status = 'complete' if event_type == 'apply_complete' else 'errored'
+            sys.stdout.write(f'[{self.stack}] {address}: {resource.action} {resource.status} after '
+                             f'{resource.duration:.1f}s ({self.running} running)\n')
+        elif event_type == 'diagnostic' and event.get('@level') == 'error':
+            diagnostic = event.get('diagnostic', {})
+            self.errors.append(f'{diagnostic.get("summary", "")}: {diagnostic.get("detail", "")}')
+
+    def finish(self) -> None:
+        """Mark the command as finished."""
+        self.finished_at = time.time()
+
+    def save(self, directory: str) -> None:
+        """Write the table to the stack's working directory."""
+        data = {
+            'stack': self.stack,
+            'command': self.command,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'resources': [asdict(resource) for resource in self.resources.values()],
+        }
+
+        with open(os.path.join(directory, f'timings-{self.command}.json'), 'w', encoding='utf-8') as timings_file:
+            json.dump(data, timings_file, indent=2)
+
+
+def build_timing_report(terraform_dir: str = TERRAFORM_DIR, slowest: int = SLOWEST_RESOURCES) -> Dict[str, Any]:
+    """Aggregate the timing tables of all stacks into the slowest resources and per-stack totals."""
+    resources: List[Dict[str, Any]] = []
+    stacks: Dict[str, Dict[str, Any]] = {}
+
+    for path in sorted(glob.glob(os.path.join(terraform_dir, '*', TIMINGS_FILE_PATTERN))):
+        with open(path, encoding='utf-8') as timings_file:
+            timings = json.load(timings_file)
+
+        finished = [resource for resource in timings['resources'] if resource['finished_at'] is not None]
+        for resource in finished:
+            resources.append({'stack': timings['stack'], 'command': timings['command'],
+                              'address': resource['address'], 'action': resource['action'],
+                              'status': resource['status'],
+                              'duration': resource['finished_at'] - resource['started_at']})
+
+        stacks[f'{timings["stack"]} {timings["command"]}'] = {
+            'wall_seconds': (timings['finished_at'] or timings['started_at']) - timings['started_at'],
+            'resource_seconds': sum(resource['finished_at'] - resource['started_at'] for resource in finished),
+            'resources': len(timings['resources']),
+            'errored': sum(1 for resource in timings['resources'] if resource['status'] == 'errored'),
+        }
+
+    resources.sort(key=lambda resource: resource['duration'], reverse=True)
+    return {'slowest_resources': resources[:slowest],
+            'stacks': dict(sorted(stacks.items(), key=lambda item: item[1]['wall_seconds'], reverse=True))}
+
+
+def write_timing_report(terraform_dir: str = TERRAFORM_DIR, path: str = TIMING_REPORT_PATH) -> Dict[str, Any]:
+    """Write the aggregated timing report and print its highlights."""
+    report = build_timing_report(terraform_dir)
+    with open(path, 'w', encoding='utf-8') as report_file:
+        json.dump(report, report_file, indent=2)
+
+    sys.stdout.write(f'Timing report written to {path}.\n')
+    for stack, totals in list(report['stacks'].items())[:5]:
+        sys.stdout.write(f'  {stack}: {totals["wall_seconds"]:.1f}s for {totals["resources"]} resources\n')
+    for resource in report['slowest_resources'][:5]:
+        sys.stdout.write(f'  {resource["stack"]} {resource["address"]}: {resource["duration"]:.1f}s\n')
+
+    return report
@@ -0,0 +1,209 @@
+"""Running Terraform over the global stack and one stack per region."""
+
+import json
+import os
+import subprocess  # nosec (remove bandit warning)
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import instrumentation
+from rendering import GLOBAL_STACK, TERRAFORM_DIR
+from terraform_progress import TerraformProgress
+
+
+TERRAFORM_PLUGIN_CACHE_DIR = os.path.expanduser(os.path.join('~', '.terraform.d', 'plugin-cache'))
+MAX_PARALLEL_STACKS = 8
+STACK_RETRIES = 2
+STACK_RETRY_BACKOFF_SECONDS = 10.0
+# Commands that can emit machine-readable events
+JSON_COMMANDS = ('apply', 'destroy')
+
+
+def stack_dir(stack: str) -> str:
+    """Return the working directory of the given stack."""
+    return os.path.join(TERRAFORM_DIR, stack)
+
+
+def region_stacks() -> List[str]:
+    """Return the names of all region stacks that have been rendered."""
+    if not os.path.isdir(TERRAFORM_DIR):
+        return []
+
+    return sorted(stack for stack in os.listdir(TERRAFORM_DIR)
+                  if stack != GLOBAL_STACK and os.path.isfile(os.path.join(stack_dir(stack), 'main.tf')))
+
+
+class TerraformOutputs:
+    """In-memory index of a stack's Terraform outputs, loaded with a single `terraform output -json`."""
+
+    def __init__(self, stack: str) -> None:
+        """Create an empty store for the given stack."""
+        self.stack = stack
+        self._outputs: Optional[Dict[str, str]] = None
+
+    def _load(self) -> Dict[str, str]:
+        """Read every output of the stack at once."""
+        with instrumentation.span('terraform', command='output', stack=self.stack), \
+                subprocess.Popen(['terraform', 'output', '-json'],  # nosec (remove bandit warning)
+                                 cwd=stack_dir(self.stack), stdout=subprocess.PIPE, stderr=subprocess.PIPE) as process:
+            stdout, stderr = process.communicate()
+            if process.returncode != 0:
+                sys.stderr.write(stderr.decode('utf-8'))
+                raise ValueError(f'terraform output -json failed in {stack_dir(self.stack)}.')
+
+        outputs = json.loads(stdout.decode('utf-8'))
+        return {name: output['value'] if isinstance(output['value'], str) else json.dumps(output['value'])
+                for name, output in outputs.items()}
+
+    def get(self, output_name: str) -> str:
+        """Return the Terraform output for the given output name."""
+        if self._outputs is None:
+            self._outputs = self._load()
+
+        if output_name not in self._outputs:
+            raise ValueError(f'terraform output {output_name} not found in {stack_dir(self.stack)}.')
+
+        return self._outputs[output_name]
+
+    def invalidate(self) -> None:
+        """Drop the loaded outputs so that the next lookup re-reads them."""
+        self._outputs = None
+
+
+_TERRAFORM_OUTPUTS: Dict[str, TerraformOutputs] = {}
+
+
+def terraform_outputs(stack: str) -> TerraformOutputs:
+    """Return the output store of the given stack."""
+    if stack not in _TERRAFORM_OUTPUTS:
+        _TERRAFORM_OUTPUTS[stack] = TerraformOutputs(stack)
+
+    return _TERRAFORM_OUTPUTS[stack]
+
+
+def get_terraform_output(output_name: str, stack: str = GLOBAL_STACK) -> str:
+    """Return the Terraform output for the given output name."""
+    return terraform_outputs(stack).get(output_name)
+
+
+def terraform_env() -> Dict[str, str]:
+    """Return the environment for Terraform, with a plugin cache shared between runs."""
+    env = dict(os.environ)
+    env.setdefault('TF_PLUGIN_CACHE_DIR', TERRAFORM_PLUGIN_CACHE_DIR)
+    os.makedirs(env['TF_PLUGIN_CACHE_DIR'], exist_ok=True)
+    return env
+
+
+def target_args(targets: Optional[List[str]]) -> List[str]:
+    """Return Terraform -target arguments for the given resource addresses."""
+    return [f'-target={target}' for target in targets or []]
+
+
+def run_terraform_command(stack: str, args: List[str]) -> None:
+    """Run a Terraform command in the given stack, streaming its progress as it arrives.
+
+    Commands that support it run with `-json`, so every resource's start and finish is tracked live and
+    the resulting timing table is saved next to the stack's state.
+    """
+    command = args[0]
+    if command in JSON_COMMANDS:
+        args = [command, '-json', *args[1:]]
+
+    progress = TerraformProgress(stack, command)
+    with instrumentation.span('terraform', command=command, stack=stack), \
+            subprocess.Popen(['terraform', *args],  # nosec (remove bandit warning)
+                             cwd=stack_dir(stack), env=terraform_env(), text=True,
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT) as process:
+        assert process.stdout  # nosec (remove bandit warning)
+        for line in process.stdout:
+            progress.handle_line(line)
+
+    progress.finish()
+    if command in JSON_COMMANDS:
+        progress.save(stack_dir(stack))
+
+    if process.returncode != 0:
+        sys.stderr.write('\n'.join(progress.errors) + '\n')
+        raise ValueError(f'terraform {command} failed in {stack_dir(stack)}.')
+
+
+def run_terraform(stack: str, targets: Optional[List[str]] = None) -> None:
+    """Run terraform in the given stack, optionally only for the given resource addresses."""
+    run_terraform_command(stack, ['init'])
+    sys.stdout.write(f'Terraform init successful in {stack}.\n')
+
+    run_terraform_command(stack, ['apply', '-auto-approve', '-parallelism=50', *target_args(targets)])
+    terraform_outputs(stack).invalidate()
+    sys.stdout.write(f'Terraform apply successful in {stack}.\n')
+
+
+def destroy_terraform(stack: str, targets: Optional[List[str]] = None) -> None:
+    """Destroy the given stack, optionally only the given resource addresses."""
+    run_terraform_command(stack, ['destroy', '-auto-approve', '-parallelism=50', *target_args(targets)])
+    terraform_outputs(stack).invalidate()
+    sys.stdout.write(f'Terraform destroy successful in {stack}.\n')
+
+
+def _run_with_retries(action: Callable[[str, Optional[List[str]]], None], stack: str,
+                      targets: Optional[List[str]], retries: int, backoff_seconds: float) -> Optional[str]:
+    """Run an action on a stack with exponential backoff, returning the last error or None on success."""
+    for attempt in range(retries + 1):
+        try:
+            action(stack, targets)
+            return None
+        except ValueError as error:
+            if attempt == retries:
+                return str(error)
+
+            sys.stderr.write(f'{error} Retrying ({attempt + 1}/{retries}).\n')
+            instrumentation.count('terraform_retries', stack=stack)
+            time.sleep(backoff_seconds * 2 ** attempt)
+
+    return None
+
+
+def _run_stack(action: Callable[[str, Optional[List[str]]], None], stack: str, targets: Optional[List[str]],
+               retries: int, backoff_seconds: float) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """Run an action on a stack in a worker process, returning its error and the worker's instrumentation."""
+    with instrumentation.span('stack', action=action.__name__, stack=stack):
+        error = _run_with_retries(action, stack, targets, retries, backoff_seconds)
+
+    return error, instrumentation.drain()
+
+
+def run_stacks(action: Callable[[str, Optional[List[str]]], None],
+               stacks: Dict[str, Optional[List[str]]],
+               max_workers: int = MAX_PARALLEL_STACKS,
+               retries: int = STACK_RETRIES,
+               backoff_seconds: float = STACK_RETRY_BACKOFF_SECONDS) -> Dict[str, str]:
+    """Run `run_terraform` or `destroy_terraform` on many stacks in parallel worker processes.
+
+    `stacks` maps every stack to its resource targets (None for the whole stack). A failing stack is retried
+    on its own and never stops the others. Returns the stacks that still failed, mapped to their error.
+    """
+    failures: Dict[str, str] = {}
+    if not stacks:
+        return failures
+
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(stacks))) as executor:
+        futures = {executor.submit(_run_stack, action, stack, targets, retries, backoff_seconds): stack
+                   for stack, targets in stacks.items()}
+        for future in as_completed(futures):
+            stack = futures[future]
+            # Workers have their own output stores, so the parent's copy must be refreshed here
+            terraform_outputs(stack).invalidate()
+            try:
+                error, worker_instrumentation = future.result()
+                instrumentation.merge(worker_instrumentation)
+            except Exception as exception:  # pylint: disable=broad-except
+                error = f'{type(exception).__name__}: {exception}'
+
+            if error is not None:
+                failures[stack] = error
+
+    for stack, error in sorted(failures.items()):
+        sys.stderr.write(f'Stack {stack} failed: {error}\n')
+
+    return failures
@@ -1,160 +1,449 @@
 """Template script to be used as user-data for EC2 instances."""
 
-import boto3
+import atexit
 import json
-import subprocess  # nosec (remove bandit warning)
-import re
+import math
+import os
+import random
+import signal
+import socket
+import sys
+import time
+from collections import defaultdict
 from decimal import Decimal
-from typing import List, Tuple
-
-
-with open('/sqs-queue', encoding='utf-8') as sqs_queue_file:
-    QUEUE_URL = sqs_queue_file.read().strip()
-
-with open('/control-sqs-queue', encoding='utf-8') as sqs_queue_file:
-    CONTROL_QUEUE_URL = sqs_queue_file.read().strip()
-
-with open('/dynamodb-write-table', encoding='utf-8') as dynamodb_write_table_file:
-    WRITE_TABLE_NAME = dynamodb_write_table_file.read().strip()
-
-with open('/dynamodb-read-table', encoding='utf-8') as dynamodb_read_table_file:
-    READ_TABLE_NAME = dynamodb_read_table_file.read().strip()
-
-with open('/region', encoding='utf-8') as region_file:
-    REGION_NAME = region_file.read().strip()
-
-with open('/az', encoding='utf-8') as region_file:
-    AZ_NAME = region_file.read().strip()
-
-
-def test_bandwidth(server_ip: str, port: int = 5201) -> Decimal:
-    """Test network bandwidth to a host."""
-    command = ['iperf3', '-c', server_ip, '-p', str(port), '-J']
-    result = subprocess.run(command, capture_output=True, text=True)
-
-    if result.returncode != 0:
-        raise ValueError(f'Error running iperf3: {result.stderr}')
-
-    data = json.loads(result.stdout)
-    bandwidth_bps = data['end']['sum_received']['bits_per_second']
-
-    # Convert to Gb/s
-    bandwidth_gbps = Decimal(bandwidth_bps) / Decimal(10**9)
-
-    return bandwidth_gbps
-
-
-def test_network_latency(hostname: str) -> Decimal:
-    """Test network latency to a host."""
-    # Run the ping command
-    command = ['ping', '-c', '100', '-i', '0.1', hostname]
-    result = subprocess.run(command, stdout=subprocess.PIPE, text=True, check=True)  # nosec (remove bandit warning)
-
-    time_values = re.findall(r'time=([\d.]+)', result.stdout)
-    avg_time = sum(map(Decimal, time_values)) / Decimal(len(time_values))
-
-    return avg_time
+from typing import Any, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+from boto3.dynamodb.conditions import Key
+
+import instrumentation
+from agent_clients import AgentClients, BatchResultWriter
+from bandwidth import BandwidthResult, measure_bandwidth
+from latency_probe import ECHO_PORT, PACKET_FORMAT, LatencyStats, probe_latency
+from run_progress import PAIR_DONE, PAIR_FAILED, pair_key, progress_item, read_run_progress
+from sampling import AdaptiveSampler, SamplingPolicy, SamplingResult
+
+
+LATENCY_SAMPLING = SamplingPolicy(relative_tolerance=0.02, min_samples=50, max_samples=1000, max_seconds=10.0)
+BANDWIDTH_SAMPLING = SamplingPolicy(relative_tolerance=0.05, min_samples=4, max_samples=40, max_seconds=10.0)
+BANDWIDTH_STREAMS = 1
+# Daemon mode measures bandwidth far less often and with a shorter budget, to stay within a t3.micro's
+# CPU credits and leave the link alone most of the time
+DAEMON_BANDWIDTH_SAMPLING = SamplingPolicy(relative_tolerance=0.05, min_samples=4, max_samples=10, max_seconds=3.0)
+SERIES_RETENTION_SECONDS = 30 * 24 * 60 * 60
+# A failing pair is retried after 5, then 10 seconds before it is recorded as failed
+PAIR_ATTEMPTS = 3
+PAIR_RETRY_BACKOFF_SECONDS = 5.0
+
+# Written by the instance's user data
+with open(os.environ.get('AGENT_CONFIG', '/etc/latency-agent.json'), encoding='utf-8') as config_file:
+    CONFIG = json.load(config_file)
+
+QUEUE_URL = CONFIG['sqs_queue_url']
+CONTROL_QUEUE_URL = CONFIG['control_sqs_queue_url']
+WRITE_TABLE_NAME = CONFIG['dynamodb_write_table']
+READ_TABLE_NAME = CONFIG['dynamodb_read_table']
+REGION_NAME = CONFIG['region']
+AZ_NAME = CONFIG['az']
+# 'once' measures every partner a single time; 'daemon' keeps measuring them every period
+MODE = CONFIG.get('mode', 'once')
+SERIES_TABLE_NAME = CONFIG.get('dynamodb_series_table')
+PROGRESS_TABLE_NAME = CONFIG.get('dynamodb_progress_table')
+PERIOD_SECONDS = float(CONFIG.get('period_seconds', 300))
+JITTER_SECONDS = float(CONFIG.get('jitter_seconds', PERIOD_SECONDS / 10))
+BANDWIDTH_EVERY = int(CONFIG.get('bandwidth_every', 12))
+# Once-mode agents wait this long for the next run after finishing one; by default until they are torn down
+NEXT_RUN_WAIT_SECONDS = float(CONFIG['next_run_wait_seconds']) if 'next_run_wait_seconds' in CONFIG else None
+
+if CONFIG.get('trace_path') or CONFIG.get('metrics_path'):
+    instrumentation.configure(CONFIG.get('trace_path'), CONFIG.get('metrics_path'))
+# Registered first so that it runs last, after the results are flushed
+atexit.register(instrumentation.flush)
+
+CLIENTS = AgentClients()
+RESULTS = BatchResultWriter(CLIENTS, WRITE_TABLE_NAME)
+atexit.register(RESULTS.flush)
+# A pair is only recorded as done once its result is durable
+PROGRESS = BatchResultWriter(CLIENTS, PROGRESS_TABLE_NAME, before_flush=RESULTS.flush) if PROGRESS_TABLE_NAME else None
+if PROGRESS is not None:
+    atexit.register(PROGRESS.flush)
+
+
+def test_bandwidth(server_ip: str, az_name: str) -> BandwidthResult:
+    """Test network bandwidth to a host, stopping once the throughput has converged."""
+    with instrumentation.span('pair_bandwidth', to=az_name):
+        return measure_bandwidth(server_ip, BANDWIDTH_SAMPLING, streams=BANDWIDTH_STREAMS)
+
+
+def test_network_latency(hostname: str, az_name: str,
+                         sock: Optional[socket.socket] = None) -> Tuple[LatencyStats, SamplingResult]:
+    """Test network latency to a host, stopping once the mean is precise enough."""
+    sampler = AdaptiveSampler(LATENCY_SAMPLING)
+    with instrumentation.span('pair_latency', to=az_name):
+        stats = probe_latency(hostname, count=LATENCY_SAMPLING.max_samples, sampler=sampler, sock=sock)
+
+    return stats, sampler.result()
+
+
+def to_decimal(value: float) -> Decimal:
+    """Convert a float to a Decimal that DynamoDB accepts."""
+    return Decimal(str(round(value, 4)))
+
+
+def result_item(network_latency: LatencyStats, latency_sampling: SamplingResult,
+                bandwidth: Optional[BandwidthResult]) -> Dict[str, Any]:
+    """Return the attributes of a measurement; bandwidth attributes are left out without a bandwidth result, and
+    confidence intervals when there were too few samples for one."""
+    item: Dict[str, Any] = {
+        'measured_at': to_decimal(time.time()),
+        'network_latency_ms': to_decimal(network_latency.mean_ms),
+        'network_latency_min_ms': to_decimal(network_latency.min_ms),
+        'network_latency_p50_ms': to_decimal(network_latency.p50_ms),
+        'network_latency_p90_ms': to_decimal(network_latency.p90_ms),
+        'network_latency_p99_ms': to_decimal(network_latency.p99_ms),
+        'network_latency_max_ms': to_decimal(network_latency.max_ms),
+        'network_jitter_ms': to_decimal(network_latency.jitter_ms),
+        'network_loss': to_decimal(network_latency.loss),
+        'network_latency_stop_reason': latency_sampling.stop_reason,
+        'network_latency_samples': latency_sampling.samples,
+    }
+    # With fewer than two samples there is no confidence interval, and DynamoDB rejects infinite numbers
+    if math.isfinite(latency_sampling.half_width):
+        item['network_latency_ci_ms'] = to_decimal(latency_sampling.half_width)
+    if bandwidth is None:
+        return item
+
+    item.update({
+        'bandwidth_gbps': to_decimal(bandwidth.gbps),
+        'bandwidth_stop_reason': bandwidth.sampling.stop_reason,
+        'bandwidth_samples': bandwidth.sampling.samples,
+        'bandwidth_streams': bandwidth.streams,
+        'bandwidth_retransmits': bandwidth.retransmits,
+        'bandwidth_interval_ends': [to_decimal(interval.end) for interval in bandwidth.intervals],
+        'bandwidth_interval_gbps': [to_decimal(interval.bits_per_second / 10**9) for interval in bandwidth.intervals],
+        'bandwidth_interval_retransmits': [interval.retransmits or 0 for interval in bandwidth.intervals],
+    })
+    if math.isfinite(bandwidth.sampling.half_width):
+        item['bandwidth_ci_gbps'] = to_decimal(bandwidth.sampling.half_width)
+
+    return item
+
+
+def write_to_dynamodb(az_name: str,
+                      network_latency: LatencyStats, latency_sampling: SamplingResult,
+                      bandwidth: BandwidthResult) -> None:
+    """Queue a result for a batched write to DynamoDB."""
+    item = result_item(network_latency, latency_sampling, bandwidth)
+    item.update({'availability_zone_from': AZ_NAME, 'availability_zone_to': az_name})
+
+    RESULTS.add(item)
+
+
+def read_from_dynamodb_table() -> Tuple[List[str], List[List[str]], List[str], bool, Optional[str]]:
+    """Read from the DynamoDB table.
+
+    Returns this AZ's partner for every round (`ip:az`, or an empty string when the AZ only serves in
+    that round), the queues to synchronize with at the end of every round, the queues to synchronize with
+    before the region is reported as done (none if the rounds already synchronize the whole region),
+    whether this AZ is the region's leader and the ID of the run, if it tracks its progress.
+    """
+    table = CLIENTS.resource('dynamodb', 'us-east-1').Table(READ_TABLE_NAME)
 
+    response = table.query(
+        KeyConditionExpression=Key('availability_zone').eq(AZ_NAME)
+    )
 
-def write_to_dynamodb(az_name: str, network_latency: Decimal, bandwidth: Decimal) -> None:
-    """Write to DynamoDB."""
-    dynamodb = boto3.resource('dynamodb',
-                              region_name='us-east-1'
-                              )
+    item = response.get('Items')[0]
+    rounds = item.get('rounds').split(',')
+    peer_queues = [queue for queue in item.get('peer_queues').split(',') if queue]
+    is_leader = bool(item.get('is_leader'))
+    run_id = item.get('run_id')
 
-    table = dynamodb.Table(WRITE_TABLE_NAME)
+    # Global and resumed pair plans only synchronize the partners of consecutive rounds
+    if 'round_peer_queues' not in item:
+        return rounds, [peer_queues] * len(rounds), [], is_leader, run_id
 
-    item = {
-        'availability_zone_from': AZ_NAME,
-        'availability_zone_to': az_name,
-        'network_latency_ms': network_latency,
-        'bandwidth_gbps': bandwidth,
-    }
+    round_peer_queues = [[queue for queue in round_queues.split(',') if queue]
+                         for round_queues in item.get('round_peer_queues').split('|')]
+    return rounds, round_peer_queues, peer_queues, is_leader, run_id
 
-    table.put_item(Item=item)
 
+def measure_pair(ip: str, az_name: str) -> Tuple[bool, int, Optional[str]]:
+    """Measure a partner and queue the result, retrying with exponential backoff.
 
-def read_from_dynamodb_table() -> Tuple[List[str], List[str], str]:
-    """Read from the DynamoDB table."""
-    dynamodb = boto3.resource('dynamodb',
-                              region_name='us-east-1'
-                              )
+    Returns whether the pair succeeded, the attempts it took and the last error.
+    """
+    error = None
+    for attempt in range(PAIR_ATTEMPTS):
+        if attempt:
+            time.sleep(PAIR_RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1))
 
-    table = dynamodb.Table(READ_TABLE_NAME)
+        try:
+            network_latency, latency_sampling = test_network_latency(ip, az_name)
+            bandwidth = test_bandwidth(ip, az_name)
+        except (OSError, ValueError) as pair_error:
+            error = f'{type(pair_error).__name__}: {pair_error}'
+            sys.stderr.write(f'Pair {AZ_NAME} -> {az_name} failed ({attempt + 1}/{PAIR_ATTEMPTS}): {error}\n')
+            instrumentation.count('pair_failures', to=az_name)
+            continue
 
-    response = table.query(
-        KeyConditionExpression=boto3.dynamodb.conditions.Key('availability_zone').eq(AZ_NAME)
-    )
+        write_to_dynamodb(az_name, network_latency, latency_sampling, bandwidth)
+        return True, attempt + 1, None
 
-    azs = response.get('Items')[0].get('azs').split(',')
-    pairs = [az.split(':') for az in azs]
-    ips, az_names = zip(*pairs)
+    return False, PAIR_ATTEMPTS, error
 
-    next_az_queue = response.get('Items')[0].get('next_az_queue')
 
-    return ips, az_names, next_az_queue
+def control_message(kind: str, run_id: Optional[str]) -> str:
+    """Return a control message body, tagged with the run ID so that coordinators can tell runs apart."""
+    return f'{kind} - {REGION_NAME} run={run_id}' if run_id else f'{kind} - {REGION_NAME}'
 
 
-def trigger_next_az(next_az_queue: str) -> None:
-    """Trigger the next AZ."""
-    sqs = boto3.client('sqs',
-                       region_name=REGION_NAME
-                       )
+def report_progress(rounds_done: int, rounds_total: int, run_id: Optional[str] = None) -> None:
+    """Tell the control queue how many rounds the region has finished."""
+    sqs = CLIENTS.client('sqs', 'us-east-1')
     sqs.send_message(
-        QueueUrl=next_az_queue,
-        MessageBody='Go'
+        QueueUrl=CONTROL_QUEUE_URL,
+        MessageBody=control_message(f'PROGRESS {rounds_done}/{rounds_total}', run_id)
     )
 
 
-def trigger_done() -> None:
+def trigger_done(run_id: Optional[str] = None) -> None:
     """Tell the control queue the region is done."""
-    sqs = boto3.client('sqs',
-                       region_name='us-east-1'
-                       )
+    sqs = CLIENTS.client('sqs', 'us-east-1')
     sqs.send_message(
         QueueUrl=CONTROL_QUEUE_URL,
-        MessageBody=f'DONE - {REGION_NAME}'
+        MessageBody=control_message('DONE', run_id)
     )
 
 
-def poll_sqs_queue() -> None:
-    """Poll the SQS queue for messages."""
-    sqs = boto3.client('sqs',
-                       region_name=REGION_NAME
-                       )
+def queue_region(queue_url: str) -> str:
+    """Return the region of an SQS queue URL, defaulting to this instance's region."""
+    host_parts = (urlparse(queue_url).hostname or '').split('.')
+    return host_parts[1] if len(host_parts) == 4 and host_parts[0] == 'sqs' else REGION_NAME
 
-    while True:
-        messages = sqs.receive_message(
+
+class RoundBarrier:
+    """Barrier between measurement rounds, built on this AZ's SQS queue.
+
+    At the end of every round each AZ announces the round to all of its peers' queues and waits until all
+    peers have announced it too. Standard SQS queues may deliver announcements early or out of order, so
+    they are counted per run and round. Peers may be in other regions. 'Go' and the announcements carry the
+    run ID, so that shards seeded one after another on the same instances do not mix.
+    """
+
+    def __init__(self) -> None:
+        """Create a barrier for this AZ's queue."""
+        self.sqs = CLIENTS.client('sqs', REGION_NAME)
+        self.started_runs: List[Optional[str]] = []
+        self.finished_runs: Set[Optional[str]] = set()
+        self.arrivals: Dict[Tuple[Optional[str], int], Set[str]] = defaultdict(set)
+
+    def _poll(self) -> None:
+        """Receive and delete one batch of messages from the queue."""
+        messages = self.sqs.receive_message(
             QueueUrl=QUEUE_URL,
-            MaxNumberOfMessages=1,
+            MaxNumberOfMessages=10,
             WaitTimeSeconds=20,
-        )
+        ).get('Messages', [])
 
-        if 'Messages' in messages:
-            message = messages['Messages'][0]
-            receipt_handle = message['ReceiptHandle']
+        if not messages:
+            return
 
-            # Delete message from queue
-            sqs.delete_message(
-                QueueUrl=QUEUE_URL,
-                ReceiptHandle=receipt_handle
+        # Delete messages from queue
+        self.sqs.delete_message_batch(
+            QueueUrl=QUEUE_URL,
+            Entries=[{'Id': str(idx), 'ReceiptHandle': message['ReceiptHandle']}
+                     for idx, message in enumerate(messages)]
+        )
+
+        for message in messages:
+            # 'Go [run ID]' or 'Round <round> <AZ> [run ID]'
+            fields = message['Body'].split(' ')
+            if fields[0] == 'Go':
+                self.started_runs.append(fields[1] if len(fields) > 1 else None)
+            else:
+                self.arrivals[(fields[3] if len(fields) > 3 else None, int(fields[1]))].add(fields[2])
+
+    def wait_for_go(self, timeout_seconds: Optional[float] = None) -> bool:
+        """Poll the SQS queue until 'Go' arrives for a run that was not measured yet.
+
+        Returns False if none arrived within `timeout_seconds`.
+        """
+        deadline = None if timeout_seconds is None else time.monotonic() + timeout_seconds
+        with instrumentation.span('wait_for_go'):
+            while True:
+                # Redelivered 'Go' messages of finished runs are dropped
+                self.started_runs = [run_id for run_id in self.started_runs if run_id not in self.finished_runs]
+                if self.started_runs:
+                    self.started_runs.clear()
+                    return True
+                if deadline is not None and time.monotonic() >= deadline:
+                    return False
+
+                self._poll()
+
+    def complete_round(self, run_id: Optional[str], round_idx: int, peer_queues: List[str]) -> None:
+        """Announce that this AZ finished the given round and wait for all peers to finish it."""
+        for peer_queue in peer_queues:
+            CLIENTS.client('sqs', queue_region(peer_queue)).send_message(
+                QueueUrl=peer_queue,
+                MessageBody=f'Round {round_idx} {AZ_NAME} {run_id}' if run_id else f'Round {round_idx} {AZ_NAME}'
             )
 
-            assert message['Body'] == 'Go'  # nosec (remove bandit warning)
-            break
+        with instrumentation.span('barrier', round=round_idx):
+            while len(self.arrivals[(run_id, round_idx)]) < len(peer_queues):
+                self._poll()
+
+    def finish_run(self, run_id: Optional[str]) -> None:
+        """Forget the announcements of a finished run and ignore its 'Go' from now on."""
+        self.finished_runs.add(run_id)
+        for key in [key for key in self.arrivals if key[0] == run_id]:
+            del self.arrivals[key]
+
+
+def cpu_seconds() -> float:
+    """Return the CPU time used by this process and its finished children (iperf3), in seconds."""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def run_daemon(partners: List[str]) -> None:
+    """Measure every partner once per period, until the instance is stopped.
+
+    Cycles start every `PERIOD_SECONDS` plus a random jitter, so AZs do not probe in lockstep. Every peer
+    keeps one UDP socket to its echo responder for the whole run. Bandwidth is measured every
+    `BANDWIDTH_EVERY` cycles per peer, at staggered offsets, and retried on the next cycle if the peer's
+    iperf3 server was busy. Samples are buffered and written in batches to the time series table; each
+    cycle logs the CPU time it used and the bytes it sent, to keep the agent's own overhead in check.
+    """
+    series = BatchResultWriter(CLIENTS, SERIES_TABLE_NAME, max_age_seconds=3 * PERIOD_SECONDS)
+    atexit.register(series.close)
+    # Stopping the instance sends SIGTERM; exiting through sys.exit() runs the atexit flushes
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    peers = [partner.split(':') for partner in dict.fromkeys(partners) if partner]
+    sockets: Dict[str, socket.socket] = {}
+    bandwidth_due: Dict[str, int] = {}
+    for ip, _ in peers:
+        sockets[ip] = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sockets[ip].connect((ip, ECHO_PORT))
+        bandwidth_due[ip] = random.randrange(BANDWIDTH_EVERY)
+
+    time.sleep(random.uniform(0, JITTER_SECONDS))
+    started_at = time.monotonic()
+    cycle = 0
+    while True:
+        cycle_start = time.monotonic()
+        cpu_start = cpu_seconds()
+        sent_bytes = 0.0
+        for ip, az_name in peers:
+            try:
+                network_latency, latency_sampling = test_network_latency(ip, az_name, sockets[ip])
+            except (OSError, ValueError) as error:
+                # e.g. no echo replies while the peer's responder restarts; the peer is retried next cycle
+                sys.stderr.write(f'Cycle {cycle}: latency to {az_name} failed: {error}\n')
+                instrumentation.count('latency_failures', to=az_name)
+                continue
+            sent_bytes += network_latency.sent * PACKET_FORMAT.size
+
+            bandwidth = None
+            if cycle >= bandwidth_due[ip]:
+                try:
+                    with instrumentation.span('pair_bandwidth', to=az_name):
+                        bandwidth = measure_bandwidth(ip, DAEMON_BANDWIDTH_SAMPLING, streams=BANDWIDTH_STREAMS)
+                except (OSError, ValueError) as error:
+                    sys.stderr.write(f'Cycle {cycle}: bandwidth to {az_name} skipped: {error}\n')
+                    instrumentation.count('bandwidth_skipped', to=az_name)
+                else:
+                    bandwidth_due[ip] = cycle + BANDWIDTH_EVERY
+                    sent_bytes += sum(interval.bits_per_second * (interval.end - interval.start)
+                                      for interval in bandwidth.intervals) / 8
+
+            item = result_item(network_latency, latency_sampling, bandwidth)
+            item.update({
+                'availability_zone_pair': f'{AZ_NAME}|{az_name}',
+                'expires_at': int(time.time()) + SERIES_RETENTION_SECONDS,
+            })
+            series.add(item)
+
+        cpu_used = cpu_seconds() - cpu_start
+        sys.stdout.write(f'Cycle {cycle}: {len(peers)} peers in {time.monotonic() - cycle_start:.1f}s, '
+                         f'{cpu_used:.2f}s CPU ({cpu_used / PERIOD_SECONDS:.2%} of the period), '
+                         f'{sent_bytes / 2**20:.2f} MiB sent\n')
+        sys.stdout.flush()
+        instrumentation.count('daemon_cpu_seconds', cpu_used)
+        instrumentation.count('daemon_sent_bytes', sent_bytes)
+        instrumentation.flush()
+
+        cycle += 1
+        next_start = started_at + cycle * PERIOD_SECONDS + random.uniform(0, JITTER_SECONDS)
+        time.sleep(max(0.0, next_start - time.monotonic()))
+
+
+def report_usage() -> None:
+    """Flush the result writers and log what batching saved and the API calls made so far."""
+    RESULTS.close()
+    if PROGRESS is not None:
+        PROGRESS.close()
+    sys.stdout.write(f'{sum(CLIENTS.api_calls.values())} API calls through shared clients: '
+                     f'{dict(CLIENTS.api_calls)}\n')
+    sys.stdout.flush()
+    instrumentation.flush()
+
+
+def measure_run(barrier: RoundBarrier) -> None:
+    """Measure every pair of the seeded instructions, synchronizing every round with the partners."""
+    az_rounds, round_peer_queues, final_peer_queues, is_leader, run_id = read_from_dynamodb_table()
+    if MODE == 'daemon':
+        run_daemon(az_rounds)
+
+    progress = {}
+    if run_id and PROGRESS is not None:
+        progress = read_run_progress(CLIENTS.resource('dynamodb', 'us-east-1').Table(PROGRESS_TABLE_NAME),
+                                     run_id, AZ_NAME)
+
+    for round_idx, partner in enumerate(az_rounds):
+        if partner:
+            ip, az_name = partner.split(':')
+            pair_progress = progress.get(pair_key(AZ_NAME, az_name), {})
+            if pair_progress.get('status') == PAIR_DONE:
+                sys.stdout.write(f'Pair {AZ_NAME} -> {az_name} is already done in run {run_id}.\n')
+            else:
+                # A failing pair is recorded and skipped, so that the rest of the run goes on
+                succeeded, attempts, error = measure_pair(ip, az_name)
+                if run_id and PROGRESS is not None:
+                    PROGRESS.add(progress_item(run_id, AZ_NAME, az_name, PAIR_DONE if succeeded else PAIR_FAILED,
+                                               int(pair_progress.get('attempts', 0)) + attempts, error))
+
+        # Results must be durable before the region can be reported as done
+        if round_idx == len(az_rounds) - 1:
+            RESULTS.flush()
+            if PROGRESS is not None:
+                PROGRESS.flush()
+
+        barrier.complete_round(run_id, round_idx, round_peer_queues[round_idx])
+
+        # Lets the coordinator tell a slow region from a stalled one
+        if is_leader and round_idx < len(az_rounds) - 1:
+            report_progress(round_idx + 1, len(az_rounds), run_id)
+
+    # The region can only be torn down once all of its AZs are done
+    if final_peer_queues:
+        barrier.complete_round(run_id, len(az_rounds), final_peer_queues)
+
+    if is_leader:
+        trigger_done(run_id)
+
+    barrier.finish_run(run_id)
+    # Reported after every run, as the agent then waits for the next one until the instance is torn down
+    report_usage()
 
 
 if __name__ == '__main__':
-    poll_sqs_queue()
-
-    az_ips, az_names, next_az_queue = read_from_dynamodb_table()
-    for ip, az_name in zip(az_ips, az_names):
-        network_latency = test_network_latency(ip)
-        bandwidth = test_bandwidth(ip)
-
-        write_to_dynamodb(az_name, network_latency, bandwidth)
+    round_barrier = RoundBarrier()
+    round_barrier.wait_for_go()
+    measure_run(round_barrier)
 
-    if next_az_queue == 'DONE':
-        trigger_done()
-    else:
-        trigger_next_az(next_az_queue)
+    # The next shard of the global plan may be seeded onto the same instances, until they are torn down
+    while round_barrier.wait_for_go(NEXT_RUN_WAIT_SECONDS):
+        measure_run(round_barrier)